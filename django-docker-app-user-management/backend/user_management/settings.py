@@ -3,6 +3,7 @@ Django settings for user_management project.
 """
 
 from pathlib import Path
+from corsheaders.defaults import default_headers
 from decouple import config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -80,6 +81,45 @@ DATABASES = {
 }
 
 
+# Cache
+# Redis when REDIS_URL is set and the redis package is installed, otherwise
+# CACHE_BACKEND picks local memory (per process) or files shared by all processes
+REDIS_URL = config('REDIS_URL', default='')
+CACHE_BACKEND = config('CACHE_BACKEND', default='locmem')
+
+try:
+    import redis  # noqa: F401
+except ImportError:
+    redis = None
+
+if REDIS_URL and redis is not None:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+elif CACHE_BACKEND == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': config('CACHE_DIR', default=str(BASE_DIR / 'cache')),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'user-management',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+
+# Cache used for users list and detail responses, and how long they are kept (seconds)
+USERS_CACHE_ALIAS = 'default'
+USERS_CACHE_TIMEOUT = config('USERS_CACHE_TIMEOUT', default=300, cast=int)
+
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -122,15 +162,34 @@ CORS_ALLOWED_ORIGINS = config(
 
 CORS_ALLOW_CREDENTIALS = True
 
+# Conditional requests: the frontend reads ETag and sends If-Match on updates
+CORS_ALLOW_HEADERS = (*default_headers, 'if-match', 'if-none-match')
+CORS_EXPOSE_HEADERS = ['ETag', 'Last-Modified']
+
 # REST Framework Settings
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        'users.renderers.ORJSONRenderer',
     ],
     'DEFAULT_PARSER_CLASSES': [
         'rest_framework.parsers.JSONParser',
     ],
 }
 
+# Largest list accepted by the /api/users/bulk/ endpoints
+USERS_BULK_MAX_ITEMS = config('USERS_BULK_MAX_ITEMS', default=10000, cast=int)
+
+# Change feed (/api/users/changes/): rows are reported once they are this many seconds old,
+# a long poll waits at most this long, and tombstones of deleted users are kept this many days
+USERS_CHANGES_SETTLE_SECONDS = config('USERS_CHANGES_SETTLE_SECONDS', default=1.0, cast=float)
+USERS_CHANGES_MAX_WAIT = config('USERS_CHANGES_MAX_WAIT', default=30, cast=int)
+USERS_CHANGES_RETENTION_DAYS = config('USERS_CHANGES_RETENTION_DAYS', default=30, cast=int)
+
+# Uploaded CSV files are kept here while they are imported
+USERS_IMPORT_DIR = Path(config('USERS_IMPORT_DIR', default=str(BASE_DIR / 'imports')))
+
+# A 10k user bulk request is a few MB of JSON
+DATA_UPLOAD_MAX_MEMORY_SIZE = config('DATA_UPLOAD_MAX_MEMORY_SIZE', default=10 * 1024 * 1024, cast=int)
+
@@ -1,5 +1,9 @@
 from django.contrib import admin
-from .models import User
+from django.db import transaction
+
+from . import cache
+from .changes import record_deletes
+from .models import User, UserImport
 
 
 @admin.register(User)
@@ -9,3 +13,28 @@ class UserAdmin(admin.ModelAdmin):
     list_filter = ['created_at', 'updated_at']
     readonly_fields = ['created_at', 'updated_at']
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        cache.invalidate([obj.pk])
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            pk = obj.pk
+            super().delete_model(request, obj)
+            # Deletions made here show up in the change feed too
+            record_deletes([pk])
+        cache.invalidate([pk])
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            ids = list(queryset.values_list('id', flat=True))
+            super().delete_queryset(request, queryset)
+            record_deletes(ids)
+        cache.invalidate(ids)
+
+
+@admin.register(UserImport)
+class UserImportAdmin(admin.ModelAdmin):
+    list_display = ['id', 'filename', 'status', 'rows_processed', 'created_count', 'invalid_count', 'created_at']
+    list_filter = ['status']
+    readonly_fields = [field.name for field in UserImport._meta.fields]
@@ -0,0 +1,198 @@
+"""
+Bulk create, update and delete of users.
+
+Each operation validates the whole batch first, checks email uniqueness with
+a single IN query, and writes everything in one transaction. Nothing is
+written when any item fails; the errors are reported per item by index.
+
+Emails are compared case-folded: the unique index on MySQL uses a
+case-insensitive collation, so A@x.com and a@x.com are the same email there.
+"""
+from collections import defaultdict
+
+from django.db import IntegrityError, connections, transaction
+from django.db.models.functions import Collate
+
+from . import cache
+from .changes import record_deletes, stamp_updated
+from .models import User
+from .serializers import UserBulkSerializer
+
+BATCH_SIZE = 1000
+
+# bulk_update writes one CASE WHEN per row per field, each row scanning the whole CASE; keep batches short
+UPDATE_BATCH_SIZE = 200
+
+EMAIL_TAKEN = 'A user with this email already exists.'
+EMAIL_REPEATED = 'This email appears more than once in the request.'
+
+
+class BulkError(Exception):
+    """
+    Raised when a batch is rejected; errors is a list of {'index': ..., 'errors': {...}}.
+    """
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+
+def _item_errors(serializer_errors):
+    return [{'index': index, 'errors': errors} for index, errors in enumerate(serializer_errors) if errors]
+
+
+def _email_errors(emails_by_index, owners):
+    """
+    Report emails repeated within the batch, and emails owned by another user.
+    owners maps email -> id of the user that has it; emails_by_index maps
+    index -> (email, id of the user being written or None).
+    """
+    errors = []
+    first_index = {}
+    for index, (email, user_id) in emails_by_index.items():
+        email = email.casefold()
+        if email in first_index:
+            errors.append({'index': index, 'errors': {'email': [EMAIL_REPEATED]}})
+            continue
+        first_index[email] = index
+        owner = owners.get(email)
+        if owner is not None and owner != user_id:
+            errors.append({'index': index, 'errors': {'email': [EMAIL_TAKEN]}})
+    return errors
+
+
+def email_owners(emails):
+    """
+    Map the case-folded email of every user that has one of emails to its id.
+    """
+    queryset = User.objects.all()
+    if connections[queryset.db].vendor == 'sqlite':
+        # MySQL's collation already ignores case; SQLite compares with its NOCASE index on email
+        queryset = queryset.alias(email_nocase=Collate('email', 'NOCASE')).filter(email_nocase__in=emails)
+    else:
+        queryset = queryset.filter(email__in=emails)
+    return {email.casefold(): pk for email, pk in queryset.order_by().values_list('email', 'id')}
+
+
+def _write(write, emails_by_index):
+    """
+    Run write in a transaction and return its result. An email taken between the check and the write
+    makes the unique index reject the batch; report it like the check would.
+    """
+    try:
+        with transaction.atomic():
+            return write()
+    except IntegrityError:
+        emails = [email for email, _ in emails_by_index.values()]
+        raise BulkError(_email_errors(emails_by_index, email_owners(emails)) or [
+            {'index': None, 'errors': {'email': [EMAIL_TAKEN]}}
+        ])
+
+
+def bulk_create_users(items):
+    """
+    Create users from a list of dicts, returns the created users.
+    """
+    serializer = UserBulkSerializer(data=items, many=True)
+    if not serializer.is_valid():
+        raise BulkError(_item_errors(serializer.errors))
+
+    rows = serializer.validated_data
+    emails_by_index = {index: (row['email'], None) for index, row in enumerate(rows)}
+    errors = _email_errors(emails_by_index, email_owners([row['email'] for row in rows]))
+    if errors:
+        raise BulkError(errors)
+
+    def write():
+        User.objects.bulk_create([User(**row) for row in rows], batch_size=BATCH_SIZE)
+        stamp_updated(User.objects.filter(email__in=[row['email'] for row in rows]))
+
+    _write(write, emails_by_index)
+    cache.invalidate()
+
+    # MySQL does not return the new primary keys, read the rows back by email
+    return list(User.objects.filter(email__in=[row['email'] for row in rows]).order_by('id'))
+
+
+def bulk_update_users(items):
+    """
+    Partially update users from a list of dicts that each carry an id, returns the updated users.
+    """
+    errors = []
+    ids = []
+    for index, item in enumerate(items):
+        user_id = item.get('id') if isinstance(item, dict) else None
+        if not isinstance(user_id, int) or isinstance(user_id, bool):
+            errors.append({'index': index, 'errors': {'id': ['A valid integer is required.']}})
+        ids.append(user_id)
+    if errors:
+        raise BulkError(errors)
+
+    # id is read-only on the serializer, so the items validate as they are
+    serializer = UserBulkSerializer(data=items, many=True, partial=True)
+    if not serializer.is_valid():
+        raise BulkError(_item_errors(serializer.errors))
+    validated = serializer.validated_data
+    emails_by_index = {index: (data['email'], ids[index]) for index, data in enumerate(validated) if 'email' in data}
+
+    def write():
+        # Locked until the commit, like a single update, so concurrent writes to these users are not overwritten
+        users = User.objects.select_for_update().in_bulk(ids)
+        errors = []
+        seen = set()
+        for index, user_id in enumerate(ids):
+            if user_id not in users:
+                errors.append({'index': index, 'errors': {'id': ['User not found.']}})
+            elif user_id in seen:
+                errors.append({'index': index, 'errors': {'id': ['This user appears more than once in the request.']}})
+            seen.add(user_id)
+        if errors:
+            raise BulkError(errors)
+
+        errors = _email_errors(emails_by_index, email_owners([email for email, _ in emails_by_index.values()]))
+        if errors:
+            raise BulkError(errors)
+
+        # Each row only gets the fields its own item supplied: one bulk_update per set of fields
+        groups = defaultdict(list)
+        for user_id, data in zip(ids, validated):
+            user = users[user_id]
+            for field, value in data.items():
+                setattr(user, field, value)
+            if data:
+                groups[tuple(sorted(data))].append(user)
+        for fields, group in groups.items():
+            User.objects.bulk_update(group, fields, batch_size=UPDATE_BATCH_SIZE)
+        # bulk_update skips auto_now; one plain UPDATE sets updated_at instead of another CASE column
+        stamp_updated(User.objects.filter(id__in=ids))
+        return users
+
+    users = _write(write, emails_by_index)
+    cache.invalidate(ids)
+    for user_id, updated_at in User.objects.filter(id__in=ids).values_list('id', 'updated_at'):
+        users[user_id].updated_at = updated_at
+    return [users[user_id] for user_id in ids]
+
+
+def bulk_delete_users(ids):
+    """
+    Delete users by id, returns the number deleted.
+    """
+    errors = [
+        {'index': index, 'errors': {'id': ['A valid integer is required.']}}
+        for index, user_id in enumerate(ids) if not isinstance(user_id, int) or isinstance(user_id, bool)
+    ]
+    if errors:
+        raise BulkError(errors)
+
+    with transaction.atomic():
+        existing = set(User.objects.select_for_update().filter(id__in=ids).values_list('id', flat=True))
+        errors = [
+            {'index': index, 'errors': {'id': ['User not found.']}}
+            for index, user_id in enumerate(ids) if user_id not in existing
+        ]
+        if errors:
+            raise BulkError(errors)
+        deleted, _ = User.objects.filter(id__in=existing).delete()
+        record_deletes(existing)
+    cache.invalidate(existing)
+    return deleted
@@ -0,0 +1,93 @@
+"""
+Versioned response cache for the users endpoints.
+
+Cache keys carry version tokens instead of being deleted on write:
+- every list response key includes the table token, replaced on any write;
+- every detail response key includes the token of that user, replaced when
+  the user is updated or deleted.
+
+A write only replaces tokens, and old entries age out on their own. A read
+that raced with a write stores its result under the token it started with,
+which no later read asks for, so stale data is never served.
+"""
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+TABLE_TOKEN_KEY = 'users:token'
+
+
+def get_cache():
+    return caches[settings.USERS_CACHE_ALIAS]
+
+
+def _new_token():
+    return uuid.uuid4().hex[:12]
+
+
+def _token(key, timeout):
+    """
+    Return the token stored at key, creating one when there is none.
+    """
+    cache = get_cache()
+    token = cache.get(key)
+    if token is None:
+        cache.add(key, _new_token(), timeout=timeout)
+        token = cache.get(key)
+    return token
+
+
+def _user_token_key(pk):
+    return f'users:{pk}:token'
+
+
+def list_key(request):
+    """
+    Key for a list response; the query string (cursor, page size, filters) is part of it.
+    """
+    query = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    return f'users:list:{_token(TABLE_TOKEN_KEY, None)}:{query}'
+
+
+def table_key(name):
+    """
+    Key for a value computed over the whole table, e.g. the list validators.
+    """
+    return f'users:{name}:{_token(TABLE_TOKEN_KEY, None)}'
+
+
+def detail_key(pk, part='response'):
+    # A lost or expired user token only turns into a cache miss, so it need not outlive the responses
+    return f'users:detail:{part}:{pk}:{_token(_user_token_key(pk), settings.USERS_CACHE_TIMEOUT)}'
+
+
+def get_or_build(key, build):
+    """
+    Return the cached response data at key, or call build() and cache its result.
+    """
+    cache = get_cache()
+    data = cache.get(key)
+    if data is None:
+        data = build()
+        cache.set(key, data, settings.USERS_CACHE_TIMEOUT)
+    return data
+
+
+def invalidate(pks=()):
+    """
+    Replace the table token and the tokens of the given users after a write.
+    Inside a transaction this waits for the commit; a read between the new
+    tokens and the commit would cache the old rows under them.
+    """
+    pks = list(pks)
+
+    def replace_tokens():
+        cache = get_cache()
+        if pks:
+            cache.set_many({_user_token_key(pk): _new_token() for pk in pks}, timeout=settings.USERS_CACHE_TIMEOUT)
+        cache.set(TABLE_TOKEN_KEY, _new_token(), timeout=None)
+
+    transaction.on_commit(replace_tokens)
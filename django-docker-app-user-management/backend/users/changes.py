@@ -0,0 +1,176 @@
+"""
+Change feed of the users table: the users created, updated or deleted since a cursor.
+
+Created and updated users are read from users in (updated_at, id) order on the
+users_updated_id_idx index, deleted ones from the tombstones written when users
+are deleted, in (deleted_at, id) order. The cursor holds the position reached
+in each, so a poll is two range scans that only touch what changed since.
+
+updated_at is set when a row is written, not when its transaction commits, so a
+row can become visible with a timestamp older than one already handed out. Rows
+are only reported once they are USERS_CHANGES_SETTLE_SECONDS old, which gives
+transactions in flight that long to commit. Writes that take longer, like bulk
+writes and import chunks, stamp updated_at with stamp_updated() as their last
+statement, so only that statement and the commit have to fit in the delay.
+"""
+import base64
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.db.models.functions import Now
+from django.utils import timezone
+
+from .models import User, UserTombstone
+from .serializers import USER_FIELDS, serialize_user_rows
+
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# ?since= value for a cursor at the current end of the feed
+LATEST = 'latest'
+
+# Seconds between two looks at the tables during a long poll
+POLL_INTERVAL = 0.5
+
+
+class UTCNow(Now):
+    """
+    The database's current time. MySQL's CURRENT_TIMESTAMP is in the session
+    time zone, while Django stores datetimes there in UTC.
+    """
+    def as_mysql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template='UTC_TIMESTAMP(6)', **extra_context)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class CursorExpired(Exception):
+    """
+    Raised for a cursor older than the tombstones that are kept; the client has to reload.
+    """
+
+
+def record_deletes(ids):
+    """
+    Write tombstones for deleted users, in the transaction that deletes them.
+    """
+    UserTombstone.objects.bulk_create([UserTombstone(user_id=pk) for pk in ids], batch_size=1000)
+
+
+def stamp_updated(queryset):
+    """
+    Set updated_at of the queryset's users to the database time, as the last statement before the commit.
+    """
+    queryset.update(updated_at=UTCNow())
+
+
+def prune_tombstones(days=None):
+    """
+    Delete tombstones older than the retention period, returns the number deleted.
+    """
+    days = settings.USERS_CHANGES_RETENTION_DAYS if days is None else days
+    deleted, _ = UserTombstone.objects.filter(deleted_at__lt=timezone.now() - timedelta(days=days)).delete()
+    return deleted
+
+
+def horizon():
+    """
+    Rows changed after this time are left for a later poll.
+    """
+    return timezone.now() - timedelta(seconds=settings.USERS_CHANGES_SETTLE_SECONDS)
+
+
+def latest_cursor():
+    """
+    A cursor at the current end of the feed, for a client that has just loaded the users.
+    """
+    position = (horizon(), 0)
+    return encode_cursor(position, position)
+
+
+def encode_cursor(users_position, deletes_position):
+    parts = []
+    for position in (users_position, deletes_position):
+        parts.extend((position[0].isoformat(), str(position[1])) if position else ('', ''))
+    return base64.urlsafe_b64encode('|'.join(parts).encode('ascii')).decode('ascii')
+
+
+def decode_cursor(encoded):
+    """
+    Return the (users, deletes) positions of a cursor; a missing cursor starts from the beginning.
+    """
+    if not encoded:
+        return None, None
+    try:
+        value = base64.urlsafe_b64decode(encoded.encode('ascii')).decode('ascii')
+        users_at, users_id, deletes_at, deletes_id = value.split('|')
+        positions = tuple(
+            (datetime.fromisoformat(at), int(pk)) if at else None
+            for at, pk in ((users_at, users_id), (deletes_at, deletes_id))
+        )
+    except (TypeError, ValueError, UnicodeError):
+        raise InvalidCursor('Invalid cursor')
+    if any(position and timezone.is_naive(position[0]) for position in positions):
+        raise InvalidCursor('Invalid cursor')
+    return positions
+
+
+def _after(queryset, field, position, until, limit):
+    """
+    Up to limit + 1 rows of queryset changed after position and no later than until, oldest first.
+    """
+    queryset = queryset.filter(**{f'{field}__lte': until}).order_by(field, 'id')
+    if position is not None:
+        changed_at, pk = position
+        # As in UserCursorPagination, the redundant >= bound lets the database seek into the index
+        queryset = queryset.filter(**{f'{field}__gte': changed_at}).filter(
+            Q(**{f'{field}__gt': changed_at}) | Q(id__gt=pk)
+        )
+    return list(queryset[:limit + 1])
+
+
+def _advance(rows, field, position, until, limit):
+    """
+    Return (rows, position, truncated) for the rows read by _after.
+    """
+    truncated = len(rows) > limit
+    rows = rows[:limit]
+    if rows:
+        position = (rows[-1][field], rows[-1]['id'])
+    if not truncated:
+        # Everything up to until has been read; moving the position there keeps the next poll's range short
+        position = max(position, (until, 0)) if position else (until, 0)
+    return rows, position, truncated
+
+
+def read_changes(since=None, fields=USER_FIELDS, limit=PAGE_SIZE):
+    """
+    Return a dict with the users created or updated since the cursor (`updated`,
+    restricted to fields), the ids of users deleted since (`deleted`), the
+    cursor to read the next changes from (`cursor`), and whether more changes
+    are already waiting (`has_more`).
+    """
+    users_position, deletes_position = decode_cursor(since)
+    oldest = timezone.now() - timedelta(days=settings.USERS_CHANGES_RETENTION_DAYS)
+    if deletes_position is not None and deletes_position[0] < oldest:
+        raise CursorExpired('Cursor expired, reload the users')
+
+    until = horizon()
+    # The position needs id and updated_at even when they are not returned
+    columns = [field for field in USER_FIELDS if field in fields or field in ('id', 'updated_at')]
+    users = _after(User.objects.values(*columns), 'updated_at', users_position, until, limit)
+    users, users_position, users_truncated = _advance(users, 'updated_at', users_position, until, limit)
+    tombstones = _after(UserTombstone.objects.values('id', 'user_id', 'deleted_at'), 'deleted_at',
+                        deletes_position, until, limit)
+    tombstones, deletes_position, deletes_truncated = _advance(tombstones, 'deleted_at', deletes_position, until, limit)
+
+    cursor = encode_cursor(users_position, deletes_position)
+    return {
+        'updated': serialize_user_rows(users, fields),
+        'deleted': [tombstone['user_id'] for tombstone in tombstones],
+        'cursor': cursor,
+        'has_more': users_truncated or deletes_truncated,
+    }
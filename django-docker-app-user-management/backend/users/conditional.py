@@ -0,0 +1,97 @@
+"""
+ETag and Last-Modified validators for the users endpoints.
+
+Validators come from updated_at: a user's own for detail responses, and for
+the list the latest updated_at or deletion time (the tombstones of the
+change feed) plus the row count. They are computed
+without serializing anything and cached under the same version tokens as
+the responses, so a request the client already has the answer to is
+answered with 304 before the response is built.
+"""
+import hashlib
+from calendar import timegm
+
+from django.db.models import Count, Max
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from rest_framework import status
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+
+from . import cache
+from .models import User, UserTombstone
+from .serializers import USER_FIELDS
+
+
+def _timestamp(value):
+    return timegm(value.utctimetuple()) if value else None
+
+
+def user_validators(pk, updated_at, fields=USER_FIELDS):
+    """
+    (etag, last_modified) for a user; a sparse fieldset is a representation of its own.
+    """
+    etag = f'{pk}-{updated_at.timestamp():.6f}'
+    if fields != USER_FIELDS:
+        etag += '-' + '.'.join(fields)
+    return quote_etag(etag), _timestamp(updated_at)
+
+
+def detail_validators(pk, fields=USER_FIELDS):
+    """
+    (etag, last_modified) for user pk, raising NotFound when there is no such user.
+    """
+    def build():
+        return User.objects.filter(pk=pk).values_list('updated_at', flat=True).first()
+
+    # A missing user comes back as None, which get_or_build does not cache
+    updated_at = cache.get_or_build(cache.detail_key(pk, 'validators'), build)
+    if updated_at is None:
+        raise NotFound()
+    return user_validators(pk, updated_at, fields)
+
+
+def list_validators(request):
+    """
+    (etag, last_modified) for a page of the users list.
+    """
+    def build():
+        table = User.objects.aggregate(latest=Max('updated_at'), count=Count('id'))
+        # A delete does not move the latest updated_at, its tombstone does
+        deleted = UserTombstone.objects.aggregate(latest=Max('deleted_at'))['latest']
+        table['latest'] = max(filter(None, (table['latest'], deleted)), default=None)
+        return table
+
+    table = cache.get_or_build(cache.table_key('validators'), build)
+    latest = table['latest']
+    # Each page and filter is its own representation
+    value = f"{latest.timestamp() if latest else 0:.6f}-{table['count']}-{request.get_full_path()}"
+    return quote_etag(hashlib.md5(value.encode()).hexdigest()), _timestamp(latest)
+
+
+def evaluate_preconditions(request, etag, last_modified):
+    """
+    Return a 304 or 412 response when the request's conditional headers call for one, else None.
+    """
+    current = set_validators(HttpResponse(), etag, last_modified)
+    response = get_conditional_response(request, etag, last_modified, current)
+    if response is current:
+        return None
+    if response.status_code == status.HTTP_412_PRECONDITION_FAILED:
+        return Response({
+            'success': False,
+            'message': 'The user was changed since it was fetched'
+        }, status=status.HTTP_412_PRECONDITION_FAILED)
+    return response
+
+
+def set_validators(response, etag, last_modified):
+    """
+    Add ETag and Last-Modified to a response; clients must revalidate before reusing it.
+    """
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, no_cache=True)
+    return response
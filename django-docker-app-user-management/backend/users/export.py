@@ -0,0 +1,72 @@
+"""
+Streaming export of the users table as NDJSON or CSV.
+
+Rows are read in keyset chunks ordered by id (WHERE id > last id LIMIT n),
+and each chunk is written out before the next one is fetched. mysqlclient
+buffers a whole result set client-side even under QuerySet.iterator(), so
+chunked queries are what keeps memory flat on MySQL.
+"""
+import csv
+import io
+
+import orjson
+
+from .models import User
+from .serializers import USER_DATETIME_FIELDS, USER_FIELDS as FIELDS, format_datetimes
+
+CHUNK_SIZE = 2000
+
+
+def iter_chunks(queryset, fields=FIELDS, chunk_size=CHUNK_SIZE):
+    """
+    Yield lists of value tuples for fields, chunk_size rows at a time, in id order.
+    """
+    # id is always read, it is the position of the next chunk
+    columns = fields if 'id' in fields else ('id', *fields)
+    output = slice(0 if 'id' in fields else 1, None)
+    datetime_positions = [columns.index(field) for field in USER_DATETIME_FIELDS if field in columns]
+    queryset = queryset.order_by('id').values_list(*columns)
+    last_id = 0
+    while True:
+        rows = list(queryset.filter(id__gt=last_id)[:chunk_size])
+        if not rows:
+            return
+        last_id = rows[-1][columns.index('id')]
+        values = list(zip(*rows))
+        for position in datetime_positions:
+            values[position] = format_datetimes(values[position])
+        yield list(zip(*values[output]))
+        if len(rows) < chunk_size:
+            return
+
+
+def ndjson_lines(queryset=None, fields=FIELDS, chunk_size=CHUNK_SIZE):
+    """
+    Yield the users as newline-delimited JSON objects, one bytestring per chunk.
+    """
+    queryset = User.objects.all() if queryset is None else queryset
+    for rows in iter_chunks(queryset, fields, chunk_size):
+        yield b''.join(orjson.dumps(dict(zip(fields, row)), option=orjson.OPT_APPEND_NEWLINE) for row in rows)
+
+
+def csv_lines(queryset=None, fields=FIELDS, chunk_size=CHUNK_SIZE):
+    """
+    Yield the users as CSV with a header row, one string per chunk.
+    """
+    queryset = User.objects.all() if queryset is None else queryset
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    yield buffer.getvalue()
+    for rows in iter_chunks(queryset, fields, chunk_size):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue()
+
+
+# Content type, file extension and row writer per export type
+EXPORT_TYPES = {
+    'ndjson': ('application/x-ndjson', 'ndjson', ndjson_lines),
+    'csv': ('text/csv', 'csv', csv_lines),
+}
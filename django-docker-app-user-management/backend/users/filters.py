@@ -0,0 +1,87 @@
+"""
+Search and filters for the users list and export.
+
+Every filter is written so the database can answer it from an index:
+- exact matches and prefixes are case-insensitive (iexact, istartswith),
+  a plain LIKE 'abc' / LIKE 'abc%' on MySQL. The case-sensitive lookups
+  become LIKE BINARY there and cannot use the case-insensitive indexes.
+- ?q= picks the one column that fits what was typed: an email prefix when it
+  contains @, a phone prefix when it is made of digits, otherwise the name,
+  through the FULLTEXT index on MySQL.
+
+Check the plans with `python manage.py check_user_query_plans`.
+"""
+import re
+
+from django.db import NotSupportedError, connections
+from django.db.models import Lookup
+
+from .models import User
+
+# Query parameter -> (field, lookup)
+FILTERS = {
+    'name': ('name', 'iexact'),
+    'email': ('email', 'iexact'),
+    'phone': ('phone', 'iexact'),
+    'name_prefix': ('name', 'istartswith'),
+    'email_prefix': ('email', 'istartswith'),
+    'phone_prefix': ('phone', 'istartswith'),
+}
+
+PHONE_PATTERN = re.compile(r'^\+?[\d\s().-]+$')
+
+# InnoDB skips words shorter than innodb_ft_min_token_size (3 by default)
+FULLTEXT_MIN_WORD_LENGTH = 3
+
+
+class FullTextMatch(Lookup):
+    """
+    name__fulltext='john sm' matches rows whose name has words starting with
+    every given word, using a MySQL FULLTEXT index on the column.
+    """
+    lookup_name = 'fulltext'
+
+    def as_mysql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        words = re.findall(r'\w+', self.rhs)
+        query = ' '.join(f'+{word}*' for word in words)
+        return f'MATCH ({lhs}) AGAINST (%s IN BOOLEAN MODE)', [*lhs_params, query]
+
+    def as_sql(self, compiler, connection):
+        raise NotSupportedError('Full-text search is only available on MySQL')
+
+
+# Only users.name has a FULLTEXT index (on MySQL, migration 0004)
+User._meta.get_field('name').register_lookup(FullTextMatch)
+
+
+def search(queryset, q):
+    """
+    Narrow the queryset to users matching the free-text search q.
+    """
+    q = q.strip()
+    if not q:
+        return queryset
+    if '@' in q:
+        return queryset.filter(email__istartswith=q)
+    if PHONE_PATTERN.match(q):
+        return queryset.filter(phone__istartswith=q)
+
+    words = re.findall(r'\w+', q)
+    vendor = connections[queryset.db].vendor
+    if vendor == 'mysql' and words and all(len(word) >= FULLTEXT_MIN_WORD_LENGTH for word in words):
+        return queryset.filter(name__fulltext=q)
+    return queryset.filter(name__istartswith=q)
+
+
+def filter_users(queryset, params):
+    """
+    Apply ?q= and the FILTERS query parameters to a users queryset.
+    """
+    for param, (field, lookup) in FILTERS.items():
+        value = params.get(param)
+        if value:
+            queryset = queryset.filter(**{f'{field}__{lookup}': value})
+    if 'q' in params:
+        queryset = search(queryset, params['q'])
+    return queryset
@@ -0,0 +1,173 @@
+"""
+Streaming CSV import of users.
+
+The file is read row by row and handled in chunks of CHUNK_SIZE: each chunk
+is validated with the UserSerializer rules, checked against existing emails
+with one IN query and inserted with bulk_create. Memory use depends on the
+chunk size, not on the size of the file, and the UserImport record is
+updated after every chunk so clients can poll the progress.
+"""
+import csv
+import io
+import threading
+from datetime import timedelta
+
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from . import cache
+from .bulk import email_owners
+from .changes import stamp_updated
+from .models import User, UserImport
+from .serializers import UserBulkSerializer
+
+CHUNK_SIZE = 1000
+
+# Only the first errors are kept on the job record
+MAX_REPORTED_ERRORS = 100
+
+COLUMNS = ('name', 'email', 'phone')
+
+# The job record is saved after every chunk; one left running this long without progress lost its thread
+STALE_AFTER = timedelta(minutes=5)
+
+
+class ImportFileError(Exception):
+    """
+    Raised when the file cannot be imported at all, e.g. missing columns.
+    """
+
+
+def read_rows(stream):
+    """
+    Yield (line number, row dict) from a binary CSV stream, decoding as UTF-8.
+    """
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    missing = [column for column in COLUMNS if column not in (reader.fieldnames or [])]
+    if missing:
+        raise ImportFileError(f"Missing column(s): {', '.join(missing)}")
+    for row in reader:
+        yield reader.line_num, {column: row[column] or '' for column in COLUMNS}
+
+
+def import_chunk(serializer, rows):
+    """
+    Validate and insert one chunk of (line, row) pairs.
+    Returns (created, duplicates, errors) where errors is a list of {'line': ..., 'errors': {...}}.
+    """
+    valid = {}
+    errors = []
+    duplicates = 0
+    for line, row in rows:
+        try:
+            data = serializer.run_validation(row)
+        except serializers.ValidationError as e:
+            detail = {field: [str(message) for message in messages] for field, messages in e.detail.items()}
+            errors.append({'line': line, 'errors': detail})
+            continue
+        # Case-folded, as the unique email index compares them on MySQL
+        email = data['email'].casefold()
+        if email in valid:
+            duplicates += 1
+        else:
+            valid[email] = data
+
+    emails = [data['email'] for data in valid.values()]
+    owners = email_owners(emails)
+    while True:
+        new_users = [User(**data) for email, data in valid.items() if email not in owners]
+        try:
+            with transaction.atomic():
+                User.objects.bulk_create(new_users, batch_size=CHUNK_SIZE)
+                stamp_updated(User.objects.filter(email__in=[user.email for user in new_users]))
+            break
+        except IntegrityError:
+            # Someone else created some of these users since the check; skip them and insert the rest
+            taken = email_owners(emails)
+            if len(taken) == len(owners):
+                raise
+            owners = taken
+    if new_users:
+        cache.invalidate()
+    return len(new_users), duplicates + len(valid) - len(new_users), errors
+
+
+def run_import(job, stream, chunk_size=CHUNK_SIZE):
+    """
+    Import users from a binary CSV stream, recording progress on the UserImport job.
+    """
+    job.status = UserImport.RUNNING
+    job.save(update_fields=['status', 'updated_at'])
+
+    # One serializer for the whole file, so its fields are only built once
+    serializer = UserBulkSerializer()
+    chunk = []
+
+    def flush():
+        created, duplicates, errors = import_chunk(serializer, chunk)
+        job.rows_processed += len(chunk)
+        job.created_count += created
+        job.duplicate_count += duplicates
+        job.invalid_count += len(errors)
+        job.errors.extend(errors[:MAX_REPORTED_ERRORS - len(job.errors)])
+        job.save(update_fields=[
+            'rows_processed', 'created_count', 'duplicate_count', 'invalid_count', 'errors', 'updated_at'
+        ])
+        chunk.clear()
+
+    try:
+        for line, row in read_rows(stream):
+            chunk.append((line, row))
+            if len(chunk) >= chunk_size:
+                flush()
+        if chunk:
+            flush()
+    except (ImportFileError, UnicodeDecodeError, csv.Error) as e:
+        job.status = UserImport.FAILED
+        job.message = str(e)
+    except Exception as e:
+        job.status = UserImport.FAILED
+        job.message = f'Import stopped: {e}'
+        raise
+    else:
+        job.status = UserImport.COMPLETED
+        job.message = f'{job.created_count} users imported'
+    finally:
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'message', 'finished_at', 'updated_at'])
+    return job
+
+
+def fail_if_stale(job):
+    """
+    Mark a pending or running job as failed when it has not progressed for
+    STALE_AFTER, e.g. because the process running it was restarted.
+    """
+    now = timezone.now()
+    if job.status not in (UserImport.PENDING, UserImport.RUNNING) or job.updated_at > now - STALE_AFTER:
+        return job
+    # Conditional on updated_at, so a job that has just saved progress is left alone
+    UserImport.objects.filter(pk=job.pk, updated_at=job.updated_at).update(
+        status=UserImport.FAILED, message='Import stopped: the server was restarted', finished_at=now, updated_at=now
+    )
+    job.refresh_from_db()
+    return job
+
+
+def start_import(job, path):
+    """
+    Run the import of the CSV file at path in a background thread; the file is removed afterwards.
+    """
+    def run():
+        try:
+            with open(path, 'rb') as stream:
+                run_import(job, stream)
+        finally:
+            path.unlink(missing_ok=True)
+            # The thread's own database connection is not closed by the request cycle
+            connection.close()
+
+    thread = threading.Thread(target=run, name=f'user-import-{job.pk}', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,99 @@
+import json
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from rest_framework.request import Request
+
+from users.filters import filter_users
+from users.models import User
+from users.pagination import UserCursorPagination
+
+# MySQL access types that read the whole table or a whole index
+MYSQL_FULL_SCANS = {'ALL', 'index'}
+
+# Index matching the list ordering; the unfiltered first page may scan it since LIMIT ends the scan
+ORDERING_INDEX = 'users_created_id_idx'
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN the users list queries for every search and filter, and fail if any reads the whole table'
+
+    def cases(self, sample):
+        """
+        (description, query parameters) for every filter, with values taken from a sample user.
+        """
+        words = sample.name.split()
+        return [
+            # Reads the ordering index from the top and stops after one page
+            ('first page', {}),
+            ('later page', {'cursor': UserCursorPagination().encode_cursor((sample.created_at, sample.pk))}),
+            ('name', {'name': sample.name}),
+            ('email', {'email': sample.email}),
+            ('phone', {'phone': sample.phone}),
+            ('name_prefix', {'name_prefix': sample.name[:3]}),
+            ('email_prefix', {'email_prefix': sample.email[:3]}),
+            ('phone_prefix', {'phone_prefix': sample.phone[:4]}),
+            ('q (name)', {'q': words[0] if words else sample.name}),
+            ('q (email)', {'q': sample.email.split('@')[0] + '@'}),
+            ('q (phone)', {'q': sample.phone[:4]}),
+        ]
+
+    def page_queryset(self, params):
+        """
+        The query the list endpoint runs for a page with these parameters.
+        """
+        request = Request(RequestFactory().get('/api/users/', params))
+        queryset = filter_users(User.objects.all(), request.query_params)
+        return UserCursorPagination().get_page_queryset(queryset, request)
+
+    def explain(self, queryset):
+        """
+        Return (index used, whether the table or index is read in full).
+        """
+        if connection.vendor == 'mysql':
+            plan = json.loads(queryset.explain(format='json'))
+            tables = []
+
+            def collect(node):
+                if isinstance(node, dict):
+                    if 'table_name' in node and 'access_type' in node:
+                        tables.append(node)
+                    for value in node.values():
+                        collect(value)
+                elif isinstance(node, list):
+                    for value in node:
+                        collect(value)
+
+            collect(plan)
+            table = next(table for table in tables if table['table_name'] == User._meta.db_table)
+            return table.get('key'), table['access_type'] in MYSQL_FULL_SCANS
+
+        if connection.vendor == 'sqlite':
+            plan = queryset.explain()
+            search = re.search(r'SEARCH \w+ USING (?:COVERING )?INDEX (\w+)|SEARCH \w+ USING INTEGER PRIMARY KEY', plan)
+            if search:
+                return search.group(1) or 'PRIMARY', False
+            scan = re.search(r'SCAN \w+(?: USING (?:COVERING )?INDEX (\w+))?', plan)
+            return (scan.group(1) if scan else None), True
+
+        raise CommandError(f'Query plans are only checked on MySQL and SQLite, not {connection.vendor}')
+
+    def handle(self, *args, **options):
+        sample = User.objects.order_by('id').first()
+        if sample is None:
+            raise CommandError('The users table is empty; plans on an empty table prove nothing')
+
+        failures = []
+        for description, params in self.cases(sample):
+            key, full_scan = self.explain(self.page_queryset(params))
+            if full_scan and not (params == {} and key == ORDERING_INDEX):
+                failures.append(description)
+                self.stdout.write(self.style.ERROR(f'{description:<14} full scan (index: {key or "none"})'))
+            else:
+                self.stdout.write(f'{description:<14} {key}')
+
+        if failures:
+            raise CommandError(f"Full scans for: {', '.join(failures)}")
+        self.stdout.write(self.style.SUCCESS('Every users list query uses an index'))
@@ -0,0 +1,34 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.imports import CHUNK_SIZE, run_import
+from users.models import UserImport
+
+
+class Command(BaseCommand):
+    help = 'Import users from a CSV file with name, email and phone columns'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', type=Path, help='CSV file to import')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Rows validated and inserted at a time')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not path.is_file():
+            raise CommandError(f'No such file: {path}')
+
+        job = UserImport.objects.create(filename=path.name)
+        self.stdout.write(f'Import {job.pk} started')
+        with path.open('rb') as stream:
+            run_import(job, stream, chunk_size=options['chunk_size'])
+
+        summary = (
+            f'{job.rows_processed} rows: {job.created_count} created, '
+            f'{job.duplicate_count} duplicates skipped, {job.invalid_count} invalid'
+        )
+        for error in job.errors:
+            self.stderr.write(f"Line {error['line']}: {error['errors']}")
+        if job.status == UserImport.FAILED:
+            raise CommandError(f'{job.message} ({summary})')
+        self.stdout.write(self.style.SUCCESS(summary))
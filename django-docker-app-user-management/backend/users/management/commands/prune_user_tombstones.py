@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from users.changes import prune_tombstones
+
+
+class Command(BaseCommand):
+    help = 'Delete the change feed tombstones of users deleted longer ago than the retention period'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.USERS_CHANGES_RETENTION_DAYS,
+            help='Keep tombstones of users deleted within this many days'
+        )
+
+    def handle(self, *args, **options):
+        deleted = prune_tombstones(options['days'])
+        self.stdout.write(self.style.SUCCESS(f'{deleted} tombstones deleted'))
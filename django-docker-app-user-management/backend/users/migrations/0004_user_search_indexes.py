@@ -0,0 +1,54 @@
+from django.db import migrations
+
+# MySQL: a 32-character prefix index is enough to narrow name lookups and
+# keeps the index small; FULLTEXT backs ?q= word search on name. The email
+# column is already covered by its unique index.
+MYSQL_INDEXES = [
+    ('users_name_prefix_idx', 'CREATE INDEX users_name_prefix_idx ON users (name(32))'),
+    ('users_phone_idx', 'CREATE INDEX users_phone_idx ON users (phone)'),
+    ('users_name_fulltext_idx', 'CREATE FULLTEXT INDEX users_name_fulltext_idx ON users (name)'),
+]
+
+# SQLite (local development) only uses an index for LIKE when it is case-insensitive
+SQLITE_INDEXES = [
+    ('users_name_prefix_idx', 'CREATE INDEX users_name_prefix_idx ON users (name COLLATE NOCASE)'),
+    ('users_email_nocase_idx', 'CREATE INDEX users_email_nocase_idx ON users (email COLLATE NOCASE)'),
+    ('users_phone_idx', 'CREATE INDEX users_phone_idx ON users (phone COLLATE NOCASE)'),
+]
+
+DEFAULT_INDEXES = [
+    ('users_name_prefix_idx', 'CREATE INDEX users_name_prefix_idx ON users (name)'),
+    ('users_phone_idx', 'CREATE INDEX users_phone_idx ON users (phone)'),
+]
+
+
+def _indexes(schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'mysql':
+        return MYSQL_INDEXES
+    if vendor == 'sqlite':
+        return SQLITE_INDEXES
+    return DEFAULT_INDEXES
+
+
+def create_indexes(apps, schema_editor):
+    for _, statement in _indexes(schema_editor):
+        schema_editor.execute(statement)
+
+
+def drop_indexes(apps, schema_editor):
+    on_table = ' ON users' if schema_editor.connection.vendor == 'mysql' else ''
+    for name, _ in _indexes(schema_editor):
+        schema_editor.execute(f'DROP INDEX {name}{on_table}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_userimport'),
+    ]
+
+    operations = [
+        # Prefix and FULLTEXT indexes cannot be declared in Meta.indexes
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
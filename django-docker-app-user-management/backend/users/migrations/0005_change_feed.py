@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-19 02:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_user_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'user_tombstones',
+                'ordering': ['deleted_at', 'id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['updated_at', 'id'], name='users_updated_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usertombstone',
+            index=models.Index(fields=['deleted_at', 'id'], name='tombstones_deleted_id_idx'),
+        ),
+    ]
@@ -13,8 +13,67 @@ class User(models.Model):
 
     class Meta:
         db_table = 'users'
-        ordering = ['-created_at']
+        ordering = ['-created_at', '-id']
+        indexes = [
+            # Keyset pagination of the users list, see users/pagination.py
+            models.Index(fields=['created_at', 'id'], name='users_created_id_idx'),
+            # Change feed, see users/changes.py
+            models.Index(fields=['updated_at', 'id'], name='users_updated_id_idx'),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.email})"
 
+
+class UserTombstone(models.Model):
+    """
+    Record of a deleted user, so the change feed can report deletions.
+    """
+    user_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'user_tombstones'
+        ordering = ['deleted_at', 'id']
+        indexes = [
+            models.Index(fields=['deleted_at', 'id'], name='tombstones_deleted_id_idx'),
+        ]
+
+    def __str__(self):
+        return f"User {self.user_id} deleted at {self.deleted_at}"
+
+
+class UserImport(models.Model):
+    """
+    Progress and outcome of a CSV import of users, polled by the client.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (COMPLETED, 'Completed'),
+        (FAILED, 'Failed'),
+    ]
+
+    filename = models.CharField(max_length=255)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    rows_processed = models.PositiveIntegerField(default=0)
+    created_count = models.PositiveIntegerField(default=0)
+    duplicate_count = models.PositiveIntegerField(default=0)
+    invalid_count = models.PositiveIntegerField(default=0)
+    # The first invalid rows, as {'line': ..., 'errors': {...}}
+    errors = models.JSONField(default=list)
+    message = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'user_imports'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.filename} ({self.status})"
@@ -0,0 +1,107 @@
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class UserCursorPagination(BasePagination):
+    """
+    Keyset pagination over (created_at, id), newest first.
+
+    The cursor holds the (created_at, id) of the last row on the page, and the
+    next page is read with a range condition on the users_created_id_idx
+    index, so every page costs the same no matter how deep it is.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-created_at', '-id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        results = list(self.get_page_queryset(queryset, request))
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        # Taken now, the rows may be formatted in place before the response is built
+        self.last_position = self.get_position(self.page[-1]) if self.page else None
+        return self.page
+
+    def get_page_queryset(self, queryset, request):
+        """
+        The query for the requested page, with one extra row that tells whether there is a next page.
+        """
+        position = self.decode_cursor(request)
+        queryset = queryset.order_by(*self.ordering)
+        if position is not None:
+            created_at, pk = position
+            # The redundant created_at <= bound lets the database seek into the index
+            # instead of walking it from the start to evaluate the OR
+            queryset = queryset.filter(created_at__lte=created_at).filter(Q(created_at__lt=created_at) | Q(id__lt=pk))
+        return queryset[:self.get_page_size(request) + 1]
+
+    def get_page_size(self, request):
+        page_size = api_settings.PAGE_SIZE or 10
+        try:
+            requested = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return page_size
+        return max(1, min(requested, self.max_page_size))
+
+    def decode_cursor(self, request):
+        """
+        Return the (created_at, id) position from the request, or None for the first page.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            value = base64.urlsafe_b64decode(encoded.encode('ascii')).decode('ascii')
+            created_at, pk = value.rsplit('|', 1)
+            return datetime.fromisoformat(created_at), int(pk)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_position(self, item):
+        """
+        (created_at, id) of a user instance or a .values() row.
+        """
+        if isinstance(item, dict):
+            return item['created_at'], item['id']
+        return item.created_at, item.pk
+
+    def encode_cursor(self, position):
+        created_at, pk = position
+        value = f'{created_at.isoformat()}|{pk}'
+        return base64.urlsafe_b64encode(value.encode('ascii')).decode('ascii')
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.last_position))
+
+    def get_paginated_response(self, data, message='Users retrieved successfully'):
+        return Response({
+            'success': True,
+            'data': data,
+            'next': self.get_next_link(),
+            'message': message
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'success': {'type': 'boolean'},
+                'data': schema,
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'message': {'type': 'string'},
+            },
+        }
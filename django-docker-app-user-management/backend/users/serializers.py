@@ -1,5 +1,8 @@
+from django.conf import settings
+from django.utils import timezone
 from rest_framework import serializers
-from .models import User
+from rest_framework.settings import ISO_8601, api_settings
+from .models import User, UserImport
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -25,3 +28,98 @@ class UserSerializer(serializers.ModelSerializer):
                 raise serializers.ValidationError("A user with this email already exists.")
         return value
 
+
+class UserBulkSerializer(UserSerializer):
+    """
+    UserSerializer for bulk writes.
+    Email uniqueness is checked for the whole batch at once in users/bulk.py
+    instead of with one query per item.
+    """
+    class Meta(UserSerializer.Meta):
+        extra_kwargs = {'email': {'validators': []}}
+
+    def validate_email(self, value):
+        return value
+
+
+class UserImportSerializer(serializers.ModelSerializer):
+    """
+    Serializer for the progress of a CSV import.
+    """
+    class Meta:
+        model = UserImport
+        fields = [
+            'id', 'filename', 'status', 'rows_processed', 'created_count', 'duplicate_count',
+            'invalid_count', 'errors', 'message', 'created_at', 'updated_at', 'finished_at'
+        ]
+        read_only_fields = fields
+
+
+# Fields of UserSerializer, in output order, and the ones holding datetimes
+USER_FIELDS = ('id', 'name', 'email', 'phone', 'created_at', 'updated_at')
+USER_DATETIME_FIELDS = ('created_at', 'updated_at')
+
+
+def format_datetimes(values):
+    """
+    Format a list of datetimes exactly as DRF's DateTimeField would, in one pass.
+    """
+    output_format = api_settings.DATETIME_FORMAT
+    if output_format is None:
+        return values
+    if settings.USE_TZ:
+        tz = timezone.get_current_timezone()
+        values = [value.astimezone(tz) if value else value for value in values]
+    if output_format.lower() != ISO_8601:
+        return [value.strftime(output_format) if value else None for value in values]
+
+    formatted = []
+    for value in values:
+        if not value:
+            formatted.append(None)
+            continue
+        value = value.isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        formatted.append(value)
+    return formatted
+
+
+def select_fields(fields=None, exclude=None):
+    """
+    Return the USER_FIELDS named by the comma-separated ?fields= and ?exclude=
+    parameters, in output order. Raises ValueError for unknown names, or when
+    nothing is left.
+    """
+    selected = USER_FIELDS
+    for names, keep in ((fields, True), (exclude, False)):
+        if not names:
+            continue
+        names = {name.strip() for name in names.split(',') if name.strip()}
+        unknown = names.difference(USER_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown field(s): {', '.join(sorted(unknown))}")
+        selected = tuple(field for field in selected if (field in names) == keep)
+    if not selected:
+        raise ValueError('No fields left to return')
+    return selected
+
+
+def serialize_user_rows(rows, fields=USER_FIELDS):
+    """
+    Fast path for reading users: turn rows from .values() into the same dicts
+    UserSerializer(many=True) produces, without going through the serializer
+    field machinery per row. Rows are modified in place; columns fetched for
+    other reasons (e.g. the pagination cursor) that are not in fields are
+    dropped.
+    """
+    for field in USER_DATETIME_FIELDS:
+        if field in fields:
+            for row, value in zip(rows, format_datetimes([row[field] for row in rows])):
+                row[field] = value
+    if rows and len(rows[0]) != len(fields):
+        extra = [field for field in rows[0] if field not in fields]
+        for row in rows:
+            for field in extra:
+                del row[field]
+    return rows
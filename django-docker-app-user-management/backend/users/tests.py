@@ -0,0 +1,539 @@
+import datetime
+import io
+import json
+import time
+from unittest import mock
+
+from django.contrib import admin
+from django.core.cache import cache
+from django.core.exceptions import FieldError
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from . import bulk, changes, export, imports
+from .models import User, UserImport
+from .renderers import ORJSONRenderer
+from .serializers import USER_FIELDS, UserSerializer, serialize_user_rows
+
+
+class FastPathParityTests(TestCase):
+    """
+    The fast read path (values() rows, bulk datetime formatting, orjson) must
+    produce exactly the bytes of UserSerializer and DRF's JSONRenderer.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        names = [
+            'Ada Lovelace',
+            'Zoë "Quotes" \\ Backslash',
+            'Line\u2028Separator\u2029Paragraph',
+            'Emoji 🚀 and 中文',
+            '<script>alert(1)</script>',
+        ]
+        users = User.objects.bulk_create([
+            User(name=name, email=f'user{i}@example.com', phone=f'+1 555 000 {i:04d}')
+            for i, name in enumerate(names)
+        ])
+        # A datetime without microseconds is formatted differently by isoformat()
+        User.objects.filter(pk=users[0].pk).update(
+            created_at=datetime.datetime(2024, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc)
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def assert_same_bytes(self):
+        queryset = User.objects.order_by('id')
+        expected = JSONRenderer().render(UserSerializer(queryset, many=True).data)
+        actual = ORJSONRenderer().render(serialize_user_rows(list(queryset.values(*USER_FIELDS))))
+        self.assertEqual(actual, expected)
+
+    def test_rows_render_like_serializer(self):
+        self.assert_same_bytes()
+
+    @override_settings(TIME_ZONE='Asia/Kolkata')
+    def test_rows_render_like_serializer_in_other_time_zone(self):
+        self.assert_same_bytes()
+
+    def test_renderer_matches_json_renderer(self):
+        data = {
+            'text': 'a b c é 🚀',
+            'when': timezone.now(),
+            'nested': [{'n': 1, 'none': None, 'flag': True}],
+            'lazy': UserSerializer().fields['email'].error_messages['invalid'],
+        }
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_list_endpoint_matches_serializer(self):
+        response = APIClient().get('/api/users/?page_size=100')
+        expected = JSONRenderer().render({
+            'success': True,
+            'data': UserSerializer(User.objects.order_by('-created_at', '-id'), many=True).data,
+            'next': None,
+            'message': 'Users retrieved successfully'
+        })
+        self.assertEqual(response.content, expected)
+
+    def test_detail_endpoint_matches_serializer(self):
+        user = User.objects.get(name__startswith='Line')
+        response = APIClient().get(f'/api/users/{user.pk}/')
+        expected = JSONRenderer().render({
+            'success': True,
+            'data': UserSerializer(user).data,
+            'message': 'User retrieved successfully'
+        })
+        self.assertEqual(response.content, expected)
+
+
+class SparseFieldsetTests(TestCase):
+    """
+    ?fields= and ?exclude= trim both the response and the columns selected.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = User.objects.bulk_create([
+            User(name=f'User {i}', email=f'sparse{i}@example.com', phone=f'+1 555 100 {i:04d}') for i in range(3)
+        ])
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        return response, ' '.join(query['sql'] for query in queries.captured_queries)
+
+    def test_list_fields(self):
+        response, sql = self.get('/api/users/?fields=id,name&page_size=2')
+        self.assertEqual([list(user) for user in response.json()['data']], [['id', 'name'], ['id', 'name']])
+        self.assertNotIn('"email"', sql)
+        self.assertIsNotNone(response.json()['next'])
+
+    def test_list_cursor_works_without_id_and_created_at(self):
+        response, _ = self.get('/api/users/?fields=email&page_size=2')
+        next_page = self.client.get(response.json()['next']).json()['data']
+        self.assertEqual([user['email'] for user in response.json()['data'] + next_page],
+                         [f'sparse{i}@example.com' for i in (2, 1, 0)])
+
+    def test_detail_exclude(self):
+        user = self.users[0]
+        response, sql = self.get(f'/api/users/{user.pk}/?exclude=phone,created_at,updated_at')
+        self.assertEqual(response.json()['data'], {'id': user.pk, 'name': user.name, 'email': user.email})
+        self.assertNotIn('"phone"', sql)
+
+    def test_detail_fieldsets_are_cached_apart(self):
+        user = self.users[0]
+        self.client.get(f'/api/users/{user.pk}/?fields=name')
+        response = self.client.get(f'/api/users/{user.pk}/')
+        self.assertEqual(list(response.json()['data']), list(USER_FIELDS))
+
+    def test_unknown_field(self):
+        response = self.client.get('/api/users/?fields=id,password')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'], {'fields': ['Unknown field(s): password']})
+
+
+class PaginationTests(TestCase):
+    """
+    The users list is read newest first, one keyset page at a time.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        created_at = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+        cls.users = User.objects.bulk_create([
+            User(name=f'Page {i}', email=f'page{i}@example.com', phone=f'+1 555 600 {i:04d}') for i in range(5)
+        ])
+        # Two users share a created_at, so the id has to break the tie
+        for i, user in enumerate(cls.users):
+            User.objects.filter(pk=user.pk).update(created_at=created_at + datetime.timedelta(minutes=min(i, 3)))
+
+    def setUp(self):
+        cache.clear()
+
+    def test_pages_cover_every_user_once(self):
+        client = APIClient()
+        url = '/api/users/?page_size=2'
+        names = []
+        while url:
+            body = client.get(url).json()
+            names.extend(user['name'] for user in body['data'])
+            url = body['next']
+        self.assertEqual(names, ['Page 4', 'Page 3', 'Page 2', 'Page 1', 'Page 0'])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(APIClient().get('/api/users/?cursor=garbage').status_code, 404)
+
+
+class BulkTests(TestCase):
+    """
+    Bulk endpoints write all of a batch or none of it, with errors per item.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create(name='Existing', email='taken@example.com', phone='+1 555 300 0000')
+
+    def items(self, *emails):
+        return [{'name': f'User {i}', 'email': email, 'phone': f'+1 555 300 {i:04d}'} for i, email in enumerate(emails, 1)]
+
+    def test_emails_compare_case_insensitively(self):
+        response = self.client.post('/api/users/bulk/', self.items('new@example.com', 'TAKEN@example.com',
+                                                                   'New@Example.com'), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'], [
+            {'index': 1, 'errors': {'email': [bulk.EMAIL_TAKEN]}},
+            {'index': 2, 'errors': {'email': [bulk.EMAIL_REPEATED]}},
+        ])
+        self.assertEqual(User.objects.count(), 1)
+
+    def test_email_taken_after_the_check_is_an_item_error(self):
+        # As if another request inserted the email between the check and the write
+        with mock.patch.object(bulk, 'email_owners', side_effect=[{}, {'taken@example.com': self.user.pk}]):
+            response = self.client.post('/api/users/bulk/', self.items('ok@example.com', 'taken@example.com'),
+                                        format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'], [{'index': 1, 'errors': {'email': [bulk.EMAIL_TAKEN]}}])
+        self.assertFalse(User.objects.filter(email='ok@example.com').exists())
+
+    def test_invalid_item_writes_nothing(self):
+        items = self.items('a@example.com', 'b@example.com')
+        items[1]['phone'] = ''
+        response = self.client.post('/api/users/bulk/', items, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['index'] for error in response.json()['errors']], [1])
+        self.assertEqual(User.objects.count(), 1)
+
+    def test_update(self):
+        other = User.objects.create(name='Other', email='other@example.com', phone='+1 555 300 0009')
+        response = self.client.patch('/api/users/bulk/', [
+            {'id': self.user.pk, 'name': 'Renamed'}, {'id': other.pk, 'email': 'OTHER@example.com'}
+        ], format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([user['name'] for user in response.json()['data']], ['Renamed', 'Other'])
+        self.assertEqual(User.objects.get(pk=other.pk).email, 'OTHER@example.com')
+
+    def test_update_writes_only_the_fields_of_each_item(self):
+        other = User.objects.create(name='Other', email='other@example.com', phone='+1 555 300 0009')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.patch('/api/users/bulk/', [
+                {'id': self.user.pk, 'name': 'Renamed'}, {'id': other.pk, 'email': 'moved@example.com'}
+            ], format='json')
+        updates = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('UPDATE')]
+        self.assertFalse([sql for sql in updates if '"name" = CASE' in sql and '"email" = CASE' in sql])
+        self.assertEqual(User.objects.get(pk=self.user.pk).name, 'Renamed')
+        self.assertEqual(User.objects.get(pk=other.pk).email, 'moved@example.com')
+
+    def test_update_rejects_email_of_another_user(self):
+        other = User.objects.create(name='Other', email='other@example.com', phone='+1 555 300 0009')
+        response = self.client.patch('/api/users/bulk/', [
+            {'id': self.user.pk, 'name': 'Renamed'}, {'id': other.pk, 'email': 'Taken@example.com'}
+        ], format='json')
+        self.assertEqual(response.json()['errors'], [{'index': 1, 'errors': {'email': [bulk.EMAIL_TAKEN]}}])
+        self.assertEqual(User.objects.get(pk=self.user.pk).name, 'Existing')
+
+    def test_delete_unknown_id_deletes_nothing(self):
+        response = self.client.delete('/api/users/bulk/', {'ids': [self.user.pk, 0]}, format='json')
+        self.assertEqual(response.json()['errors'], [{'index': 1, 'errors': {'id': ['User not found.']}}])
+        self.assertTrue(User.objects.filter(pk=self.user.pk).exists())
+
+
+class CacheInvalidationTests(TestCase):
+    """
+    Cached list and detail responses are replaced after every kind of write.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create(name='Cached', email='cached@example.com', phone='+1 555 500 0000')
+
+    def names(self):
+        return [user['name'] for user in self.client.get('/api/users/').json()['data']]
+
+    def write(self, method, url, data=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            return getattr(self.client, method)(url, data, format='json')
+
+    def test_api_writes(self):
+        detail = f'/api/users/{self.user.pk}/'
+        self.assertEqual(self.names(), ['Cached'])
+        self.client.get(detail)
+
+        self.write('post', '/api/users/', {'name': 'Added', 'email': 'added@example.com', 'phone': '+1 555 500 0001'})
+        self.assertEqual(self.names(), ['Added', 'Cached'])
+
+        self.write('patch', detail, {'name': 'Renamed'})
+        self.assertEqual(self.client.get(detail).json()['data']['name'], 'Renamed')
+        self.assertEqual(self.names(), ['Added', 'Renamed'])
+
+        self.write('delete', detail)
+        self.assertEqual(self.client.get(detail).status_code, 404)
+        self.assertEqual(self.names(), ['Added'])
+
+    def test_admin_writes(self):
+        user_admin = admin.site._registry[User]
+        request = RequestFactory().post('/admin/')
+        self.assertEqual(self.names(), ['Cached'])
+
+        self.user.name = 'Renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            user_admin.save_model(request, self.user, None, True)
+        self.assertEqual(self.names(), ['Renamed'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            user_admin.delete_queryset(request, User.objects.filter(pk=self.user.pk))
+        self.assertEqual(self.names(), [])
+        self.assertEqual(self.client.get(f'/api/users/{self.user.pk}/').status_code, 404)
+
+
+class ConditionalRequestTests(TestCase):
+    """
+    ETag and Last-Modified give 304 on unchanged reads and 412 on stale updates.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create(name='Tagged', email='tagged@example.com', phone='+1 555 700 0000')
+        self.url = f'/api/users/{self.user.pk}/'
+
+    def test_not_modified(self):
+        for url in (self.url, '/api/users/'):
+            response = self.client.get(url)
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+            self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+    def test_list_is_modified_by_a_delete(self):
+        other = User.objects.create(name='Other', email='other@example.com', phone='+1 555 700 0001')
+        User.objects.update(updated_at=timezone.now() - datetime.timedelta(hours=1))
+        last_modified = self.client.get('/api/users/')['Last-Modified']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/users/{other.pk}/')
+        response = self.client.get('/api/users/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([user['name'] for user in response.json()['data']], ['Tagged'])
+
+    def test_etag_changes_with_the_user(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(self.url, {'name': 'Changed'}, format='json')
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_if_match(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.patch(self.url, {'name': 'First'}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        response = self.client.patch(self.url, {'name': 'Second'}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(User.objects.get(pk=self.user.pk).name, 'First')
+
+
+class ExportTests(TestCase):
+    """
+    Exports stream every matching user in id order.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.bulk_create([
+            User(name=f'Export {i}', email=f'export{i}@example.com', phone=f'+1 555 800 {i:04d}') for i in range(5)
+        ])
+
+    def export(self, query):
+        response = APIClient().get(f'/api/users/export/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_ndjson_matches_serializer(self):
+        expected = UserSerializer(User.objects.order_by('id'), many=True).data
+        self.assertEqual([json.loads(line) for line in self.export('').splitlines()], expected)
+        # Across several chunks too
+        chunked = b''.join(export.ndjson_lines(chunk_size=2)).decode()
+        self.assertEqual([json.loads(line) for line in chunked.splitlines()], expected)
+
+    def test_csv_with_filters_and_fields(self):
+        self.assertEqual(self.export('type=csv&fields=name,email&email_prefix=export1').splitlines(),
+                         ['name,email', 'Export 1,export1@example.com'])
+
+    def test_unknown_type(self):
+        self.assertEqual(APIClient().get('/api/users/export/?type=xml').status_code, 400)
+
+
+class FilterTests(TestCase):
+    """
+    Filters and ?q= narrow the users list.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create(name='Ada Lovelace', email='ada@example.com', phone='+44 20 7946 0000')
+        User.objects.create(name='Alan Turing', email='alan@example.org', phone='+1 555 900 0000')
+
+    def setUp(self):
+        cache.clear()
+
+    def names(self, query):
+        return [user['name'] for user in APIClient().get(f'/api/users/?{query}').json()['data']]
+
+    def test_filters(self):
+        self.assertEqual(self.names('email=ADA@example.com'), ['Ada Lovelace'])
+        self.assertEqual(self.names('name_prefix=al'), ['Alan Turing'])
+        self.assertEqual(self.names('phone_prefix=%2B44'), ['Ada Lovelace'])
+        self.assertEqual(self.names('name_prefix=a&email_prefix=ada'), ['Ada Lovelace'])
+
+    def test_search_picks_the_column(self):
+        self.assertEqual(self.names('q=alan@'), ['Alan Turing'])
+        self.assertEqual(self.names('q=%2B1 555'), ['Alan Turing'])
+        self.assertEqual(self.names('q=ada'), ['Ada Lovelace'])
+
+    def test_fulltext_lookup_is_only_on_name(self):
+        with self.assertRaises(FieldError):
+            User.objects.filter(email__fulltext='ada')
+
+
+class ImportTests(TestCase):
+    """
+    CSV imports count what was created, skipped and rejected, and report their progress.
+    """
+    CSV = (
+        'name,email,phone\n'
+        'New One,one@example.com,+1 555 400 0001\n'
+        'Again,ONE@example.com,+1 555 400 0002\n'
+        'Existing,Taken@Example.com,+1 555 400 0003\n'
+        'Bad,not-an-email,+1 555 400 0004\n'
+        'New Two,two@example.com,+1 555 400 0005\n'
+    )
+
+    def setUp(self):
+        cache.clear()
+        User.objects.create(name='Taken', email='taken@example.com', phone='+1 555 400 0000')
+
+    def run_import(self, chunk_size=2):
+        job = UserImport.objects.create(filename='users.csv')
+        return imports.run_import(job, io.BytesIO(self.CSV.encode()), chunk_size=chunk_size)
+
+    def test_counts(self):
+        job = self.run_import()
+        self.assertEqual(job.status, UserImport.COMPLETED)
+        self.assertEqual((job.rows_processed, job.created_count, job.duplicate_count, job.invalid_count), (5, 2, 2, 1))
+        self.assertEqual(job.errors[0]['line'], 5)
+        self.assertEqual(job.message, '2 users imported')
+        self.assertEqual(User.objects.count(), 3)
+
+    def test_users_created_during_the_import_count_as_duplicates(self):
+        def owners(emails):
+            # two@example.com is created by someone else right after the check
+            found = bulk.email_owners(emails)
+            if 'two@example.com' in emails and not User.objects.filter(email='two@example.com').exists():
+                User.objects.create(name='Racer', email='two@example.com', phone='+1 555 400 0009')
+            return found
+
+        with mock.patch.object(imports, 'email_owners', side_effect=owners):
+            job = self.run_import(chunk_size=10)
+        self.assertEqual((job.created_count, job.duplicate_count), (1, 3))
+        self.assertEqual(User.objects.get(email='two@example.com').name, 'Racer')
+
+    def test_stale_job_is_reported_failed(self):
+        job = UserImport.objects.create(filename='users.csv', status=UserImport.RUNNING)
+        UserImport.objects.filter(pk=job.pk).update(updated_at=timezone.now() - datetime.timedelta(hours=1))
+        data = APIClient().get(f'/api/users/import/{job.pk}/').json()['data']
+        self.assertEqual(data['status'], UserImport.FAILED)
+
+
+@override_settings(USERS_CHANGES_SETTLE_SECONDS=0)
+class ChangeFeedTests(TestCase):
+    """
+    /api/users/changes/ reports creates, updates and deletes since a cursor.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.users = User.objects.bulk_create([
+            User(name=f'User {i}', email=f'feed{i}@example.com', phone=f'+1 555 200 {i:04d}') for i in range(3)
+        ])
+
+    def changes(self, since='', **params):
+        response = self.client.get('/api/users/changes/', {'since': since, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()['data']
+
+    def test_from_the_start_in_pages(self):
+        first = self.changes(page_size=2)
+        self.assertTrue(first['has_more'])
+        second = self.changes(first['cursor'], page_size=2)
+        self.assertFalse(second['has_more'])
+        self.assertEqual([user['email'] for user in first['updated'] + second['updated']],
+                         [user.email for user in self.users])
+
+    def test_only_changes_since_cursor(self):
+        cursor = self.changes()['cursor']
+        self.assertEqual(self.changes(cursor)['updated'], [])
+
+        self.client.patch(f'/api/users/{self.users[1].pk}/', {'name': 'Renamed'}, format='json')
+        self.client.delete(f'/api/users/{self.users[2].pk}/')
+        data = self.changes(cursor, fields='id,name')
+        self.assertEqual(data['updated'], [{'id': self.users[1].pk, 'name': 'Renamed'}])
+        self.assertEqual(data['deleted'], [self.users[2].pk])
+        after = self.changes(data['cursor'])
+        self.assertEqual((after['updated'], after['deleted']), ([], []))
+
+    def test_bulk_deletes_leave_tombstones(self):
+        cursor = self.changes()['cursor']
+        ids = [self.users[0].pk, self.users[1].pk]
+        self.client.delete('/api/users/bulk/', {'ids': ids}, format='json')
+        self.assertEqual(sorted(self.changes(cursor)['deleted']), ids)
+
+    def test_latest_cursor_skips_existing_users(self):
+        cursor = self.changes('latest')['cursor']
+        self.assertEqual(self.changes(cursor)['updated'], [])
+
+    def test_wait_returns_empty_when_nothing_changes(self):
+        cursor = self.changes()['cursor']
+        started = time.monotonic()
+        self.assertEqual(self.changes(cursor, wait=0.6)['updated'], [])
+        self.assertGreaterEqual(time.monotonic() - started, 0.6)
+
+    @override_settings(USERS_CHANGES_SETTLE_SECONDS=0.01)
+    def test_slow_bulk_writes_are_not_skipped(self):
+        # A poll made while a slow bulk write is still running moves the cursor past
+        # the time the write started; its rows must still be reported after the commit
+        cursors = []
+
+        def slow(original):
+            def write(*args, **kwargs):
+                result = original(*args, **kwargs)
+                time.sleep(0.05)
+                cursors.append(changes.latest_cursor())
+                return result
+            return write
+
+        with mock.patch.object(User.objects, 'bulk_update', slow(User.objects.bulk_update)):
+            self.client.patch('/api/users/bulk/', [{'id': self.users[0].pk, 'name': 'Slow'}], format='json')
+        with mock.patch.object(User.objects, 'bulk_create', slow(User.objects.bulk_create)):
+            self.client.post('/api/users/bulk/', [
+                {'name': 'Slow new', 'email': 'slow@example.com', 'phone': '+1 555 200 0009'}
+            ], format='json')
+
+        time.sleep(0.02)
+        self.assertEqual([user['name'] for user in self.changes(cursors[0])['updated']], ['Slow', 'Slow new'])
+        self.assertEqual([user['name'] for user in self.changes(cursors[1])['updated']], ['Slow new'])
+
+    @override_settings(USERS_CHANGES_SETTLE_SECONDS=60)
+    def test_recent_changes_wait_to_settle(self):
+        self.assertEqual(self.changes()['updated'], [])
+
+    def test_invalid_and_expired_cursors(self):
+        self.assertEqual(self.client.get('/api/users/changes/?since=nope').status_code, 400)
+        old = timezone.now() - datetime.timedelta(days=365)
+        expired = changes.encode_cursor((old, 0), (old, 0))
+        self.assertEqual(self.client.get('/api/users/changes/', {'since': expired}).status_code, 410)
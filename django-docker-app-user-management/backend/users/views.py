@@ -1,8 +1,26 @@
+import time
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
 from rest_framework import viewsets, status
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from .models import User
-from .serializers import UserSerializer
+from rest_framework.exceptions import NotFound
+from . import cache, changes
+from .conditional import (
+    detail_validators, evaluate_preconditions, list_validators, set_validators, user_validators
+)
+from .bulk import BulkError, bulk_create_users, bulk_delete_users, bulk_update_users
+from .export import EXPORT_TYPES
+from .filters import filter_users
+from .imports import fail_if_stale, start_import
+from .models import User, UserImport
+from .pagination import UserCursorPagination
+from .serializers import USER_FIELDS, UserImportSerializer, UserSerializer, select_fields, serialize_user_rows
 
 
 class UserViewSet(viewsets.ModelViewSet):
@@ -10,38 +28,85 @@ class UserViewSet(viewsets.ModelViewSet):
     ViewSet for User CRUD operations.
     
     Provides:
-    - list: GET /api/users/
+    - list: GET /api/users/ (cursor paginated, ?cursor= and ?page_size=; ?q= and filters, see users/filters.py)
     - create: POST /api/users/
     - retrieve: GET /api/users/{id}/
     - update: PUT /api/users/{id}/
     - partial_update: PATCH /api/users/{id}/
     - destroy: DELETE /api/users/{id}/
+    - bulk_create: POST /api/users/bulk/
+    - bulk_update: PATCH /api/users/bulk/
+    - bulk_destroy: DELETE /api/users/bulk/
+    - import_csv: POST /api/users/import/
+    - import_status: GET /api/users/import/{job_id}/
+    - export: GET /api/users/export/?type=ndjson|csv (same filters as list)
+    - change_feed: GET /api/users/changes/?since=<cursor>&wait=<seconds> (see users/changes.py)
+
+    Reads and writes return only the fields named by ?fields=id,name or not named by ?exclude=phone.
     """
     queryset = User.objects.all()
     serializer_class = UserSerializer
+    pagination_class = UserCursorPagination
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ('list', 'export'):
+            queryset = filter_users(queryset, self.request.query_params)
+        elif self.action in ('update', 'partial_update'):
+            queryset = queryset.select_for_update()
+        return queryset
+
+    def _requested_fields(self, request):
+        """
+        Return (fields, None) for the ?fields= / ?exclude= sparse fieldset, or (None, error response).
+        """
+        try:
+            return select_fields(request.query_params.get('fields'), request.query_params.get('exclude')), None
+        except ValueError as e:
+            return None, Response({
+                'success': False,
+                'errors': {'fields': [str(e)]},
+                'message': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
 
     def list(self, request, *args, **kwargs):
         """
-        List all users.
+        List users, newest first, one page at a time.
+        Follow the `next` link (?cursor=...) for the following page.
         """
-        queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True)
-        return Response({
-            'success': True,
-            'data': serializer.data,
-            'message': 'Users retrieved successfully'
-        })
+        fields, invalid = self._requested_fields(request)
+        if invalid:
+            return invalid
+
+        def build():
+            # The cursor needs id and created_at even when they are not returned
+            columns = [field for field in USER_FIELDS if field in fields or field in ('id', 'created_at')]
+            page = self.paginate_queryset(self.get_queryset().values(*columns))
+            return self.get_paginated_response(serialize_user_rows(page, fields)).data
+
+        etag, last_modified = list_validators(request)
+        not_modified = evaluate_preconditions(request, etag, last_modified)
+        if not_modified:
+            return not_modified
+
+        response = Response(cache.get_or_build(cache.list_key(request), build))
+        return set_validators(response, etag, last_modified)
 
     def create(self, request, *args, **kwargs):
         """
         Create a new user.
         """
+        fields, invalid = self._requested_fields(request)
+        if invalid:
+            return invalid
+
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
             serializer.save()
+            cache.invalidate()
             return Response({
                 'success': True,
-                'data': serializer.data,
+                'data': {field: serializer.data[field] for field in fields},
                 'message': 'User created successfully'
             }, status=status.HTTP_201_CREATED)
         return Response({
@@ -54,28 +119,62 @@ class UserViewSet(viewsets.ModelViewSet):
         """
         Retrieve a single user by ID.
         """
-        instance = self.get_object()
-        serializer = self.get_serializer(instance)
-        return Response({
-            'success': True,
-            'data': serializer.data,
-            'message': 'User retrieved successfully'
-        })
+        fields, invalid = self._requested_fields(request)
+        if invalid:
+            return invalid
+
+        def build():
+            rows = list(self.get_queryset().filter(pk=pk).values(*fields))
+            if not rows:
+                raise NotFound()
+            return {
+                'success': True,
+                'data': serialize_user_rows(rows, fields)[0],
+                'message': 'User retrieved successfully'
+            }
+
+        try:
+            pk = int(kwargs['pk'])
+        except ValueError:
+            raise NotFound()
+        etag, last_modified = detail_validators(pk, fields)
+        not_modified = evaluate_preconditions(request, etag, last_modified)
+        if not_modified:
+            return not_modified
+
+        # Keyed on the normalised id, so /users/01/ cannot outlive an invalidation of user 1
+        part = 'response' if fields == USER_FIELDS else 'response-' + '.'.join(fields)
+        response = Response(cache.get_or_build(cache.detail_key(pk, part), build))
+        return set_validators(response, etag, last_modified)
 
     def update(self, request, *args, **kwargs):
         """
         Update a user.
+        With If-Match (or If-Unmodified-Since), the update only happens when
+        the user is unchanged since the client fetched it, otherwise 412.
         """
         partial = kwargs.pop('partial', False)
-        instance = self.get_object()
-        serializer = self.get_serializer(instance, data=request.data, partial=partial)
-        if serializer.is_valid():
-            serializer.save()
-            return Response({
-                'success': True,
-                'data': serializer.data,
-                'message': 'User updated successfully'
-            })
+        fields, invalid = self._requested_fields(request)
+        if invalid:
+            return invalid
+
+        with transaction.atomic():
+            # Locked, so no other write lands between the precondition check and the save
+            instance = self.get_object()
+            precondition_failed = evaluate_preconditions(request, *user_validators(instance.pk, instance.updated_at))
+            if precondition_failed:
+                return precondition_failed
+
+            serializer = self.get_serializer(instance, data=request.data, partial=partial)
+            if serializer.is_valid():
+                serializer.save()
+                cache.invalidate([instance.pk])
+                response = Response({
+                    'success': True,
+                    'data': {field: serializer.data[field] for field in fields},
+                    'message': 'User updated successfully'
+                })
+                return set_validators(response, *user_validators(instance.pk, instance.updated_at))
         return Response({
             'success': False,
             'errors': serializer.errors,
@@ -93,10 +192,213 @@ class UserViewSet(viewsets.ModelViewSet):
         """
         Delete a user.
         """
-        instance = self.get_object()
-        instance.delete()
+        with transaction.atomic():
+            instance = self.get_object()
+            pk = instance.pk
+            instance.delete()
+            changes.record_deletes([pk])
+        cache.invalidate([pk])
         return Response({
             'success': True,
             'message': 'User deleted successfully'
         }, status=status.HTTP_200_OK)
 
+    def _bulk_items(self, request, items):
+        """
+        Return an error response when items is not a list of acceptable size, else None.
+        """
+        if not isinstance(items, list) or not items:
+            message = 'Expected a non-empty list'
+        elif len(items) > settings.USERS_BULK_MAX_ITEMS:
+            message = f'At most {settings.USERS_BULK_MAX_ITEMS} items per request'
+        else:
+            return None
+        return Response({
+            'success': False,
+            'errors': {'non_field_errors': [message]},
+            'message': message
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    def _bulk_failed(self, error, message):
+        return Response({
+            'success': False,
+            'errors': error.errors,
+            'message': message
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk_create(self, request, *args, **kwargs):
+        """
+        Create users from a list; nothing is created when any item is invalid.
+        """
+        invalid = self._bulk_items(request, request.data)
+        if invalid:
+            return invalid
+        try:
+            users = bulk_create_users(request.data)
+        except BulkError as e:
+            return self._bulk_failed(e, 'Failed to create users')
+        return Response({
+            'success': True,
+            'data': UserSerializer(users, many=True).data,
+            'message': f'{len(users)} users created successfully'
+        }, status=status.HTTP_201_CREATED)
+
+    @bulk_create.mapping.patch
+    def bulk_update(self, request, *args, **kwargs):
+        """
+        Partially update users from a list of objects with an id; nothing is updated when any item is invalid.
+        """
+        invalid = self._bulk_items(request, request.data)
+        if invalid:
+            return invalid
+        try:
+            users = bulk_update_users(request.data)
+        except BulkError as e:
+            return self._bulk_failed(e, 'Failed to update users')
+        return Response({
+            'success': True,
+            'data': UserSerializer(users, many=True).data,
+            'message': f'{len(users)} users updated successfully'
+        })
+
+    @bulk_create.mapping.delete
+    def bulk_destroy(self, request, *args, **kwargs):
+        """
+        Delete users given {"ids": [...]}; nothing is deleted when any id is unknown.
+        """
+        ids = request.data.get('ids') if isinstance(request.data, dict) else None
+        invalid = self._bulk_items(request, ids)
+        if invalid:
+            return invalid
+        try:
+            deleted = bulk_delete_users(ids)
+        except BulkError as e:
+            return self._bulk_failed(e, 'Failed to delete users')
+        return Response({
+            'success': True,
+            'message': f'{deleted} users deleted successfully'
+        }, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser])
+    def import_csv(self, request, *args, **kwargs):
+        """
+        Start importing a CSV file uploaded as `file`; poll the returned job for progress.
+        """
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({
+                'success': False,
+                'errors': {'file': ['No file was submitted.']},
+                'message': 'Failed to start import'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        # The upload's temporary file goes away with the request, keep a copy for the import thread
+        import_dir = settings.USERS_IMPORT_DIR
+        import_dir.mkdir(parents=True, exist_ok=True)
+        path = import_dir / f'{uuid.uuid4().hex}.csv'
+        with path.open('wb') as destination:
+            for chunk in upload.chunks():
+                destination.write(chunk)
+
+        job = UserImport.objects.create(filename=upload.name[:255])
+        start_import(job, path)
+        return Response({
+            'success': True,
+            'data': UserImportSerializer(job).data,
+            'message': 'Import started'
+        }, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['get'], url_path=r'import/(?P<job_id>[0-9]+)')
+    def import_status(self, request, job_id=None, *args, **kwargs):
+        """
+        Progress of a CSV import.
+        """
+        job = fail_if_stale(get_object_or_404(UserImport, pk=job_id))
+        return Response({
+            'success': True,
+            'data': UserImportSerializer(job).data,
+            'message': 'Import retrieved successfully'
+        })
+
+    @action(detail=False, methods=['get'])
+    def export(self, request, *args, **kwargs):
+        """
+        Stream every user as NDJSON (default) or CSV, in id order.
+        """
+        fields, invalid = self._requested_fields(request)
+        if invalid:
+            return invalid
+
+        export_type = request.query_params.get('type', 'ndjson')
+        if export_type not in EXPORT_TYPES:
+            return Response({
+                'success': False,
+                'errors': {'type': [f"Choose one of: {', '.join(EXPORT_TYPES)}"]},
+                'message': 'Unknown export type'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        content_type, extension, lines = EXPORT_TYPES[export_type]
+        response = StreamingHttpResponse(lines(self.get_queryset(), fields), content_type=f'{content_type}; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="users.{extension}"'
+        return response
+
+    @action(detail=False, methods=['get'], url_path='changes')
+    def change_feed(self, request, *args, **kwargs):
+        """
+        Users created, updated or deleted since ?since=, the cursor returned by the
+        previous call; without it, every user from the start. ?since=latest returns
+        no changes and a cursor at the current end of the feed. With ?wait=N, an
+        empty answer is held back up to N seconds until there is a change.
+        """
+        fields, invalid = self._requested_fields(request)
+        if invalid:
+            return invalid
+
+        since = request.query_params.get('since')
+        if since == changes.LATEST:
+            return Response({
+                'success': True,
+                'data': {'updated': [], 'deleted': [], 'cursor': changes.latest_cursor(), 'has_more': False},
+                'message': 'Changes retrieved successfully'
+            })
+
+        try:
+            wait = min(float(request.query_params.get('wait', 0)), settings.USERS_CHANGES_MAX_WAIT)
+            limit = int(request.query_params.get('page_size', changes.PAGE_SIZE))
+        except ValueError:
+            wait = limit = -1
+        if not wait >= 0 or limit < 1:
+            return Response({
+                'success': False,
+                'errors': {'non_field_errors': ['wait and page_size must be positive numbers']},
+                'message': 'Invalid parameters'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        deadline = time.monotonic() + wait
+        try:
+            while True:
+                data = changes.read_changes(since, fields, min(limit, changes.MAX_PAGE_SIZE))
+                if data['updated'] or data['deleted'] or time.monotonic() >= deadline:
+                    break
+                # Nothing new: look again from where this read stopped
+                since = data['cursor']
+                time.sleep(changes.POLL_INTERVAL)
+        except changes.InvalidCursor as e:
+            return Response({
+                'success': False,
+                'errors': {'since': [str(e)]},
+                'message': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        except changes.CursorExpired as e:
+            return Response({
+                'success': False,
+                'errors': {'since': [str(e)]},
+                'message': str(e)
+            }, status=status.HTTP_410_GONE)
+
+        return Response({
+            'success': True,
+            'data': data,
+            'message': 'Changes retrieved successfully'
+        })
@@ -4,6 +4,10 @@
 
 let deleteUserId = null;
 let isEditMode = false;
+let nextUsersUrl = null;
+let editUserEtag = null;
+let changesCursor = null;
+let oldestLoadedCreatedAt = null;
 
 // Bootstrap modal instances
 let userModal;
@@ -35,19 +39,30 @@ function showAlert(type, message) {
 }
 
 /**
- * Load all users
+ * Load the first page of users, or append the next page when loadMore is true
  */
-async function loadUsers() {
+async function loadUsers(loadMore = false) {
     const tableBody = document.getElementById('usersTableBody');
     const loadingSpinner = document.getElementById('loadingSpinner');
     const noDataMessage = document.getElementById('noDataMessage');
+    const loadMoreButton = document.getElementById('loadMoreButton');
+    const url = loadMore && nextUsersUrl ? nextUsersUrl : `${API_CONFIG.BASE_URL}${API_CONFIG.ENDPOINTS.USERS}`;
     
     try {
         loadingSpinner.classList.remove('d-none');
-        tableBody.innerHTML = '';
+        loadMoreButton.classList.add('d-none');
+        if (!loadMore) {
+            tableBody.innerHTML = '';
+        }
         noDataMessage.classList.add('d-none');
         
-        const response = await fetch(`${API_CONFIG.BASE_URL}${API_CONFIG.ENDPOINTS.USERS}`, {
+        if (!loadMore) {
+            // Taken before the list, so changes made while it loads are picked up by syncChanges
+            changesCursor = await fetchLatestChangesCursor();
+            oldestLoadedCreatedAt = null;
+        }
+        
+        const response = await fetch(url, {
             method: 'GET',
             headers: {
                 'Content-Type': 'application/json',
@@ -60,10 +75,12 @@ async function loadUsers() {
         
         const result = await response.json();
         const users = result.data || [];
+        nextUsersUrl = result.next || null;
         
         loadingSpinner.classList.add('d-none');
+        loadMoreButton.classList.toggle('d-none', !nextUsersUrl);
         
-        if (users.length === 0) {
+        if (users.length === 0 && !loadMore) {
             noDataMessage.classList.remove('d-none');
             return;
         }
@@ -72,6 +89,9 @@ async function loadUsers() {
             const row = createUserRow(user);
             tableBody.appendChild(row);
         });
+        if (users.length > 0) {
+            oldestLoadedCreatedAt = new Date(users[users.length - 1].created_at);
+        }
         
     } catch (error) {
         console.error('Error loading users:', error);
@@ -85,6 +105,7 @@ async function loadUsers() {
  */
 function createUserRow(user) {
     const row = document.createElement('tr');
+    row.dataset.userId = user.id;
     const createdDate = new Date(user.created_at).toLocaleDateString();
     
     row.innerHTML = `
@@ -106,6 +127,79 @@ function createUserRow(user) {
     return row;
 }
 
+/**
+ * Cursor at the current end of the change feed, or null when it cannot be fetched
+ */
+async function fetchLatestChangesCursor() {
+    try {
+        const response = await fetch(`${API_CONFIG.BASE_URL}${API_CONFIG.ENDPOINTS.USERS}changes/?since=latest`);
+        if (!response.ok) {
+            return null;
+        }
+        const result = await response.json();
+        return result.data.cursor;
+    } catch (error) {
+        console.error('Error fetching changes cursor:', error);
+        return null;
+    }
+}
+
+/**
+ * Apply the changes made since the list was loaded to the table, instead of reloading it.
+ * The feed holds a request open (wait) until a change is there, so a save just made shows up.
+ */
+async function syncChanges() {
+    if (!changesCursor) {
+        loadUsers();
+        return;
+    }
+    
+    try {
+        let hasMore = true;
+        while (hasMore) {
+            const url = `${API_CONFIG.BASE_URL}${API_CONFIG.ENDPOINTS.USERS}changes/` +
+                `?since=${encodeURIComponent(changesCursor)}&wait=5`;
+            const response = await fetch(url);
+            if (!response.ok) {
+                // 410: the cursor is older than the deletions the server keeps
+                throw new Error('Failed to fetch changes');
+            }
+            const result = await response.json();
+            applyChanges(result.data);
+            changesCursor = result.data.cursor;
+            hasMore = result.data.has_more;
+        }
+    } catch (error) {
+        console.error('Error syncing users:', error);
+        loadUsers();
+    }
+}
+
+/**
+ * Update, add and remove table rows for a page of the change feed
+ */
+function applyChanges(changes) {
+    const tableBody = document.getElementById('usersTableBody');
+    
+    changes.updated.forEach(user => {
+        const existing = tableBody.querySelector(`tr[data-user-id="${user.id}"]`);
+        if (existing) {
+            existing.replaceWith(createUserRow(user));
+        } else if (!nextUsersUrl || !oldestLoadedCreatedAt || new Date(user.created_at) > oldestLoadedCreatedAt) {
+            // Newer than the loaded rows, so a new user; older ones are on pages not loaded yet
+            tableBody.prepend(createUserRow(user));
+        }
+    });
+    changes.deleted.forEach(userId => {
+        const existing = tableBody.querySelector(`tr[data-user-id="${userId}"]`);
+        if (existing) {
+            existing.remove();
+        }
+    });
+    
+    document.getElementById('noDataMessage').classList.toggle('d-none', tableBody.children.length > 0);
+}
+
 /**
  * Escape HTML to prevent XSS
  */
@@ -150,6 +244,7 @@ async function openEditModal(userId) {
         
         const result = await response.json();
         const user = result.data;
+        editUserEtag = response.headers.get('ETag');
         
         document.getElementById('userId').value = user.id;
         document.getElementById('userName').value = user.name;
@@ -186,22 +281,31 @@ async function saveUser() {
     try {
         let url = `${API_CONFIG.BASE_URL}${API_CONFIG.ENDPOINTS.USERS}`;
         let method = 'POST';
+        const headers = {
+            'Content-Type': 'application/json',
+        };
         
         if (isEditMode && userId) {
             url += `${userId}/`;
             method = 'PUT';
+            // Refuse to overwrite changes made since the user was opened for editing
+            if (editUserEtag) {
+                headers['If-Match'] = editUserEtag;
+            }
         }
         
         const response = await fetch(url, {
             method: method,
-            headers: {
-                'Content-Type': 'application/json',
-            },
+            headers: headers,
             body: JSON.stringify(userData)
         });
         
         const result = await response.json();
         
+        if (response.status === 412) {
+            throw new Error('This user was changed by someone else. Reopen it to see the latest details.');
+        }
+        
         if (!response.ok) {
             let errorMessage = 'Failed to save user. ';
             if (result.errors) {
@@ -212,7 +316,7 @@ async function saveUser() {
         
         userModal.hide();
         showAlert('success', result.message || 'User saved successfully!');
-        loadUsers();
+        syncChanges();
         form.reset();
         form.classList.remove('was-validated');
         
@@ -255,7 +359,7 @@ async function confirmDelete() {
         
         deleteModal.hide();
         showAlert('success', result.message || 'User deleted successfully!');
-        loadUsers();
+        syncChanges();
         deleteUserId = null;
         
     } catch (error) {
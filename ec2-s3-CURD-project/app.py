@@ -2,15 +2,32 @@
 Flask S3 Image Manager
 A Flask application for managing images in AWS S3
 """
+import hashlib
+import itertools
+import mimetypes
 import os
+import re
+import threading
+import time
 import uuid
-from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from flask import Flask, Response, after_this_request, g, render_template, request, redirect, url_for, flash, jsonify, send_file
 import boto3
+from botocore.config import Config as BotoConfig
 from botocore.exceptions import ClientError, NoCredentialsError
 from werkzeug.utils import secure_filename
 from io import BytesIO
+from archive import stream_zip
+from circuit_breaker import CircuitBreaker, HealthProber
 from config import Config
+from image_cache import DiskCache
+from image_index import ImageIndex
+from image_metadata import UnreadableImage, extract_metadata
+from job_queue import JobQueue, JobWorker, PermanentJobError
+import metrics
+from storage import LocalStorage, ObjectNotFound, S3Storage
+from transcode import SOURCE_TYPES, NotTranscodable, choose_variant, transcode, variant_suffix
 
 app = Flask(__name__)
 app.config.from_object(Config)
@@ -18,14 +35,321 @@ app.config.from_object(Config)
 # Allowed file extensions
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp', 'bmp'}
 
+# Maximum number of keys S3 accepts in a single DeleteObjects call
+DELETE_BATCH_SIZE = 1000
+
+# Keys produced by generate_unique_filename are never rewritten, so browsers may cache them for good
+UNIQUE_KEY_PATTERN = re.compile(r'^[0-9a-f]{32}_\d{8}_\d{6}\.[a-z0-9]+$')
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60  # One year
+
+# Read size when hashing uploads
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Query parameters that make /api/images answer from the local index
+SEARCH_PARAMS = {'prefix', 'min_size', 'max_size', 'modified_after', 'modified_before',
+                 'content_type', 'sort', 'limit', 'cursor'}
+MAX_SEARCH_LIMIT = 1000
+
+# Image records written to the index per transaction by sync-index
+SYNC_BATCH_SIZE = 1000
+
+# Job kind for background metadata extraction
+METADATA_JOB = 'metadata'
+
+_image_cache_lock = threading.Lock()
+_image_index_lock = threading.Lock()
+_health_prober_lock = threading.Lock()
+_storage_lock = threading.Lock()
+_variant_cache_lock = threading.Lock()
+_transcode_pool_lock = threading.Lock()
+_job_queue_lock = threading.Lock()
+_metadata_worker_lock = threading.Lock()
+
+# Shared by every S3 client in this process so routes fail fast while S3 is down
+s3_breaker = CircuitBreaker(
+    failure_threshold=app.config['S3_BREAKER_FAILURE_THRESHOLD'],
+    window_size=app.config['S3_BREAKER_WINDOW'],
+    min_calls=app.config['S3_BREAKER_MIN_CALLS'],
+    reset_timeout=app.config['S3_BREAKER_RESET_TIMEOUT']
+)
+
+# Exposed on /metrics; counts are per process
+metrics_registry = metrics.Registry()
+http_request_duration = metrics_registry.register(metrics.Histogram(
+    'http_request_duration_seconds', 'Time to produce a response, by endpoint', ['method', 'endpoint', 'status']))
+http_response_size = metrics_registry.register(metrics.Histogram(
+    'http_response_size_bytes', 'Response body size when known up front, by endpoint', ['method', 'endpoint'],
+    buckets=metrics.SIZE_BUCKETS))
+http_requests_in_flight = metrics_registry.register(metrics.Gauge(
+    'http_requests_in_flight', 'Requests currently being handled', []))
+s3_metrics = metrics.S3Instrumentation(metrics_registry)
+
 def get_s3_client():
     """Create and return an S3 client"""
     try:
-        s3_client = boto3.client('s3', region_name='us-east-1')
+        s3_client = boto3.client(
+            's3',
+            region_name=app.config['AWS_REGION'],
+            endpoint_url=app.config['S3_ENDPOINT_URL'],
+            config=BotoConfig(
+                connect_timeout=app.config['S3_CONNECT_TIMEOUT'],
+                read_timeout=app.config['S3_READ_TIMEOUT'],
+                retries={'max_attempts': app.config['S3_MAX_ATTEMPTS'], 'mode': 'standard'}
+            )
+        )
+        s3_breaker.attach(s3_client)
+        s3_metrics.attach(s3_client)
         return s3_client
     except NoCredentialsError:
         return None
 
+def get_storage():
+    """Return the configured storage backend, or None when S3 is unreachable"""
+    if app.config['STORAGE_BACKEND'] == 'local':
+        root = os.path.abspath(app.config['LOCAL_STORAGE_DIR'])
+        with _storage_lock:
+            storage = app.extensions.get('local_storage')
+            if storage is None or storage.root != root:
+                storage = LocalStorage(root)
+                app.extensions['local_storage'] = storage
+            return storage
+    
+    s3_client = get_s3_client()
+    if not s3_client:
+        return None
+    return S3Storage(s3_client, app.config['S3_BUCKET_NAME'])
+
+def get_health_prober():
+    """Return this process's background storage prober, or None when it was not started"""
+    prober = app.extensions.get('health_prober')
+    # Threads do not survive fork, so a prober started before the fork is not running here
+    if prober is None or prober.pid != os.getpid():
+        return None
+    return prober
+
+def start_health_prober():
+    """Start this process's background storage prober, unless S3_HEALTH_PROBE_INTERVAL is 0"""
+    interval = app.config.get('S3_HEALTH_PROBE_INTERVAL')
+    if not interval:
+        return None
+    
+    with _health_prober_lock:
+        prober = get_health_prober()
+        if prober is None:
+            prober = HealthProber(lambda: get_storage().check(), interval)
+            app.extensions['health_prober'] = prober
+            prober.start()
+        return prober
+
+def start_background_threads():
+    """Start the background threads of a serving process.
+    
+    Called once per worker process by gunicorn.conf.py, the async entry point
+    and `python app.py`; tests and CLI commands do not start them.
+    """
+    start_health_prober()
+    worker = get_metadata_worker()
+    if worker:
+        worker.start()
+
+def get_job_queue():
+    """Return the shared job queue, kept in the image index database, or None when INDEX_DB_PATH is not set"""
+    db_path = app.config.get('INDEX_DB_PATH')
+    if not db_path:
+        return None
+    db_path = os.path.abspath(db_path)
+    
+    with _job_queue_lock:
+        queue = app.extensions.get('job_queue')
+        if queue is None or queue.path != db_path:
+            queue = JobQueue(db_path)
+            app.extensions['job_queue'] = queue
+        return queue
+
+def get_metadata_worker():
+    """Return this process's metadata extraction worker.
+    
+    Returns None when there is no job queue. Its threads are started by
+    start_background_threads; until then, or with METADATA_WORKERS 0, it
+    only runs jobs when asked (extract-metadata command).
+    """
+    queue = get_job_queue()
+    if not queue:
+        return None
+    
+    with _metadata_worker_lock:
+        worker = app.extensions.get('metadata_worker')
+        # Threads do not survive fork, so each worker process starts its own
+        if worker is None or worker.pid != os.getpid() or worker.queue is not queue:
+            if worker is not None:
+                worker.stop()
+            worker = JobWorker(
+                queue,
+                {METADATA_JOB: extract_image_metadata},
+                workers=app.config['METADATA_WORKERS'],
+                max_attempts=app.config['METADATA_MAX_ATTEMPTS'],
+                retry_delay=app.config['METADATA_RETRY_DELAY'],
+                poll_interval=app.config['METADATA_POLL_INTERVAL']
+            )
+            app.extensions['metadata_worker'] = worker
+        return worker
+
+def queue_metadata_extraction(key):
+    """Queue background metadata extraction for a stored image; costs one SQLite insert"""
+    worker = get_metadata_worker()
+    if worker:
+        worker.queue.enqueue(METADATA_JOB, key)
+        worker.notify()
+
+def extract_image_metadata(key):
+    """Job handler: read an image from storage and record its metadata in the index"""
+    storage = get_storage()
+    index = get_image_index()
+    if not storage or not index:
+        raise RuntimeError('Storage or image index unavailable')
+    
+    try:
+        info, body = storage.open(key)
+    except ObjectNotFound as e:
+        raise PermanentJobError(str(e))
+    with body:
+        source = BytesIO(body.read())
+    
+    try:
+        metadata = extract_metadata(source)
+    except UnreadableImage as e:
+        raise PermanentJobError(str(e))
+    index.set_metadata(key, metadata)
+
+def get_image_cache():
+    """Return the shared on-disk image cache, or None when IMAGE_CACHE_DIR is not set"""
+    cache_dir = app.config.get('IMAGE_CACHE_DIR')
+    if not cache_dir:
+        return None
+    cache_dir = os.path.abspath(cache_dir)
+    
+    with _image_cache_lock:
+        cache = app.extensions.get('image_cache')
+        if cache is None or cache.directory != cache_dir:
+            cache = DiskCache(cache_dir, app.config['IMAGE_CACHE_MAX_BYTES'])
+            app.extensions['image_cache'] = cache
+        return cache
+
+def variants_enabled():
+    """Whether images are resized and re-encoded on request; operators opt in with IMAGE_VARIANT_DIR"""
+    return bool(app.config.get('IMAGE_VARIANT_DIR'))
+
+def get_variant_cache():
+    """Return the shared on-disk cache of image variants, or None when IMAGE_VARIANT_DIR is not set"""
+    cache_dir = app.config.get('IMAGE_VARIANT_DIR')
+    if not cache_dir:
+        return None
+    cache_dir = os.path.abspath(cache_dir)
+    
+    with _variant_cache_lock:
+        cache = app.extensions.get('variant_cache')
+        if cache is None or cache.directory != cache_dir:
+            cache = DiskCache(cache_dir, app.config['IMAGE_VARIANT_MAX_BYTES'])
+            app.extensions['variant_cache'] = cache
+        return cache
+
+def get_transcode_pool():
+    """Return the shared worker pool that encodes image variants"""
+    with _transcode_pool_lock:
+        pool = app.extensions.get('transcode_pool')
+        if pool is None:
+            pool = ThreadPoolExecutor(max_workers=app.config['TRANSCODE_MAX_WORKERS'], thread_name_prefix='transcode')
+            app.extensions['transcode_pool'] = pool
+        return pool
+
+def get_image_index():
+    """Return the shared image index, or None when INDEX_DB_PATH is not set"""
+    db_path = app.config.get('INDEX_DB_PATH')
+    if not db_path:
+        return None
+    db_path = os.path.abspath(db_path)
+    
+    with _image_index_lock:
+        index = app.extensions.get('image_index')
+        if index is None or index.path != db_path:
+            index = ImageIndex(db_path)
+            app.extensions['image_index'] = index
+        return index
+
+def forget_keys(keys):
+    """Drop local state (cached copies, index entries) for deleted keys"""
+    cache = get_image_cache()
+    if cache:
+        for key in keys:
+            cache.discard(key)
+    
+    variant_cache = get_variant_cache()
+    if variant_cache:
+        for key in keys:
+            variant_cache.discard_prefix(variant_cache_key(key, None))
+    
+    index = get_image_index()
+    if index:
+        index.remove_keys(keys)
+    
+    queue = get_job_queue()
+    if queue:
+        queue.remove_keys(METADATA_JOB, keys)
+
+def fetch_object(storage, key):
+    """Fetch an object in the shape DiskCache.get_or_fetch expects"""
+    info, body = storage.open(key)
+    return {
+        'body': body,
+        'etag': info.etag,
+        'content_type': info.content_type or 'image/jpeg',
+        'last_modified': info.last_modified
+    }
+
+def variant_cache_key(key, variant):
+    """Variant cache key; with variant None, the prefix shared by every variant of key"""
+    return f'{key}\0{variant_suffix(variant) if variant else ""}'
+
+def fetch_variant(storage, key, variant):
+    """Transcode an object in the worker pool, in the shape DiskCache.get_or_fetch expects"""
+    info, body = storage.open(key)
+    with body:
+        source = BytesIO(body.read())
+    data = get_transcode_pool().submit(transcode, source, variant).result()
+    return {
+        'body': BytesIO(data),
+        'etag': info.etag,
+        'content_type': variant.content_type,
+        'last_modified': info.last_modified
+    }
+
+def serve_variant(storage, key, variant):
+    """Serve a resized or re-encoded image, producing it at most once per source ETag"""
+    cache = get_variant_cache()
+    cache_key = variant_cache_key(key, variant)
+    
+    entry = cache.get(cache_key) if cache and UNIQUE_KEY_PATTERN.match(key) else None
+    if entry:
+        source_etag, last_modified = entry.etag, entry.last_modified
+    else:
+        info = storage.head(key)
+        source_etag, last_modified = info.etag, info.last_modified
+    etag = f'{source_etag}-{variant_suffix(variant)}'
+    
+    if is_not_modified(etag, last_modified):
+        return set_cache_headers(app.response_class(status=304), key, etag, last_modified)
+    
+    if cache:
+        entry = entry or cache.get_or_fetch(cache_key, source_etag, lambda: fetch_variant(storage, key, variant))
+        try:
+            response = send_file(entry.path, mimetype=entry.content_type, etag=False, last_modified=last_modified)
+            return set_cache_headers(response, key, etag, last_modified)
+        except FileNotFoundError:
+            cache.discard(cache_key)
+    
+    obj = fetch_variant(storage, key, variant)
+    return set_cache_headers(send_file(obj['body'], mimetype=obj['content_type']), key, etag, last_modified)
+
 def allowed_file(filename):
     """Check if file extension is allowed"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -36,6 +360,183 @@ def generate_unique_filename(filename):
     unique_name = f"{uuid.uuid4().hex}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{ext}"
     return unique_name
 
+def hash_file(file):
+    """Return (SHA-256 hex digest, size) of an uploaded file, leaving the stream at its start"""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: file.stream.read(HASH_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    size = file.stream.tell()
+    file.stream.seek(0)
+    return digest.hexdigest(), size
+
+def index_timestamp(value):
+    """Format a datetime the way the image index stores and compares it (UTC, to the second)"""
+    return value.astimezone(timezone.utc).isoformat(timespec='seconds')
+
+def is_image_key(key):
+    """Check if a key has one of the allowed image extensions"""
+    return any(key.lower().endswith(ext) for ext in ALLOWED_EXTENSIONS)
+
+def find_duplicate(storage, sha256):
+    """Return the key identical bytes were already stored under, or None"""
+    index = get_image_index()
+    if not index:
+        return None
+    existing = index.find_by_hash(sha256)
+    if existing:
+        if storage.exists(existing):
+            return existing
+        # Deleted outside the app, forget it and upload again
+        index.remove_hash(sha256)
+    return None
+
+def record_upload(key, sha256, size, content_type):
+    """Add a newly stored upload to the image index and queue its metadata extraction"""
+    index = get_image_index()
+    if not index:
+        return
+    index.add_hash(sha256, key)
+    index.add_images([{
+        'key': key,
+        'size': size,
+        'last_modified': index_timestamp(datetime.now(timezone.utc)),
+        'content_type': content_type
+    }])
+    queue_metadata_extraction(key)
+
+def store_upload(storage, file):
+    """Store an uploaded file under a unique key, returns (filename, original_filename, duplicate).
+    
+    When identical bytes were uploaded before, the existing key is returned
+    and nothing is written to storage.
+    """
+    original_filename = secure_filename(file.filename)
+    sha256, size = hash_file(file)
+    
+    existing = find_duplicate(storage, sha256)
+    if existing:
+        return existing, original_filename, True
+    
+    unique_filename = generate_unique_filename(original_filename)
+    storage.put(
+        unique_filename,
+        file,
+        file.content_type,
+        {'original_filename': original_filename, 'sha256': sha256}
+    )
+    record_upload(unique_filename, sha256, size, file.content_type)
+    return unique_filename, original_filename, False
+
+def sync_index(storage, index):
+    """Bring the image index in line with storage, returns (indexed, pruned) counts"""
+    started = time.time()
+    seen = []
+    images = []
+    for info in storage.list():
+        if not is_image_key(info.key):
+            continue
+        images.append({
+            'key': info.key,
+            'size': info.size,
+            'last_modified': index_timestamp(info.last_modified),
+            'content_type': info.content_type or mimetypes.guess_type(info.key)[0]
+        })
+        seen.append(info.key)
+        if len(images) == SYNC_BATCH_SIZE:
+            index.add_images(images)
+            images = []
+    index.add_images(images)
+    
+    # Records written by uploads while the listing ran are newer than started and survive
+    pruned = index.prune_images(seen, started)
+    return len(seen), pruned
+
+def parse_datetime(value):
+    """Parse an ISO 8601 string into an aware datetime (naive values are taken as UTC)"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+def parse_int(name, default=None):
+    """Read an integer query parameter, raising ValueError when it is not one"""
+    value = request.args.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f'{name} must be an integer')
+
+def list_keys(storage, prefix='', modified_after=None, modified_before=None):
+    """Yield every key under prefix, optionally limited to a LastModified window"""
+    for info in storage.list(prefix):
+        if modified_after and info.last_modified < modified_after:
+            continue
+        if modified_before and info.last_modified >= modified_before:
+            continue
+        yield info.key
+
+def is_not_modified(etag, last_modified):
+    """Check the request's If-None-Match / If-Modified-Since against an object's validators"""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified:
+        # HTTP dates have one-second resolution
+        return last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+def set_cache_headers(response, key, etag, last_modified):
+    """Attach validators and a Cache-Control policy for a stored object"""
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    if UNIQUE_KEY_PATTERN.match(key):
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+@app.before_request
+def start_request_timer():
+    """Start timing the request and count it as in flight"""
+    g.request_started = time.monotonic()
+    g.request_timings = metrics.RequestTimings()
+    g.request_timings_token = metrics.current_timings.set(g.request_timings)
+    http_requests_in_flight.inc()
+
+@app.after_request
+def record_request_metrics(response):
+    """Record latency and size for the endpoint and add a Server-Timing header"""
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    elapsed = time.monotonic() - started
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    
+    http_request_duration.observe(elapsed, method=request.method, endpoint=endpoint, status=response.status_code)
+    if response.content_length is not None:
+        http_response_size.observe(response.content_length, method=request.method, endpoint=endpoint)
+    
+    # Streamed bodies are still being produced at this point, so app covers time to first byte
+    timings = g.request_timings
+    server_timing = [f'app;dur={elapsed * 1000:.2f}']
+    if timings.s3_calls:
+        server_timing.append(f'storage;dur={timings.s3_seconds * 1000:.2f};desc="{timings.s3_calls} S3 calls"')
+    response.headers['Server-Timing'] = ', '.join(server_timing)
+    return response
+
+@app.teardown_request
+def finish_request(exc):
+    """Stop counting the request as in flight, even when it raised"""
+    token = g.pop('request_timings_token', None)
+    if token is not None:
+        metrics.current_timings.reset(token)
+        http_requests_in_flight.dec()
+
 @app.route('/')
 def index():
     """Home page - display upload form and list of images"""
@@ -43,24 +544,19 @@ def index():
     error = None
     
     try:
-        s3_client = get_s3_client()
-        if s3_client:
-            bucket_name = app.config['S3_BUCKET_NAME']
-            response = s3_client.list_objects_v2(Bucket=bucket_name)
-            
-            if 'Contents' in response:
-                for obj in response['Contents']:
-                    # Only show image files
-                    key = obj['Key']
-                    if any(key.lower().endswith(ext) for ext in ALLOWED_EXTENSIONS):
-                        # Use Flask route to serve images (works with IAM roles)
-                        images.append({
-                            'key': key,
-                            'url': url_for('serve_image', key=key),
-                            'size': obj['Size'],
-                            'last_modified': obj['LastModified'].strftime('%Y-%m-%d %H:%M:%S'),
-                            'size_kb': round(obj['Size'] / 1024, 2)
-                        })
+        storage = get_storage()
+        if storage:
+            for info in storage.list():
+                # Only show image files
+                if is_image_key(info.key):
+                    # Use Flask route to serve images (works with IAM roles)
+                    images.append({
+                        'key': info.key,
+                        'url': url_for('serve_image', key=info.key),
+                        'size': info.size,
+                        'last_modified': info.last_modified.strftime('%Y-%m-%d %H:%M:%S'),
+                        'size_kb': round(info.size / 1024, 2)
+                    })
         else:
             error = "Failed to connect to AWS S3. Check your credentials."
     except ClientError as e:
@@ -88,28 +584,18 @@ def upload():
         return redirect(url_for('index'))
     
     try:
-        s3_client = get_s3_client()
-        if not s3_client:
+        storage = get_storage()
+        if not storage:
             flash('Failed to connect to S3', 'error')
             return redirect(url_for('index'))
         
-        # Generate unique filename
-        original_filename = secure_filename(file.filename)
-        unique_filename = generate_unique_filename(original_filename)
-        
-        # Upload to S3
-        bucket_name = app.config['S3_BUCKET_NAME']
-        s3_client.upload_fileobj(
-            file,
-            bucket_name,
-            unique_filename,
-            ExtraArgs={
-                'ContentType': file.content_type,
-                'Metadata': {'original_filename': original_filename}
-            }
-        )
+        # Store under a unique filename
+        unique_filename, original_filename, duplicate = store_upload(storage, file)
         
-        flash(f'Successfully uploaded: {original_filename}', 'success')
+        if duplicate:
+            flash(f'Already uploaded: {original_filename} is stored as {unique_filename}', 'success')
+        else:
+            flash(f'Successfully uploaded: {original_filename}', 'success')
     except ClientError as e:
         flash(f'Upload failed: {str(e)}', 'error')
     except Exception as e:
@@ -121,13 +607,13 @@ def upload():
 def delete(key):
     """Delete an image from S3"""
     try:
-        s3_client = get_s3_client()
-        if not s3_client:
+        storage = get_storage()
+        if not storage:
             flash('Failed to connect to S3', 'error')
             return redirect(url_for('index'))
         
-        bucket_name = app.config['S3_BUCKET_NAME']
-        s3_client.delete_object(Bucket=bucket_name, Key=key)
+        storage.delete(key)
+        forget_keys([key])
         flash(f'Successfully deleted: {key}', 'success')
     except ClientError as e:
         flash(f'Delete failed: {str(e)}', 'error')
@@ -138,47 +624,114 @@ def delete(key):
 
 @app.route('/image/<path:key>')
 def serve_image(key):
-    """Serve an image from S3 (for display in browser)"""
+    """Serve an image from storage (for display in browser)"""
+    width = request.args.get('w')
+    if width is not None:
+        if not width.isdigit() or int(width) == 0:
+            return "Invalid width", 400
+        width = int(width)
+    
+    content_type = mimetypes.guess_type(key)[0]
+    negotiate = content_type in SOURCE_TYPES and variants_enabled()
+    if negotiate:
+        # The same URL answers with different bytes depending on Accept
+        @after_this_request
+        def vary_on_accept(response):
+            response.vary.add('Accept')
+            return response
+    
     try:
-        s3_client = get_s3_client()
-        if not s3_client:
+        storage = get_storage()
+        if not storage:
             return "S3 connection failed", 500
         
-        bucket_name = app.config['S3_BUCKET_NAME']
-        response = s3_client.get_object(Bucket=bucket_name, Key=key)
+        variant = negotiate and choose_variant(request.accept_mimetypes, content_type, width,
+                                               app.config['IMAGE_VARIANT_WIDTHS'])
+        if variant:
+            try:
+                return serve_variant(storage, key, variant)
+            except NotTranscodable:
+                pass  # Served as stored below
         
-        file_stream = BytesIO(response['Body'].read())
-        content_type = response.get('ContentType', 'image/jpeg')
+        # Files the backend already keeps on local disk are sent as they are
+        path = storage.local_path(key)
+        if path:
+            info = storage.head(key)
+            if is_not_modified(info.etag, info.last_modified):
+                return set_cache_headers(app.response_class(status=304), key, info.etag, info.last_modified)
+            response = send_file(
+                path,
+                mimetype=info.content_type or 'image/jpeg',
+                etag=False,
+                last_modified=info.last_modified
+            )
+            return set_cache_headers(response, key, info.etag, info.last_modified)
         
-        return send_file(
-            file_stream,
-            mimetype=content_type
+        cache = get_image_cache()
+        
+        # Uploader keys are never rewritten, so any cached copy is current without asking S3
+        entry = cache.get(key) if cache and UNIQUE_KEY_PATTERN.match(key) else None
+        if entry:
+            etag, last_modified = entry.etag, entry.last_modified
+        elif cache or request.if_none_match or request.if_modified_since:
+            # Revalidation and cache lookups only need the object's metadata, not its body
+            info = storage.head(key)
+            etag, last_modified = info.etag, info.last_modified
+        else:
+            etag = last_modified = None
+        
+        if etag and is_not_modified(etag, last_modified):
+            return set_cache_headers(app.response_class(status=304), key, etag, last_modified)
+        
+        if cache:
+            entry = entry or cache.get_or_fetch(key, etag, lambda: fetch_object(storage, key))
+            try:
+                # A file path lets the WSGI server hand the body to sendfile()
+                response = send_file(
+                    entry.path,
+                    mimetype=entry.content_type,
+                    etag=False,
+                    last_modified=entry.last_modified
+                )
+                return set_cache_headers(response, key, entry.etag, entry.last_modified)
+            except FileNotFoundError:
+                # Evicted by another worker process, fall back to S3
+                cache.discard(key)
+        
+        info, body = storage.open(key)
+        with body:
+            file_stream = BytesIO(body.read())
+        
+        return set_cache_headers(
+            send_file(file_stream, mimetype=info.content_type or 'image/jpeg'),
+            key,
+            info.etag,
+            info.last_modified
         )
     except Exception as e:
         return f"Error: {str(e)}", 404
 
 @app.route('/download/<path:key>')
 def download(key):
-    """Download an image from S3"""
+    """Download an image from storage"""
     try:
-        s3_client = get_s3_client()
-        if not s3_client:
+        storage = get_storage()
+        if not storage:
             flash('Failed to connect to S3', 'error')
             return redirect(url_for('index'))
         
-        bucket_name = app.config['S3_BUCKET_NAME']
-        
         # Get the object
-        response = s3_client.get_object(Bucket=bucket_name, Key=key)
+        info, body = storage.open(key)
         
         # Create a file-like object
-        file_stream = BytesIO(response['Body'].read())
+        with body:
+            file_stream = BytesIO(body.read())
         
         return send_file(
             file_stream,
             as_attachment=True,
             download_name=key,
-            mimetype=response['ContentType']
+            mimetype=info.content_type
         )
     except ClientError as e:
         flash(f'Download failed: {str(e)}', 'error')
@@ -187,32 +740,121 @@ def download(key):
         flash(f'Error: {str(e)}', 'error')
         return redirect(url_for('index'))
 
+@app.route('/api/download/zip', methods=['GET', 'POST'])
+def api_download_zip():
+    """Stream a ZIP archive of several images, chosen by key list or prefix"""
+    if request.method == 'POST':
+        payload = request.get_json(silent=True) or {}
+        keys = payload.get('keys')
+        prefix = payload.get('prefix', '')
+    else:
+        keys = request.args.getlist('key')
+        prefix = request.args.get('prefix', '')
+    
+    if not keys and not prefix:
+        return jsonify({'error': 'Provide a list of keys or a prefix'}), 400
+    if keys and not isinstance(keys, list):
+        return jsonify({'error': 'keys must be a list'}), 400
+    
+    try:
+        storage = get_storage()
+        if not storage:
+            return jsonify({'error': 'Failed to connect to S3'}), 500
+        
+        if keys:
+            keys = iter(dict.fromkeys(keys))
+        else:
+            # Listed lazily, so huge prefixes are never held in memory
+            keys = (info.key for info in storage.list(prefix) if is_image_key(info.key))
+            first = next(keys, None)
+            if first is None:
+                return jsonify({'error': f'No images found under prefix: {prefix}'}), 404
+            keys = itertools.chain([first], keys)
+        
+        return Response(
+            stream_zip(storage, keys, app.config['ZIP_PREFETCH']),
+            mimetype='application/zip',
+            headers={'Content-Disposition': 'attachment; filename=images.zip'}
+        )
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/images')
 def api_list_images():
-    """API endpoint to list all images"""
+    """API endpoint to list all images, or search the local index when filters are given"""
+    if SEARCH_PARAMS & set(request.args):
+        return api_search_images()
+    
     try:
-        s3_client = get_s3_client()
-        if not s3_client:
+        storage = get_storage()
+        if not storage:
             return jsonify({'error': 'Failed to connect to S3'}), 500
         
-        bucket_name = app.config['S3_BUCKET_NAME']
-        response = s3_client.list_objects_v2(Bucket=bucket_name)
-        
         images = []
-        if 'Contents' in response:
-            for obj in response['Contents']:
-                key = obj['Key']
-                if any(key.lower().endswith(ext) for ext in ALLOWED_EXTENSIONS):
-                    images.append({
-                        'key': key,
-                        'size': obj['Size'],
-                        'last_modified': obj['LastModified'].isoformat()
-                    })
+        for info in storage.list():
+            if is_image_key(info.key):
+                images.append({
+                    'key': info.key,
+                    'size': info.size,
+                    'last_modified': info.last_modified.isoformat()
+                })
         
         return jsonify({'images': images, 'count': len(images)})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def api_search_images():
+    """Answer a filtered /api/images request from the local image index"""
+    index = get_image_index()
+    if not index:
+        return jsonify({'error': 'Search requires the image index (INDEX_DB_PATH)'}), 400
+    
+    args = request.args
+    sort = args.get('sort', 'key')
+    descending = sort.startswith('-')
+    
+    try:
+        modified_after = parse_datetime(args.get('modified_after'))
+        modified_before = parse_datetime(args.get('modified_before'))
+        limit = parse_int('limit', 100)
+        if not 1 <= limit <= MAX_SEARCH_LIMIT:
+            raise ValueError(f'limit must be between 1 and {MAX_SEARCH_LIMIT}')
+        
+        images, next_cursor = index.search(
+            prefix=args.get('prefix'),
+            min_size=parse_int('min_size'),
+            max_size=parse_int('max_size'),
+            modified_after=index_timestamp(modified_after) if modified_after else None,
+            modified_before=index_timestamp(modified_before) if modified_before else None,
+            content_type=args.get('content_type'),
+            sort=sort.lstrip('-'),
+            descending=descending,
+            limit=limit,
+            cursor=args.get('cursor')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({'images': images, 'count': len(images), 'next_cursor': next_cursor})
+
+@app.route('/api/images/<path:key>/metadata')
+def api_image_metadata(key):
+    """Extracted metadata for an image, or the state of its pending extraction job"""
+    index = get_image_index()
+    queue = get_job_queue()
+    if not index or not queue:
+        return jsonify({'error': 'The image index is disabled'}), 404
+    
+    job = queue.get(METADATA_JOB, key)
+    metadata = index.get_metadata(key)
+    if job:
+        # Re-uploads queue a fresh job; earlier metadata is returned alongside it
+        return jsonify({'key': key, 'status': job['status'], 'attempts': job['attempts'],
+                        'error': job['error'], 'metadata': metadata}), 200 if metadata else 202
+    if metadata is None:
+        return jsonify({'error': f'No metadata for: {key}'}), 404
+    return jsonify({'key': key, 'status': 'done', 'metadata': metadata})
+
 @app.route('/api/upload', methods=['POST'])
 def api_upload():
     """API endpoint for file upload"""
@@ -228,28 +870,168 @@ def api_upload():
         return jsonify({'error': f'Invalid file type. Allowed: {", ".join(ALLOWED_EXTENSIONS)}'}), 400
     
     try:
-        s3_client = get_s3_client()
-        if not s3_client:
+        storage = get_storage()
+        if not storage:
             return jsonify({'error': 'Failed to connect to S3'}), 500
         
-        original_filename = secure_filename(file.filename)
+        unique_filename, original_filename, duplicate = store_upload(storage, file)
+        
+        return jsonify({
+            'message': 'Upload successful',
+            'filename': unique_filename,
+            'original_filename': original_filename,
+            'duplicate': duplicate
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/upload/batch', methods=['POST'])
+def api_upload_batch():
+    """API endpoint for uploading several files in one request"""
+    files = request.files.getlist('files') + request.files.getlist('file')
+    if not files:
+        return jsonify({'error': 'No files provided'}), 400
+    
+    storage = get_storage()
+    if not storage:
+        return jsonify({'error': 'Failed to connect to S3'}), 500
+    
+    results = [None] * len(files)
+    pending = []
+    
+    # Validate every part up front; rejected parts are reported, not raised
+    for i, file in enumerate(files):
+        if file.filename == '':
+            results[i] = {'original_filename': '', 'status': 'error', 'error': 'No file selected'}
+        elif not allowed_file(file.filename):
+            results[i] = {
+                'original_filename': file.filename,
+                'status': 'error',
+                'error': f'Invalid file type. Allowed: {", ".join(ALLOWED_EXTENSIONS)}'
+            }
+        else:
+            pending.append(i)
+    
+    # Upload the valid parts concurrently, sharing one backend (and its thread-safe client)
+    if pending:
+        max_workers = min(app.config['UPLOAD_MAX_WORKERS'], len(pending))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                i: executor.submit(store_upload, storage, files[i])
+                for i in pending
+            }
+            for i, future in futures.items():
+                try:
+                    unique_filename, original_filename, duplicate = future.result()
+                    results[i] = {
+                        'original_filename': original_filename,
+                        'filename': unique_filename,
+                        'status': 'duplicate' if duplicate else 'uploaded'
+                    }
+                except Exception as e:
+                    results[i] = {
+                        'original_filename': files[i].filename,
+                        'status': 'error',
+                        'error': str(e)
+                    }
+    
+    failed = sum(1 for result in results if result['status'] == 'error')
+    return jsonify({
+        'results': results,
+        'uploaded': len(results) - failed,
+        'failed': failed
+    }), 207 if failed else 200
+
+@app.route('/api/upload/presign', methods=['POST'])
+def api_upload_presign():
+    """API endpoint issuing a presigned POST so the browser uploads straight to S3"""
+    payload = request.get_json(silent=True) or {}
+    filename = payload.get('filename') or ''
+    content_type = payload.get('content_type') or ''
+    
+    if not filename:
+        return jsonify({'error': 'No filename provided'}), 400
+    if not allowed_file(filename):
+        return jsonify({'error': f'Invalid file type. Allowed: {", ".join(ALLOWED_EXTENSIONS)}'}), 400
+    if not content_type.startswith('image/'):
+        return jsonify({'error': 'content_type must be an image type'}), 400
+    
+    try:
+        storage = get_storage()
+        if not storage:
+            return jsonify({'error': 'Failed to connect to S3'}), 500
+        
+        original_filename = secure_filename(filename)
         unique_filename = generate_unique_filename(original_filename)
         
-        bucket_name = app.config['S3_BUCKET_NAME']
-        s3_client.upload_fileobj(
-            file,
-            bucket_name,
+        # S3 rejects the upload unless it matches these exact fields and the size limit
+        fields = {
+            'Content-Type': content_type,
+            'x-amz-meta-original_filename': original_filename
+        }
+        conditions = [
+            {'Content-Type': content_type},
+            {'x-amz-meta-original_filename': original_filename},
+            ['content-length-range', 1, app.config['MAX_CONTENT_LENGTH']]
+        ]
+        post = storage.presigned_post(
             unique_filename,
-            ExtraArgs={
-                'ContentType': file.content_type,
-                'Metadata': {'original_filename': original_filename}
-            }
+            fields,
+            conditions,
+            app.config['PRESIGNED_POST_EXPIRES']
         )
         
         return jsonify({
-            'message': 'Upload successful',
+            'url': post['url'],
+            'fields': post['fields'],
             'filename': unique_filename,
-            'original_filename': original_filename
+            'original_filename': original_filename,
+            'expires_in': app.config['PRESIGNED_POST_EXPIRES']
+        })
+    except NotImplementedError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/upload/complete', methods=['POST'])
+def api_upload_complete():
+    """API endpoint the browser calls after a presigned POST to record the new object"""
+    payload = request.get_json(silent=True) or {}
+    key = payload.get('filename') or ''
+    
+    # Only keys handed out by api_upload_presign can be completed
+    if not UNIQUE_KEY_PATTERN.match(key) or not allowed_file(key):
+        return jsonify({'error': 'Invalid filename'}), 400
+    
+    try:
+        storage = get_storage()
+        if not storage:
+            return jsonify({'error': 'Failed to connect to S3'}), 500
+        
+        try:
+            info = storage.head(key)
+        except ObjectNotFound:
+            return jsonify({'error': f'Upload not found: {key}'}), 404
+        
+        index = get_image_index()
+        if index:
+            index.add_images([{
+                'key': key,
+                'size': info.size,
+                'last_modified': index_timestamp(info.last_modified),
+                'content_type': info.content_type
+            }])
+        queue_metadata_extraction(key)
+        
+        # Some S3-compatible stores hand metadata names back with underscores turned into hyphens
+        metadata = info.metadata or {}
+        original_filename = metadata.get('original_filename') or metadata.get('original-filename') or key
+        
+        return jsonify({
+            'message': 'Upload successful',
+            'filename': key,
+            'original_filename': original_filename,
+            'size': info.size
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -258,17 +1040,66 @@ def api_upload():
 def api_delete(key):
     """API endpoint to delete an image"""
     try:
-        s3_client = get_s3_client()
-        if not s3_client:
+        storage = get_storage()
+        if not storage:
             return jsonify({'error': 'Failed to connect to S3'}), 500
         
-        bucket_name = app.config['S3_BUCKET_NAME']
-        s3_client.delete_object(Bucket=bucket_name, Key=key)
+        storage.delete(key)
+        forget_keys([key])
         
         return jsonify({'message': f'Successfully deleted: {key}'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/delete/batch', methods=['POST'])
+def api_delete_batch():
+    """API endpoint to delete many images, by key list or by prefix/date filter"""
+    payload = request.get_json(silent=True) or {}
+    keys = payload.get('keys')
+    prefix = payload.get('prefix', '')
+    
+    try:
+        modified_after = parse_datetime(payload.get('modified_after'))
+        modified_before = parse_datetime(payload.get('modified_before'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Dates must be ISO 8601 strings'}), 400
+    
+    # Refuse an empty filter rather than wiping the whole bucket
+    if not keys and not (prefix or modified_after or modified_before):
+        return jsonify({'error': 'Provide a list of keys, a prefix or a date filter'}), 400
+    if keys is not None and not (isinstance(keys, list) and all(isinstance(key, str) and key for key in keys)):
+        return jsonify({'error': 'keys must be a list of non-empty strings'}), 400
+    
+    try:
+        storage = get_storage()
+        if not storage:
+            return jsonify({'error': 'Failed to connect to S3'}), 500
+        
+        if keys:
+            keys = list(dict.fromkeys(keys))
+        else:
+            # A filter only selects images, like the listing; other objects in the bucket are left alone
+            keys = [key for key in list_keys(storage, prefix, modified_after, modified_before) if is_image_key(key)]
+        
+        batches = [keys[i:i + DELETE_BATCH_SIZE] for i in range(0, len(keys), DELETE_BATCH_SIZE)]
+        errors = []
+        if batches:
+            max_workers = min(app.config['DELETE_MAX_WORKERS'], len(batches))
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for batch_errors in executor.map(storage.delete_many, batches):
+                    errors.extend(batch_errors)
+        
+        failed_keys = {error['key'] for error in errors}
+        forget_keys([key for key in keys if key not in failed_keys])
+        
+        return jsonify({
+            'deleted': len(keys) - len(errors),
+            'failed': len(errors),
+            'errors': errors
+        }), 207 if errors else 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/health')
 def health():
     """Health check endpoint for monitoring"""
@@ -280,25 +1111,70 @@ def health():
 
 @app.route('/health/s3')
 def health_s3():
-    """S3 connectivity health check"""
+    """Storage health check, answered from the background prober when it is running"""
+    prober = get_health_prober()
+    if prober and prober.last_result:
+        result = dict(
+            prober.last_result,
+            backend=app.config['STORAGE_BACKEND'],
+            bucket=app.config['S3_BUCKET_NAME'],
+            circuit=s3_breaker.state
+        )
+        return jsonify(result), 200 if result['status'] == 'healthy' else 500
+    
     try:
-        s3_client = get_s3_client()
-        if not s3_client:
+        storage = get_storage()
+        if not storage:
             return jsonify({'status': 'unhealthy', 'error': 'No credentials'}), 500
         
-        bucket_name = app.config['S3_BUCKET_NAME']
-        s3_client.head_bucket(Bucket=bucket_name)
+        storage.check()
         
         return jsonify({
             'status': 'healthy',
-            'bucket': bucket_name,
+            'backend': storage.name,
+            'bucket': app.config['S3_BUCKET_NAME'],
+            'circuit': s3_breaker.state,
             'timestamp': datetime.now().isoformat()
         })
     except Exception as e:
-        return jsonify({'status': 'unhealthy', 'error': str(e)}), 500
+        return jsonify({'status': 'unhealthy', 'error': str(e), 'circuit': s3_breaker.state}), 500
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Request and S3 metrics in the Prometheus text format"""
+    return Response(metrics_registry.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.cli.command('sync-index')
+def sync_index_command():
+    """Index every image in storage and drop records for deleted objects"""
+    index = get_image_index()
+    if not index:
+        print('INDEX_DB_PATH is not set, nothing to sync')
+        return
+    
+    indexed, pruned = sync_index(get_storage(), index)
+    print(f'Indexed {indexed} images, removed {pruned} stale records')
+
+@app.cli.command('extract-metadata')
+def extract_metadata_command():
+    """Queue extraction for indexed images without metadata and run every due job"""
+    index = get_image_index()
+    worker = get_metadata_worker()
+    if not index or not worker:
+        print('INDEX_DB_PATH is not set, nothing to extract')
+        return
+    
+    queued = 0
+    for key in index.keys_without_metadata():
+        if not worker.queue.get(METADATA_JOB, key):
+            worker.queue.enqueue(METADATA_JOB, key)
+            queued += 1
+    ran = worker.run_pending()
+    print(f'Queued {queued} images, ran {ran} jobs; {worker.queue.counts()} left')
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     debug = os.environ.get('FLASK_DEBUG', 'False').lower() == 'true'
+    start_background_threads()
     app.run(host='0.0.0.0', port=port, debug=debug)
 
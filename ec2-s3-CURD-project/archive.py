@@ -0,0 +1,107 @@
+"""
+Streaming ZIP archives of stored images
+Objects are fetched concurrently a few keys ahead of the writer and the
+archive is yielded chunk by chunk, so memory stays flat for any archive size
+"""
+import shutil
+import tempfile
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from storage import STREAM_CHUNK_SIZE
+
+# Prefetched objects above this size spill from memory to a temp file
+SPOOL_MAX_MEMORY = 1024 * 1024
+
+
+class _ZipSink:
+    """Write-only file object that collects what ZipFile writes until it is drained.
+
+    It has no tell()/seek(), so ZipFile writes in streaming mode (data
+    descriptors after each entry) instead of seeking back to patch headers.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def fetch_to_spool(storage, key):
+    """Fetch an object into a spooled temp file, returns (ObjectInfo, file positioned at 0)"""
+    info, body = storage.open(key)
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    try:
+        with body:
+            shutil.copyfileobj(body, spool, STREAM_CHUNK_SIZE)
+        spool.seek(0)
+    except BaseException:
+        spool.close()
+        raise
+    return info, spool
+
+
+def stream_zip(storage, keys, prefetch=4):
+    """Yield a ZIP archive of the given keys as a sequence of byte chunks.
+
+    At most prefetch objects are fetched ahead of the one being written.
+    Keys that cannot be fetched are skipped and listed in an errors.txt entry
+    at the end, since the response has already started by then.
+    """
+    sink = _ZipSink()
+    keys = iter(keys)
+    pending = deque()
+    errors = []
+    executor = ThreadPoolExecutor(max_workers=prefetch)
+
+    def fill():
+        while len(pending) < prefetch:
+            key = next(keys, None)
+            if key is None:
+                return
+            pending.append((key, executor.submit(fetch_to_spool, storage, key)))
+
+    try:
+        with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+            fill()
+            while pending:
+                key, future = pending.popleft()
+                fill()
+                try:
+                    info, spool = future.result()
+                except Exception as e:
+                    errors.append(f'{key}: {e}')
+                    continue
+
+                with spool:
+                    entry_info = zipfile.ZipInfo(key, date_time=info.last_modified.timetuple()[:6])
+                    with archive.open(entry_info, 'w', force_zip64=info.size >= zipfile.ZIP64_LIMIT) as entry:
+                        for chunk in iter(lambda: spool.read(STREAM_CHUNK_SIZE), b''):
+                            entry.write(chunk)
+                            data = sink.drain()
+                            if data:
+                                yield data
+                data = sink.drain()
+                if data:
+                    yield data
+
+            if errors:
+                archive.writestr('errors.txt', '\n'.join(errors) + '\n')
+        yield sink.drain()
+    finally:
+        # Also runs when the client disconnects and the generator is closed early
+        executor.shutdown(wait=True, cancel_futures=True)
+        for _, future in pending:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                future.result()[1].close()
@@ -0,0 +1,530 @@
+"""
+Async S3 I/O path for the image manager
+An ASGI application that answers listing, image and upload requests on one
+event loop with a shared aiobotocore client, so a single process can keep
+hundreds of S3 requests in flight. Every other request (and these routes when
+they need local CPU work, such as transcoding or an index search) is handed
+to the Flask app on a thread pool.
+
+    uvicorn async_app:application --workers 2
+"""
+import asyncio
+import hashlib
+import json
+import mimetypes
+import re
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack
+from urllib.parse import parse_qs
+
+from aiobotocore.config import AioConfig
+from aiobotocore.session import get_session
+from botocore.exceptions import ClientError
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import http_date, parse_accept_header, parse_date, parse_etags, parse_options_header, quote_etag
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+from werkzeug.utils import secure_filename
+
+import metrics
+from app import (ALLOWED_EXTENSIONS, IMMUTABLE_MAX_AGE, SEARCH_PARAMS, UNIQUE_KEY_PATTERN, allowed_file, app,
+                 find_duplicate, generate_unique_filename, get_image_cache, get_storage, http_request_duration,
+                 http_requests_in_flight, http_response_size, is_image_key, record_upload, s3_breaker, s3_metrics,
+                 start_background_threads, variants_enabled)
+from storage import NOT_FOUND_CODES, STREAM_CHUNK_SIZE
+from transcode import SOURCE_TYPES, choose_variant
+
+IMAGE_PATH = re.compile(r'^/image/(?P<key>.+)$')
+
+# Uploads above this size spill from memory to a temp file while they are received
+SPOOL_MAX_MEMORY = 1024 * 1024
+
+
+class AsyncS3:
+    """One aiobotocore client per process, shared by every request on the event loop"""
+
+    def __init__(self):
+        self.client = None
+        self._exit_stack = None
+        self._lock = asyncio.Lock()
+
+    async def get_client(self):
+        if self.client is None:
+            async with self._lock:
+                if self.client is None:
+                    await self._open()
+        return self.client
+
+    async def _open(self):
+        self._exit_stack = AsyncExitStack()
+        client = await self._exit_stack.enter_async_context(get_session().create_client(
+            's3',
+            region_name=app.config['AWS_REGION'],
+            endpoint_url=app.config['S3_ENDPOINT_URL'],
+            config=AioConfig(
+                connect_timeout=app.config['S3_CONNECT_TIMEOUT'],
+                read_timeout=app.config['S3_READ_TIMEOUT'],
+                retries={'max_attempts': app.config['S3_MAX_ATTEMPTS'], 'mode': 'standard'},
+                # Every in-flight request holds a pooled connection
+                max_pool_connections=app.config['ASYNC_S3_MAX_CONNECTIONS']
+            )
+        ))
+        s3_breaker.attach(client)
+        s3_metrics.attach(client)
+        self.client = client
+
+    async def close(self):
+        if self._exit_stack is not None:
+            await self._exit_stack.aclose()
+        self.client = None
+        self._exit_stack = None
+
+
+class WsgiBridge:
+    """Runs the Flask app for an ASGI request on a thread pool, streaming its response back"""
+
+    def __init__(self, wsgi_app, max_workers):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='wsgi')
+
+    def environ(self, scope, body):
+        server_name, server_port = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope['query_string'].decode('latin-1'),
+            'SERVER_NAME': server_name,
+            'SERVER_PORT': str(server_port),
+            'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+            'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope['headers']:
+            name = name.decode('latin-1').upper().replace('-', '_')
+            if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                name = f'HTTP_{name}'
+            value = value.decode('latin-1')
+            environ[name] = f'{environ[name]},{value}' if name in environ else value
+        return environ
+
+    async def __call__(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        body = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+        try:
+            while True:
+                message = await receive()
+                body.write(message.get('body', b''))
+                if not message.get('more_body'):
+                    break
+            body.seek(0)
+
+            started = {}
+
+            def start_response(status, headers, exc_info=None):
+                started['status'] = int(status.split(' ', 1)[0])
+                started['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                      for name, value in headers]
+
+            result = await loop.run_in_executor(self.executor, self.wsgi_app, self.environ(scope, body),
+                                                start_response)
+            try:
+                chunks = iter(result)
+                await send({'type': 'http.response.start', 'status': started['status'],
+                            'headers': started['headers']})
+                # Pulled one chunk at a time, so streamed responses (ZIP downloads) stay streamed
+                while True:
+                    chunk = await loop.run_in_executor(self.executor, next, chunks, None)
+                    if chunk is None:
+                        break
+                    if chunk:
+                        await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                await send({'type': 'http.response.body', 'body': b''})
+            finally:
+                if hasattr(result, 'close'):
+                    await loop.run_in_executor(self.executor, result.close)
+        finally:
+            body.close()
+
+
+class AsyncImageApp:
+    """ASGI application: async S3 routes, everything else through the Flask app"""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.s3 = AsyncS3()
+        self.wsgi = WsgiBridge(flask_app, flask_app.config['ASYNC_WSGI_THREADS'])
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+
+        route = self.route(scope)
+        if route is None:
+            return await self.wsgi(scope, receive, send)
+
+        handler, endpoint, params = route
+        request = AsyncRequest(scope, receive)
+        http_requests_in_flight.inc()
+        token = metrics.current_timings.set(request.timings)
+        try:
+            await handler(request, send, endpoint, **params)
+        finally:
+            metrics.current_timings.reset(token)
+            http_requests_in_flight.dec()
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                start_background_threads()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.s3.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def route(self, scope):
+        """Return (handler, endpoint, params) for requests this app answers itself, or None"""
+        if self.flask_app.config['STORAGE_BACKEND'] != 's3':
+            return None
+
+        method, path = scope['method'], scope['path']
+        query = parse_qs(scope['query_string'].decode('latin-1'))
+        if method == 'GET' and path == '/api/images' and not SEARCH_PARAMS & set(query):
+            return self.list_images, '/api/images', {}
+        if method == 'POST' and path == '/api/upload':
+            return self.upload, '/api/upload', {}
+        match = IMAGE_PATH.match(path)
+        if method == 'GET' and match:
+            key = match.group('key')
+            headers = dict(scope['headers'])
+            accept = parse_accept_header(headers.get(b'accept', b'').decode('latin-1'), MIMEAccept)
+            content_type = mimetypes.guess_type(key)[0]
+            # Variants are CPU work; the Flask route produces and caches them
+            widths = self.flask_app.config['IMAGE_VARIANT_WIDTHS']
+            if variants_enabled() and ('w' in query or choose_variant(accept, content_type, None, widths)):
+                return None
+            return self.serve_image, '/image/<path:key>', {'key': key}
+        return None
+
+    async def respond(self, request, send, endpoint, status, headers, body=b'', more=None):
+        """Send a response, recording the same metrics and Server-Timing header as the Flask app"""
+        elapsed = time.monotonic() - request.started
+        http_request_duration.observe(elapsed, method=request.method, endpoint=endpoint, status=status)
+        size = int(dict(headers).get('Content-Length', len(body)))
+        http_response_size.observe(size, method=request.method, endpoint=endpoint)
+
+        server_timing = [f'app;dur={elapsed * 1000:.2f}']
+        if request.timings.s3_calls:
+            server_timing.append(
+                f'storage;dur={request.timings.s3_seconds * 1000:.2f};desc="{request.timings.s3_calls} S3 calls"')
+        headers = list(headers) + [('Server-Timing', ', '.join(server_timing))]
+        if 'Content-Length' not in dict(headers):
+            headers.append(('Content-Length', str(len(body))))
+
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(name.lower().encode('latin-1'), str(value).encode('latin-1')) for name, value in headers]
+        })
+        if more is None:
+            await send({'type': 'http.response.body', 'body': body})
+            return
+        async for chunk in more:
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def respond_json(self, request, send, endpoint, data, status=200):
+        body = json.dumps(data).encode('utf-8')
+        await self.respond(request, send, endpoint, status, [('Content-Type', 'application/json')], body)
+
+    async def list_images(self, request, send, endpoint):
+        """Async counterpart of GET /api/images without filters"""
+        try:
+            client = await self.s3.get_client()
+            images = []
+            paginator = client.get_paginator('list_objects_v2')
+            async for page in paginator.paginate(Bucket=app.config['S3_BUCKET_NAME']):
+                for obj in page.get('Contents', []):
+                    if is_image_key(obj['Key']):
+                        images.append({
+                            'key': obj['Key'],
+                            'size': obj['Size'],
+                            'last_modified': obj['LastModified'].isoformat()
+                        })
+        except Exception as e:
+            return await self.respond_json(request, send, endpoint, {'error': str(e)}, 500)
+        await self.respond_json(request, send, endpoint, {'images': images, 'count': len(images)})
+
+    async def serve_image(self, request, send, endpoint, key):
+        """Async counterpart of GET /image/<key> for originals.
+
+        With IMAGE_CACHE_DIR set, images are sent from the same disk cache as
+        the Flask route uses, filled from S3 on a miss; otherwise they are
+        streamed straight from S3.
+        """
+        loop = asyncio.get_running_loop()
+        bucket = app.config['S3_BUCKET_NAME']
+        headers = [('Vary', 'Accept')] if mimetypes.guess_type(key)[0] in SOURCE_TYPES else []
+        cache = get_image_cache()
+        cached = None
+        try:
+            client = await self.s3.get_client()
+            # Uploader keys are never rewritten, so any cached copy is current without asking S3
+            entry = cache.get(key) if cache and UNIQUE_KEY_PATTERN.match(key) else None
+            if entry:
+                etag, last_modified = entry.etag, entry.last_modified
+            elif cache or request.headers.get('if-none-match') or request.headers.get('if-modified-since'):
+                info = await client.head_object(Bucket=bucket, Key=key)
+                etag, last_modified = info['ETag'].strip('"'), info['LastModified']
+            else:
+                etag = last_modified = None
+
+            if etag and request.is_not_modified(etag, last_modified):
+                headers += cache_headers(key, etag, last_modified)
+                return await self.respond(request, send, endpoint, 304, headers)
+
+            if cache:
+                entry = entry or cache.get(key, etag) or await self.fill_cache(cache, client, key)
+                try:
+                    cached = await loop.run_in_executor(self.wsgi.executor, open, entry.path, 'rb')
+                except FileNotFoundError:
+                    # Evicted by another worker process, fall back to S3
+                    cache.discard(key)
+            if cached is None:
+                response = await client.get_object(Bucket=bucket, Key=key)
+        except ClientError as e:
+            status = 404 if e.response['Error']['Code'] in NOT_FOUND_CODES else 500
+            body = f'Error: {e}'.encode('utf-8')
+            return await self.respond(request, send, endpoint, status, [('Content-Type', 'text/plain')], body)
+        except Exception as e:
+            body = f'Error: {e}'.encode('utf-8')
+            return await self.respond(request, send, endpoint, 404, [('Content-Type', 'text/plain')], body)
+
+        if cached is not None:
+            headers += [
+                ('Content-Type', entry.content_type),
+                ('Content-Length', str(entry.size)),
+            ] + cache_headers(key, entry.etag, entry.last_modified)
+            chunks = file_chunks(cached, self.wsgi.executor)
+        else:
+            headers += [
+                ('Content-Type', response.get('ContentType') or 'image/jpeg'),
+                ('Content-Length', str(response['ContentLength'])),
+            ] + cache_headers(key, response['ETag'].strip('"'), response['LastModified'])
+            chunks = s3_chunks(response['Body'])
+        await self.respond(request, send, endpoint, 200, headers, more=chunks)
+
+    async def fill_cache(self, cache, client, key):
+        """Copy an object from S3 into the disk image cache, returns its entry"""
+        response = await client.get_object(Bucket=app.config['S3_BUCKET_NAME'], Key=key)
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY) as body:
+            async for chunk in s3_chunks(response['Body']):
+                body.write(chunk)
+            body.seek(0)
+            return await asyncio.get_running_loop().run_in_executor(
+                self.wsgi.executor, cache.put, key, response['ETag'].strip('"'), body,
+                response.get('ContentType') or 'image/jpeg', response['LastModified']
+            )
+
+    async def upload(self, request, send, endpoint):
+        """Async counterpart of POST /api/upload: the body is received and stored without blocking a thread"""
+        try:
+            upload = await request.read_file('file', app.config['MAX_CONTENT_LENGTH'])
+        except RequestTooLarge:
+            return await self.respond_json(request, send, endpoint, {'error': 'File too large'}, 413)
+        except ValueError as e:
+            return await self.respond_json(request, send, endpoint, {'error': str(e)}, 400)
+
+        if upload is None:
+            return await self.respond_json(request, send, endpoint, {'error': 'No file provided'}, 400)
+        try:
+            if upload.filename == '':
+                return await self.respond_json(request, send, endpoint, {'error': 'No file selected'}, 400)
+            if not allowed_file(upload.filename):
+                error = f'Invalid file type. Allowed: {", ".join(ALLOWED_EXTENSIONS)}'
+                return await self.respond_json(request, send, endpoint, {'error': error}, 400)
+
+            filename, original_filename, duplicate = await self.store_upload(upload)
+        except Exception as e:
+            return await self.respond_json(request, send, endpoint, {'error': str(e)}, 500)
+        finally:
+            upload.stream.close()
+
+        await self.respond_json(request, send, endpoint, {
+            'message': 'Upload successful',
+            'filename': filename,
+            'original_filename': original_filename,
+            'duplicate': duplicate
+        })
+
+    async def store_upload(self, upload):
+        """Async counterpart of app.store_upload.
+
+        The body was hashed while it was received; the duplicate lookup and the
+        index writes are app.store_upload's, run on the thread pool, and only
+        the put goes through the async client.
+        """
+        loop = asyncio.get_running_loop()
+        client = await self.s3.get_client()
+        original_filename = secure_filename(upload.filename)
+
+        existing = await loop.run_in_executor(
+            self.wsgi.executor, lambda: find_duplicate(get_storage(), upload.sha256))
+        if existing:
+            return existing, original_filename, True
+
+        unique_filename = generate_unique_filename(original_filename)
+        await client.put_object(
+            Bucket=app.config['S3_BUCKET_NAME'],
+            Key=unique_filename,
+            Body=upload.stream,
+            ContentLength=upload.size,
+            ContentType=upload.content_type,
+            Metadata={'original_filename': original_filename, 'sha256': upload.sha256}
+        )
+        await loop.run_in_executor(self.wsgi.executor, record_upload, unique_filename, upload.sha256, upload.size,
+                                   upload.content_type)
+        return unique_filename, original_filename, False
+
+
+class RequestTooLarge(Exception):
+    """Raised when a request body exceeds MAX_CONTENT_LENGTH"""
+
+
+class UploadedFile:
+    """A file part received from a multipart body, already hashed"""
+
+    def __init__(self, filename, content_type, stream, size, sha256):
+        self.filename = filename
+        self.content_type = content_type
+        self.stream = stream
+        self.size = size
+        self.sha256 = sha256
+
+
+class AsyncRequest:
+    """The parts of an ASGI request the async routes need"""
+
+    def __init__(self, scope, receive):
+        self.method = scope['method']
+        self.headers = {name.decode('latin-1'): value.decode('latin-1') for name, value in scope['headers']}
+        self.receive = receive
+        self.started = time.monotonic()
+        self.timings = metrics.RequestTimings()
+
+    def is_not_modified(self, etag, last_modified):
+        """Same rules as app.is_not_modified: If-None-Match wins over If-Modified-Since"""
+        if_none_match = self.headers.get('if-none-match')
+        if if_none_match:
+            return parse_etags(if_none_match).contains_weak(etag)
+        if_modified_since = parse_date(self.headers.get('if-modified-since'))
+        if if_modified_since and last_modified:
+            return last_modified.replace(microsecond=0) <= if_modified_since
+        return False
+
+    async def read_file(self, field_name, max_size):
+        """Receive a multipart body and return the named file part as an UploadedFile, or None.
+
+        The part is hashed and spooled to a temp file as it arrives; other
+        parts are discarded.
+        """
+        content_type, options = parse_options_header(self.headers.get('content-type', ''))
+        if content_type != 'multipart/form-data' or 'boundary' not in options:
+            raise ValueError('Expected a multipart/form-data body')
+        if int(self.headers.get('content-length') or 0) > max_size:
+            raise RequestTooLarge()
+
+        decoder = MultipartDecoder(options['boundary'].encode('latin-1'), max_form_memory_size=max_size)
+        upload = None
+        current = None
+        digest = None
+        received = 0
+        more_body = True
+        try:
+            while True:
+                event = decoder.next_event()
+                if isinstance(event, NeedData):
+                    if not more_body:
+                        decoder.receive_data(None)
+                        continue
+                    message = await self.receive()
+                    chunk = message.get('body', b'')
+                    more_body = message.get('more_body', False)
+                    received += len(chunk)
+                    if received > max_size:
+                        raise RequestTooLarge()
+                    decoder.receive_data(chunk)
+                    if not more_body:
+                        decoder.receive_data(None)
+                elif isinstance(event, File) and event.name == field_name and upload is None:
+                    current = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+                    digest = hashlib.sha256()
+                    upload = UploadedFile(event.filename or '', event.headers.get('content-type'), current, 0, None)
+                elif isinstance(event, (File, Field)):
+                    current = None
+                elif isinstance(event, Data):
+                    if current is not None:
+                        current.write(event.data)
+                        digest.update(event.data)
+                        upload.size += len(event.data)
+                elif isinstance(event, Epilogue):
+                    break
+        except BaseException:
+            if upload is not None:
+                upload.stream.close()
+            raise
+
+        if upload is not None:
+            upload.stream.seek(0)
+            upload.sha256 = digest.hexdigest()
+        return upload
+
+
+async def s3_chunks(body):
+    """Yield an S3 object body in STREAM_CHUNK_SIZE chunks, closing it at the end"""
+    try:
+        while True:
+            chunk = await body.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        body.close()
+
+
+async def file_chunks(file, executor):
+    """Yield a local file in STREAM_CHUNK_SIZE chunks read on the executor, closing it at the end"""
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            chunk = await loop.run_in_executor(executor, file.read, STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        file.close()
+
+
+def cache_headers(key, etag, last_modified):
+    """Validators and Cache-Control policy, as app.set_cache_headers sets them"""
+    headers = [('ETag', quote_etag(etag)), ('Last-Modified', http_date(last_modified))]
+    if UNIQUE_KEY_PATTERN.match(key):
+        headers.append(('Cache-Control', f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'))
+    else:
+        headers.append(('Cache-Control', 'no-cache'))
+    return headers
+
+
+application = AsyncImageApp(app)
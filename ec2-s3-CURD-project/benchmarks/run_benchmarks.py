@@ -0,0 +1,405 @@
+"""
+Benchmark and load-test suite for the image manager
+Runs the app under gunicorn against a local S3 stand-in (moto server by
+default, or any S3-compatible endpoint such as MinIO) and writes a JSON
+report that can be compared across commits
+
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --quick
+    python benchmarks/run_benchmarks.py compare old.json new.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import boto3
+import requests
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(PROJECT_DIR, 'benchmarks', 'results')
+
+# Headroom for the multipart envelope, so the largest image fits under MAX_CONTENT_LENGTH
+MULTIPART_OVERHEAD = 64 * 1024
+MAX_CONTENT_LENGTH = 16 * 1024 * 1024
+
+CREDENTIALS = {'AWS_ACCESS_KEY_ID': 'benchmark', 'AWS_SECRET_ACCESS_KEY': 'benchmark', 'AWS_REGION': 'us-east-1'}
+
+# Higher is better for these metrics when comparing reports; lower for everything else
+HIGHER_IS_BETTER = ('requests_per_second', 'mb_per_second')
+
+
+def parse_size(value):
+    """Parse sizes such as 100KB, 4MB or 512"""
+    units = {'KB': 1024, 'MB': 1024 * 1024}
+    value = value.strip().upper()
+    for suffix, factor in units.items():
+        if value.endswith(suffix):
+            return int(float(value[:-len(suffix)]) * factor)
+    return int(value)
+
+
+def parse_list(value, convert=int):
+    return [convert(item) for item in value.split(',') if item.strip()]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    raise RuntimeError(f'Server at {url} did not start within {timeout}s')
+
+
+def summarize(latencies, elapsed, total_bytes=0, errors=0):
+    """Latency percentiles in milliseconds plus throughput for one measurement"""
+    latencies = sorted(latencies)
+    result = {
+        'requests': len(latencies),
+        'errors': errors,
+        'elapsed_seconds': round(elapsed, 3),
+        'requests_per_second': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+    }
+    if latencies:
+        quantiles = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+        result.update({
+            'p50_ms': round(quantiles[49] * 1000, 2),
+            'p95_ms': round(quantiles[94] * 1000, 2),
+            'p99_ms': round(quantiles[98] * 1000, 2),
+            'max_ms': round(latencies[-1] * 1000, 2),
+        })
+    if total_bytes:
+        result['mb_per_second'] = round(total_bytes / (1024 * 1024) / elapsed, 2) if elapsed else 0.0
+    return result
+
+
+class S3StandIn:
+    """A moto server started for the run, or an existing S3-compatible endpoint"""
+
+    def __init__(self, endpoint_url=None):
+        self.endpoint_url = endpoint_url
+        self._server = None
+
+    def __enter__(self):
+        if self.endpoint_url is None:
+            try:
+                from moto.server import ThreadedMotoServer
+            except ImportError:
+                sys.exit('moto server mode needs: pip install "moto[server]" (or pass --s3-endpoint)')
+            logging.getLogger('werkzeug').setLevel(logging.ERROR)  # One access log line per S3 call otherwise
+            port = free_port()
+            self._server = ThreadedMotoServer(ip_address='127.0.0.1', port=port, verbose=False)
+            self._server.start()
+            self.endpoint_url = f'http://127.0.0.1:{port}'
+        return self
+
+    def __exit__(self, *exc):
+        if self._server is not None:
+            self._server.stop()
+
+    def client(self):
+        return boto3.client(
+            's3',
+            endpoint_url=self.endpoint_url,
+            region_name=CREDENTIALS['AWS_REGION'],
+            aws_access_key_id=CREDENTIALS['AWS_ACCESS_KEY_ID'],
+            aws_secret_access_key=CREDENTIALS['AWS_SECRET_ACCESS_KEY']
+        )
+
+    def create_bucket(self):
+        name = f'bench-{uuid.uuid4().hex[:12]}'
+        self.client().create_bucket(Bucket=name)
+        return name
+
+
+class AppServer:
+    """The app under gunicorn, pointed at one bucket of the stand-in"""
+
+    def __init__(self, s3, bucket, workers=1, threads=4):
+        self.s3 = s3
+        self.bucket = bucket
+        self.workers = workers
+        self.threads = threads
+        self.port = free_port()
+        self.url = f'http://127.0.0.1:{self.port}'
+        self._process = None
+        self._tmpdir = None
+
+    def __enter__(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        env = dict(
+            os.environ,
+            **CREDENTIALS,
+            S3_ENDPOINT_URL=self.s3.endpoint_url,
+            S3_BUCKET_NAME=self.bucket,
+            STORAGE_BACKEND='s3',
+            INDEX_DB_PATH=os.path.join(self._tmpdir.name, 'image_index.db'),
+            IMAGE_CACHE_DIR='',
+            S3_HEALTH_PROBE_INTERVAL='0'
+        )
+        self._process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '--workers', str(self.workers), '--worker-class', 'gthread',
+             '--threads', str(self.threads), '--bind', f'127.0.0.1:{self.port}', '--log-level', 'warning',
+             'app:app'],
+            cwd=PROJECT_DIR,
+            env=env
+        )
+        try:
+            wait_for(f'{self.url}/health')
+        except RuntimeError:
+            self.__exit__()
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        self._process.terminate()
+        try:
+            self._process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+        self._tmpdir.cleanup()
+
+
+def seed_objects(s3, bucket, count, start=0, size=1024, threads=32):
+    """Write count small objects directly to the bucket, bypassing the app"""
+    body = os.urandom(size)
+
+    def put(batch):
+        client = s3.client()
+        for i in batch:
+            client.put_object(Bucket=bucket, Key=f'seed/{i:08d}.jpg', Body=body, ContentType='image/jpeg')
+
+    batches = [range(i, min(i + 500, start + count)) for i in range(start, start + count, 500)]
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(put, batches))
+
+
+def timed(session, method, url, **kwargs):
+    """Return (seconds, response) for one request; non-2xx responses raise"""
+    started = time.perf_counter()
+    response = session.request(method, url, **kwargs)
+    elapsed = time.perf_counter() - started
+    response.raise_for_status()
+    return elapsed, response
+
+
+def bench_listing(s3, sizes, repeat):
+    """/api/images over a bucket grown to each size in turn"""
+    bucket = s3.create_bucket()
+    results = {}
+    seeded = 0
+    with AppServer(s3, bucket) as server, requests.Session() as session:
+        for size in sorted(sizes):
+            print(f'  seeding {size} objects')
+            seed_objects(s3, bucket, size - seeded, start=seeded)
+            seeded = size
+
+            latencies = []
+            started = time.perf_counter()
+            for _ in range(repeat):
+                elapsed, response = timed(session, 'GET', f'{server.url}/api/images', timeout=600)
+                latencies.append(elapsed)
+            result = summarize(latencies, time.perf_counter() - started)
+            result['objects'] = len(response.json()['images'])
+            results[str(size)] = result
+            print(f'  {size} objects: p50 {result["p50_ms"]} ms')
+    return results
+
+
+def bench_upload_and_serve(s3, sizes, count):
+    """Sequential uploads through /api/upload, then reads of the same images through /image/<key>"""
+    bucket = s3.create_bucket()
+    results = {}
+    with AppServer(s3, bucket) as server, requests.Session() as session:
+        for size in sizes:
+            size = min(size, MAX_CONTENT_LENGTH - MULTIPART_OVERHEAD)
+            keys = []
+            latencies = []
+            started = time.perf_counter()
+            for _ in range(count):
+                # Random bodies, so deduplication never short-circuits an upload
+                files = {'file': ('bench.jpg', os.urandom(size), 'image/jpeg')}
+                elapsed, response = timed(session, 'POST', f'{server.url}/api/upload', files=files, timeout=120)
+                latencies.append(elapsed)
+                keys.append(response.json()['filename'])
+            upload = summarize(latencies, time.perf_counter() - started, total_bytes=size * count)
+
+            latencies = []
+            started = time.perf_counter()
+            for key in keys:
+                elapsed, response = timed(session, 'GET', f'{server.url}/image/{key}', timeout=120)
+                latencies.append(elapsed)
+            serve = summarize(latencies, time.perf_counter() - started, total_bytes=size * count)
+
+            results[str(size)] = {'upload': upload, 'serve': serve}
+            print(f'  {size} bytes: upload {upload["mb_per_second"]} MB/s, serve {serve["mb_per_second"]} MB/s')
+    return results
+
+
+def bench_concurrency(s3, worker_counts, clients, duration, threads):
+    """Concurrent clients serving images and listing a small bucket, at each gunicorn worker count"""
+    bucket = s3.create_bucket()
+    seed_objects(s3, bucket, 200, size=100 * 1024)
+    keys = [f'seed/{i:08d}.jpg' for i in range(200)]
+    results = {}
+
+    for workers in worker_counts:
+        with AppServer(s3, bucket, workers=workers, threads=threads) as server:
+            deadline = time.monotonic() + duration
+
+            def client_loop(offset):
+                latencies = []
+                errors = 0
+                with requests.Session() as session:
+                    i = offset
+                    while time.monotonic() < deadline:
+                        # Nine image reads for every listing
+                        path = '/api/images' if i % 10 == 0 else f'/image/{keys[i % len(keys)]}'
+                        try:
+                            elapsed, _ = timed(session, 'GET', server.url + path, timeout=60)
+                            latencies.append(elapsed)
+                        except requests.RequestException:
+                            errors += 1
+                        i += 1
+                return latencies, errors
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=clients) as executor:
+                outcomes = list(executor.map(client_loop, range(clients)))
+            elapsed = time.perf_counter() - started
+
+            latencies = [latency for client_latencies, _ in outcomes for latency in client_latencies]
+            result = summarize(latencies, elapsed, errors=sum(errors for _, errors in outcomes))
+            result['clients'] = clients
+            results[str(workers)] = result
+            print(f'  {workers} workers: {result["requests_per_second"]} req/s, p95 {result.get("p95_ms")} ms')
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'parameters': {key: value for key, value in vars(args).items() if key not in ('func', 'output')},
+        'results': {},
+    }
+
+    with S3StandIn(args.s3_endpoint) as s3:
+        report['s3_endpoint'] = 'moto server' if args.s3_endpoint is None else args.s3_endpoint
+        if 'listing' in args.scenarios:
+            print('Listing')
+            report['results']['listing'] = bench_listing(s3, args.list_sizes, args.repeat)
+        if 'upload' in args.scenarios:
+            print('Upload and serve')
+            report['results']['upload_serve'] = bench_upload_and_serve(s3, args.image_sizes, args.count)
+        if 'concurrency' in args.scenarios:
+            print('Concurrency')
+            report['results']['concurrency'] = bench_concurrency(
+                s3, args.workers, args.clients, args.duration, args.threads)
+
+    output = args.output or os.path.join(RESULTS_DIR, f'{report["commit"] or "report"}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Report written to {output}')
+
+
+def flatten(results, path=()):
+    """Yield (path, value) for every number in a nested results dict"""
+    for name, value in results.items():
+        if isinstance(value, dict):
+            yield from flatten(value, path + (name,))
+        elif isinstance(value, (int, float)):
+            yield path + (name,), value
+
+
+def compare(args):
+    """Print the relative change of every metric between two reports"""
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    before = dict(flatten(baseline['results']))
+    print(f'{baseline.get("commit")} -> {candidate.get("commit")}')
+    for path, value in flatten(candidate['results']):
+        metric = path[-1]
+        if path not in before or metric in ('requests', 'objects', 'clients'):
+            continue
+        old = before[path]
+        change = (value - old) / old * 100 if old else 0.0
+        better = change > 0 if metric in HIGHER_IS_BETTER else change < 0
+        flag = '' if abs(change) < args.threshold else (' better' if better else ' WORSE')
+        print(f'{"/".join(path):60} {old:>12} {value:>12} {change:+7.1f}%{flag}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.set_defaults(func=run)
+    parser.add_argument('--s3-endpoint', help='Existing S3-compatible endpoint; a moto server is started if omitted')
+    parser.add_argument('--scenarios', type=lambda value: parse_list(value, str),
+                        default=['listing', 'upload', 'concurrency'], help='listing,upload,concurrency')
+    parser.add_argument('--list-sizes', type=parse_list, default=[10000, 100000], help='Bucket sizes to list')
+    parser.add_argument('--repeat', type=int, default=5, help='Listings per bucket size')
+    parser.add_argument('--image-sizes', type=lambda value: parse_list(value, parse_size),
+                        default=[parse_size(size) for size in ('100KB', '1MB', '4MB', '16MB')],
+                        help='Image sizes to upload and serve (16MB is clipped to fit MAX_CONTENT_LENGTH)')
+    parser.add_argument('--count', type=int, default=20, help='Uploads per image size')
+    parser.add_argument('--workers', type=parse_list, default=[1, 2, 4, 8], help='gunicorn worker counts')
+    parser.add_argument('--threads', type=int, default=4, help='Threads per gunicorn worker')
+    parser.add_argument('--clients', type=int, default=32, help='Concurrent clients')
+    parser.add_argument('--duration', type=float, default=20, help='Seconds per concurrency run')
+    parser.add_argument('--quick', action='store_true', help='Small sizes and short runs for a smoke test')
+    parser.add_argument('--output', help='Report path (default benchmarks/results/<commit>.json)')
+
+    subparsers = parser.add_subparsers()
+    compare_parser = subparsers.add_parser('compare', help='Compare two reports')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+    compare_parser.add_argument('--threshold', type=float, default=5.0, help='Percent change worth flagging')
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    if args.func is run and args.quick:
+        args.list_sizes = [1000]
+        args.repeat = 2
+        args.image_sizes = [parse_size('100KB'), parse_size('1MB')]
+        args.count = 3
+        args.workers = [1, 2]
+        args.clients = 4
+        args.duration = 3
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""
+Circuit breaker and background health prober for S3 calls
+Lets routes fail fast while S3 is degraded instead of waiting on timeouts
+"""
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling S3 while the circuit is open"""
+
+
+class CircuitBreaker:
+    """Failure-rate circuit breaker driven by botocore's event hooks.
+
+    Closed: calls go through and outcomes are recorded in a sliding window.
+    Open: calls are refused until reset_timeout has passed.
+    Half-open: a single trial call is let through; its outcome closes or
+    re-opens the circuit.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=0.5, window_size=20, min_calls=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._outcomes = deque(maxlen=window_size)  # True for success
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._trial_started_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow_request(self):
+        """Return True if a call may go to S3 now"""
+        with self._lock:
+            now = self._clock()
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if now - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = self.HALF_OPEN
+                self._trial_started_at = None
+            # Half-open: one trial at a time, unless the last one never reported back
+            if self._trial_started_at is None or now - self._trial_started_at >= self.reset_timeout:
+                self._trial_started_at = now
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._state = self.CLOSED
+                self._outcomes.clear()
+            self._outcomes.append(True)
+
+    def record_failure(self):
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._trip()
+                return
+            self._outcomes.append(False)
+            if len(self._outcomes) >= self.min_calls:
+                failures = self._outcomes.count(False)
+                if failures / len(self._outcomes) >= self.failure_threshold:
+                    self._trip()
+
+    def reset(self):
+        """Close the circuit and forget recorded outcomes"""
+        with self._lock:
+            self._state = self.CLOSED
+            self._trial_started_at = None
+            self._outcomes.clear()
+
+    def _trip(self):
+        self._state = self.OPEN
+        self._opened_at = self._clock()
+        self._trial_started_at = None
+        self._outcomes.clear()
+
+    def attach(self, client):
+        """Route every API call made by a boto3 client through the breaker"""
+        events = client.meta.events
+        events.register('before-call.s3', self._before_call)
+        events.register('after-call.s3', self._after_call)
+        events.register('after-call-error.s3', self._after_call_error)
+        return client
+
+    def _before_call(self, **kwargs):
+        if not self.allow_request():
+            raise CircuitOpenError('S3 circuit is open, failing fast')
+
+    def _after_call(self, http_response, **kwargs):
+        # Client errors (404, 403, ...) mean S3 answered; only server errors count against it
+        if http_response.status_code >= 500:
+            self.record_failure()
+        else:
+            self.record_success()
+
+    def _after_call_error(self, **kwargs):
+        # Connection errors and timeouts
+        self.record_failure()
+
+
+class HealthProber:
+    """Daemon thread that runs a health check every interval seconds and keeps the last result"""
+
+    def __init__(self, check, interval):
+        self.check = check
+        self.interval = interval
+        self.last_result = None
+        self.pid = os.getpid()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def probe(self):
+        """Run the check once and store the result"""
+        started = time.monotonic()
+        try:
+            self.check()
+            result = {'status': 'healthy'}
+        except Exception as e:
+            result = {'status': 'unhealthy', 'error': str(e)}
+        result['latency_ms'] = round((time.monotonic() - started) * 1000, 2)
+        result['timestamp'] = datetime.now().isoformat()
+        self.last_result = result
+        return result
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='s3-health-prober', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        self.probe()
+        while not self._stop.wait(self.interval):
+            self.probe()
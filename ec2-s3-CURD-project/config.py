@@ -13,14 +13,60 @@ class Config:
     # Flask settings
     SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key-change-in-production')
     
+    # Storage backend: 's3' or 'local' (files under LOCAL_STORAGE_DIR, no S3 needed)
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 's3')
+    LOCAL_STORAGE_DIR = os.environ.get('LOCAL_STORAGE_DIR', 'storage')
+    
     # AWS S3 settings
     AWS_ACCESS_KEY_ID = os.environ.get('AWS_ACCESS_KEY_ID', '')
     AWS_SECRET_ACCESS_KEY = os.environ.get('AWS_SECRET_ACCESS_KEY', '')
     AWS_REGION = os.environ.get('AWS_REGION', 'us-east-1')
     S3_BUCKET_NAME = os.environ.get('S3_BUCKET_NAME', 'my-image-bucket')
+    S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL') or None  # S3-compatible stand-in (MinIO, moto server)
+    S3_CONNECT_TIMEOUT = float(os.environ.get('S3_CONNECT_TIMEOUT', 2))
+    S3_READ_TIMEOUT = float(os.environ.get('S3_READ_TIMEOUT', 10))
+    S3_MAX_ATTEMPTS = int(os.environ.get('S3_MAX_ATTEMPTS', 3))
+    
+    # Async entry point (async_app.py): pooled S3 connections per process, and threads for routes left to Flask
+    ASYNC_S3_MAX_CONNECTIONS = int(os.environ.get('ASYNC_S3_MAX_CONNECTIONS', 256))
+    ASYNC_WSGI_THREADS = int(os.environ.get('ASYNC_WSGI_THREADS', 16))
+    
+    # S3 circuit breaker: open when this share of the last S3_BREAKER_WINDOW calls failed
+    S3_BREAKER_FAILURE_THRESHOLD = float(os.environ.get('S3_BREAKER_FAILURE_THRESHOLD', 0.5))
+    S3_BREAKER_WINDOW = int(os.environ.get('S3_BREAKER_WINDOW', 20))
+    S3_BREAKER_MIN_CALLS = int(os.environ.get('S3_BREAKER_MIN_CALLS', 5))
+    S3_BREAKER_RESET_TIMEOUT = float(os.environ.get('S3_BREAKER_RESET_TIMEOUT', 30))  # Seconds before a trial call
+    S3_HEALTH_PROBE_INTERVAL = float(os.environ.get('S3_HEALTH_PROBE_INTERVAL', 0))  # Seconds, 0 disables the prober
     
     # Upload settings
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16 MB max file size
+    UPLOAD_MAX_WORKERS = int(os.environ.get('UPLOAD_MAX_WORKERS', 8))  # Concurrent S3 writes per batch upload
+    PRESIGNED_POST_EXPIRES = int(os.environ.get('PRESIGNED_POST_EXPIRES', 600))  # Seconds a direct upload policy is valid
+    
+    # Local image index (SQLite), used to deduplicate uploads by content hash (disabled when empty)
+    INDEX_DB_PATH = os.environ.get('INDEX_DB_PATH', '')
+    
+    # Background metadata extraction (dimensions, EXIF, dominant color, perceptual hash) after upload
+    METADATA_WORKERS = int(os.environ.get('METADATA_WORKERS', 0))  # Threads per process, 0 leaves jobs to the CLI
+    METADATA_MAX_ATTEMPTS = int(os.environ.get('METADATA_MAX_ATTEMPTS', 5))
+    METADATA_RETRY_DELAY = float(os.environ.get('METADATA_RETRY_DELAY', 5))  # Seconds, doubled after each failure
+    METADATA_POLL_INTERVAL = float(os.environ.get('METADATA_POLL_INTERVAL', 2))  # Seconds between checks for jobs
+    
+    # Local image cache settings (disabled when IMAGE_CACHE_DIR is empty)
+    IMAGE_CACHE_DIR = os.environ.get('IMAGE_CACHE_DIR', '')
+    IMAGE_CACHE_MAX_BYTES = int(os.environ.get('IMAGE_CACHE_MAX_BYTES', 512 * 1024 * 1024))  # 512 MB
+    
+    # Resized and re-encoded variants (?w= and Accept negotiation), produced once and kept on local disk
+    IMAGE_VARIANT_WIDTHS = [int(w) for w in os.environ.get('IMAGE_VARIANT_WIDTHS', '320,640,1024,1600,2048').split(',')]
+    IMAGE_VARIANT_DIR = os.environ.get('IMAGE_VARIANT_DIR', '')  # Empty serves every image as stored
+    IMAGE_VARIANT_MAX_BYTES = int(os.environ.get('IMAGE_VARIANT_MAX_BYTES', 1024 * 1024 * 1024))
+    TRANSCODE_MAX_WORKERS = int(os.environ.get('TRANSCODE_MAX_WORKERS', os.cpu_count() or 2))  # Concurrent encodes
+    
+    # ZIP downloads: objects fetched ahead of the archive writer
+    ZIP_PREFETCH = int(os.environ.get('ZIP_PREFETCH', 4))
+    
+    # Bulk delete settings
+    DELETE_MAX_WORKERS = int(os.environ.get('DELETE_MAX_WORKERS', 4))  # Concurrent DeleteObjects calls
 
 class DevelopmentConfig(Config):
     """Development configuration"""
@@ -0,0 +1,9 @@
+"""
+Gunicorn settings, read automatically when gunicorn is started from this directory
+"""
+
+
+def post_fork(server, worker):
+    """Start the app's background threads in each worker; threads do not survive fork"""
+    from app import start_background_threads
+    start_background_threads()
@@ -0,0 +1,192 @@
+"""
+On-disk LRU cache for images served from S3
+Entries are keyed by object key and ETag, capped by total size in bytes
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+
+CacheEntry = namedtuple('CacheEntry', ['key', 'etag', 'path', 'size', 'content_type', 'last_modified'])
+
+
+class _Fetch:
+    """An in-flight fetch that concurrent callers for the same key wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.entry = None
+        self.error = None
+
+
+class DiskCache:
+    """Size-bounded LRU cache of S3 objects stored as plain files.
+
+    Every process keeps its own index; files evicted by another process
+    sharing the directory simply surface as FileNotFoundError to the caller.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()  # key -> CacheEntry, least recently used first
+        self._inflight = {}  # key -> _Fetch
+        self._lock = threading.Lock()
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._load()
+
+    def _paths(self, key, etag):
+        """Return the (data, metadata) file paths for one version of a key"""
+        name = hashlib.sha256(f'{key}\0{etag}'.encode('utf-8')).hexdigest()
+        path = os.path.join(self.directory, name)
+        return path, path + '.json'
+
+    def _load(self):
+        """Rebuild the index from files left by a previous run, oldest first"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    meta = json.load(f)
+                path, _ = self._paths(meta['key'], meta['etag'])
+                stat = os.stat(path)
+            except (OSError, ValueError, KeyError):
+                continue
+            entries.append((stat.st_mtime, CacheEntry(
+                key=meta['key'],
+                etag=meta['etag'],
+                path=path,
+                size=stat.st_size,
+                content_type=meta['content_type'],
+                last_modified=datetime.fromisoformat(meta['last_modified'])
+            )))
+
+        with self._lock:
+            for _, entry in sorted(entries, key=lambda item: item[0]):
+                self._add(entry)
+            self._evict()
+
+    def _add(self, entry):
+        """Index an entry as most recently used, replacing any other version of its key"""
+        old = self._entries.pop(entry.key, None)
+        if old is not None:
+            self.total_bytes -= old.size
+            if old.path != entry.path:
+                self._remove_files(old)
+        self._entries[entry.key] = entry
+        self.total_bytes += entry.size
+
+    def _evict(self, keep=None):
+        """Drop least recently used entries until the cache fits in max_bytes"""
+        while self.total_bytes > self.max_bytes and self._entries:
+            key = next(iter(self._entries))
+            if key == keep:
+                if len(self._entries) == 1:
+                    break
+                self._entries.move_to_end(key)
+                continue
+            entry = self._entries.pop(key)
+            self.total_bytes -= entry.size
+            self._remove_files(entry)
+
+    def _remove_files(self, entry):
+        for path in self._paths(entry.key, entry.etag):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def get(self, key, etag=None):
+        """Return the cached entry for key, or None; with an etag only that exact version matches"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (etag is not None and entry.etag != etag):
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, etag, body, content_type, last_modified):
+        """Copy a file-like body into the cache and return its entry"""
+        path, meta_path = self._paths(key, etag)
+
+        # Write to a temp file first so readers never see a partial image
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                shutil.copyfileobj(body, f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        with open(meta_path, 'w') as f:
+            json.dump({
+                'key': key,
+                'etag': etag,
+                'content_type': content_type,
+                'last_modified': last_modified.isoformat()
+            }, f)
+
+        entry = CacheEntry(key, etag, path, os.path.getsize(path), content_type, last_modified)
+        with self._lock:
+            self._add(entry)
+            self._evict(keep=key)
+        return entry
+
+    def get_or_fetch(self, key, etag, fetch):
+        """Return the cached entry, calling fetch() on a miss.
+
+        fetch() must return a dict with body, etag, content_type and
+        last_modified. Concurrent misses for the same key share one fetch.
+        """
+        entry = self.get(key, etag)
+        if entry is not None:
+            return entry
+
+        with self._lock:
+            pending = self._inflight.get(key)
+            leader = pending is None
+            if leader:
+                pending = self._inflight[key] = _Fetch()
+
+        if not leader:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.entry
+
+        try:
+            obj = fetch()
+            pending.entry = self.put(key, obj['etag'], obj['body'], obj['content_type'], obj['last_modified'])
+            return pending.entry
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            pending.done.set()
+
+    def discard(self, key):
+        """Remove every cached version of key"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.total_bytes -= entry.size
+                self._remove_files(entry)
+
+    def discard_prefix(self, prefix):
+        """Remove every entry whose key starts with prefix"""
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                entry = self._entries.pop(key)
+                self.total_bytes -= entry.size
+                self._remove_files(entry)
@@ -0,0 +1,221 @@
+"""
+Local SQLite index of uploaded images
+Maps content hashes to the S3 key holding those bytes, and keeps per-image
+metadata so listings can be searched, filtered and sorted without S3
+"""
+import base64
+import json
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+    sha256 TEXT PRIMARY KEY,
+    key TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS hashes_key ON hashes (key);
+
+CREATE TABLE IF NOT EXISTS images (
+    key TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    last_modified TEXT NOT NULL,
+    content_type TEXT,
+    indexed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS images_size ON images (size, key);
+CREATE INDEX IF NOT EXISTS images_last_modified ON images (last_modified, key);
+CREATE INDEX IF NOT EXISTS images_content_type ON images (content_type, key);
+
+CREATE TABLE IF NOT EXISTS image_metadata (
+    key TEXT PRIMARY KEY,
+    width INTEGER,
+    height INTEGER,
+    format TEXT,
+    mode TEXT,
+    exif TEXT,
+    dominant_color TEXT,
+    phash TEXT,
+    extracted_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS image_metadata_phash ON image_metadata (phash);
+"""
+
+# Columns /api/images may sort on; key is always the tie-breaker
+SORT_COLUMNS = ('key', 'size', 'last_modified')
+
+# Sorts after any character that can follow a prefix in a UTF-8 key
+PREFIX_UPPER_BOUND = '\U0010ffff'
+
+
+def encode_cursor(values):
+    """Encode the sort position of a row into an opaque string"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Decode a cursor made by encode_cursor, raises ValueError if it is malformed"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list):
+        raise ValueError('Invalid cursor')
+    return values
+
+
+class ImageIndex:
+    """SQLite-backed image index, safe to share between threads and processes"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def find_by_hash(self, sha256):
+        """Return the key already holding content with this hash, or None"""
+        row = self._connect().execute('SELECT key FROM hashes WHERE sha256 = ?', (sha256,)).fetchone()
+        return row[0] if row else None
+
+    def add_hash(self, sha256, key):
+        """Record the key holding content with this hash (the first key recorded wins)"""
+        with self._connect() as conn:
+            conn.execute('INSERT OR IGNORE INTO hashes (sha256, key) VALUES (?, ?)', (sha256, key))
+
+    def remove_hash(self, sha256):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM hashes WHERE sha256 = ?', (sha256,))
+
+    def remove_keys(self, keys):
+        """Forget every hash and image record for the given keys"""
+        params = [(key,) for key in keys]
+        with self._connect() as conn:
+            conn.executemany('DELETE FROM hashes WHERE key = ?', params)
+            conn.executemany('DELETE FROM images WHERE key = ?', params)
+            conn.executemany('DELETE FROM image_metadata WHERE key = ?', params)
+
+    def add_images(self, images):
+        """Insert or update image records.
+
+        Each image is a dict with key, size, last_modified (UTC ISO 8601)
+        and content_type.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO images (key, size, last_modified, content_type, indexed_at) '
+                'VALUES (:key, :size, :last_modified, :content_type, :indexed_at)',
+                [dict(image, indexed_at=now) for image in images]
+            )
+
+    def set_metadata(self, key, metadata):
+        """Store extracted metadata (width, height, format, mode, exif, dominant_color, phash) for a key"""
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO image_metadata '
+                '(key, width, height, format, mode, exif, dominant_color, phash, extracted_at) '
+                'VALUES (:key, :width, :height, :format, :mode, :exif, :dominant_color, :phash, :extracted_at)',
+                dict(metadata, key=key, exif=json.dumps(metadata.get('exif') or {}), extracted_at=time.time())
+            )
+
+    def get_metadata(self, key):
+        """Return the extracted metadata for a key as a dict, or None"""
+        row = self._connect().execute(
+            'SELECT width, height, format, mode, exif, dominant_color, phash, extracted_at '
+            'FROM image_metadata WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        metadata = dict(row)
+        metadata['exif'] = json.loads(metadata['exif'])
+        return metadata
+
+    def keys_without_metadata(self):
+        """Yield indexed image keys that have no extracted metadata"""
+        rows = self._connect().execute(
+            'SELECT key FROM images WHERE key NOT IN (SELECT key FROM image_metadata) ORDER BY key'
+        ).fetchall()
+        for row in rows:
+            yield row[0]
+
+    def prune_images(self, keep_keys, before):
+        """Delete image records indexed before a timestamp whose key is not in keep_keys"""
+        with self._connect() as conn:
+            conn.execute('CREATE TEMP TABLE IF NOT EXISTS keep_keys (key TEXT PRIMARY KEY)')
+            conn.execute('DELETE FROM keep_keys')
+            conn.executemany('INSERT OR IGNORE INTO keep_keys (key) VALUES (?)', ((key,) for key in keep_keys))
+            cursor = conn.execute(
+                'DELETE FROM images WHERE indexed_at < ? AND key NOT IN (SELECT key FROM keep_keys)',
+                (before,)
+            )
+            conn.execute('DELETE FROM keep_keys')
+            return cursor.rowcount
+
+    def search(self, prefix=None, min_size=None, max_size=None, modified_after=None, modified_before=None,
+               content_type=None, sort='key', descending=False, limit=100, cursor=None):
+        """Return (images, next_cursor) for one page of matching image records.
+
+        Pages are keyset-paginated on (sort column, key), so every page costs
+        the same however deep it is. next_cursor is None on the last page.
+        """
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f'sort must be one of: {", ".join(SORT_COLUMNS)}')
+
+        clauses = []
+        params = []
+        if prefix:
+            clauses.append('key >= ? AND key < ?')
+            params += [prefix, prefix + PREFIX_UPPER_BOUND]
+        if min_size is not None:
+            clauses.append('size >= ?')
+            params.append(min_size)
+        if max_size is not None:
+            clauses.append('size <= ?')
+            params.append(max_size)
+        if modified_after:
+            clauses.append('last_modified >= ?')
+            params.append(modified_after)
+        if modified_before:
+            clauses.append('last_modified < ?')
+            params.append(modified_before)
+        if content_type:
+            clauses.append('content_type = ?')
+            params.append(content_type)
+
+        op = '<' if descending else '>'
+        if cursor is not None:
+            position = decode_cursor(cursor)
+            if len(position) != (1 if sort == 'key' else 2):
+                raise ValueError('Cursor does not match the sort order')
+            if sort == 'key':
+                clauses.append(f'key {op} ?')
+                params.append(position[-1])
+            else:
+                clauses.append(f'({sort}, key) {op} (?, ?)')
+                params += position[-2:]
+
+        order = 'DESC' if descending else 'ASC'
+        order_by = f'key {order}' if sort == 'key' else f'{sort} {order}, key {order}'
+        where = f'WHERE {" AND ".join(clauses)}' if clauses else ''
+        rows = self._connect().execute(
+            f'SELECT key, size, last_modified, content_type FROM images {where} ORDER BY {order_by} LIMIT ?',
+            params + [limit]
+        ).fetchall()
+
+        images = [dict(row) for row in rows]
+        next_cursor = None
+        if len(images) == limit:
+            last = images[-1]
+            next_cursor = encode_cursor([last['key']] if sort == 'key' else [last[sort], last['key']])
+        return images, next_cursor
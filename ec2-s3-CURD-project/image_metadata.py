@@ -0,0 +1,105 @@
+"""
+Metadata extraction for stored images
+Dimensions, EXIF, dominant color and a perceptual hash, computed with Pillow
+"""
+import math
+
+from PIL import ExifTags, Image, ImageOps, UnidentifiedImageError
+
+# Side of the thumbnail the dominant color is computed from
+COLOR_SAMPLE_SIZE = 64
+
+# dHash grid: HASH_SIZE x HASH_SIZE bits, one per horizontal gradient
+HASH_SIZE = 8
+
+# EXIF values longer than this (thumbnails, maker notes) are left out
+MAX_EXIF_VALUE_LENGTH = 256
+
+
+class UnreadableImage(Exception):
+    """Raised when Pillow cannot decode a file"""
+
+
+def _json_value(value):
+    """Convert an EXIF value to str, int, float or a list of those; None when it has no JSON form"""
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace').rstrip('\0')
+    if isinstance(value, (tuple, list)):
+        items = [_json_value(item) for item in value]
+        return None if None in items else items
+    if isinstance(value, (str, int)):
+        return value
+    try:
+        value = float(value)  # Rationals
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    return value if math.isfinite(value) else None
+
+
+def exif_dict(image):
+    """Return the image's EXIF tags by name, with values converted to JSON-friendly types"""
+    exif = image.getexif()
+    tags = dict(exif)
+    tags.update(exif.get_ifd(ExifTags.IFD.Exif))
+
+    result = {}
+    for tag, value in tags.items():
+        name = ExifTags.TAGS.get(tag)
+        if name is None or name in ('ExifOffset', 'GPSInfo', 'MakerNote'):
+            continue
+        value = _json_value(value)
+        if value is None or (isinstance(value, (str, list)) and len(value) > MAX_EXIF_VALUE_LENGTH):
+            continue
+        result[name] = value
+    return result
+
+
+def dominant_color(image):
+    """Return the most common color of a downscaled, 8-color version of the image as #rrggbb"""
+    sample = image.convert('RGB')
+    sample.thumbnail((COLOR_SAMPLE_SIZE, COLOR_SAMPLE_SIZE))
+    palette_image = sample.quantize(colors=8)
+    _, index = max(palette_image.getcolors())
+    r, g, b = palette_image.getpalette()[index * 3:index * 3 + 3]
+    return f'#{r:02x}{g:02x}{b:02x}'
+
+
+def perceptual_hash(image):
+    """Return the 64-bit difference hash (dHash) of an image as 16 hex digits.
+
+    Visually similar images differ in few bits; compare with hamming_distance.
+    """
+    grey = image.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS)
+    pixels = list(grey.getdata())
+    bits = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + col]
+            right = pixels[row * (HASH_SIZE + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f'{bits:0{HASH_SIZE * HASH_SIZE // 4}x}'
+
+
+def hamming_distance(hash_a, hash_b):
+    return bin(int(hash_a, 16) ^ int(hash_b, 16)).count('1')
+
+
+def extract_metadata(source):
+    """Return a dict of width, height, format, mode, exif, dominant_color and phash for an image file object"""
+    try:
+        image = Image.open(source)
+        image_format = image.format
+        exif = exif_dict(image)
+        # Dimensions as displayed, after the EXIF orientation is applied
+        image = ImageOps.exif_transpose(image)
+        return {
+            'width': image.width,
+            'height': image.height,
+            'format': image_format,
+            'mode': image.mode,
+            'exif': exif,
+            'dominant_color': dominant_color(image),
+            'phash': perceptual_hash(image),
+        }
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        raise UnreadableImage(str(e))
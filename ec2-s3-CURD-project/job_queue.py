@@ -0,0 +1,208 @@
+"""
+Lightweight job queue persisted in SQLite
+Jobs survive restarts and are shared by every worker process using the same
+database; each process runs a few threads that claim and run them
+"""
+import os
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    run_after REAL NOT NULL,
+    locked_until REAL,
+    error TEXT,
+    created_at REAL NOT NULL,
+    UNIQUE (kind, key)
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, run_after);
+"""
+
+PENDING = 'pending'
+RUNNING = 'running'
+FAILED = 'failed'
+
+
+class PermanentJobError(Exception):
+    """Raised by a handler when retrying the job cannot help"""
+
+
+class JobQueue:
+    """Queue of (kind, key) jobs; a job is deleted once it succeeds.
+
+    A claimed job is leased for lease seconds. If the process running it dies,
+    the lease runs out and another worker claims it again. complete and fail
+    only touch a job that still holds the lease it was claimed with, so a job
+    queued again or reclaimed while it ran is left for its next run.
+    """
+
+    def __init__(self, path, lease=300.0, clock=time.time):
+        self.path = path
+        self.lease = lease
+        self._clock = clock
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # Enqueueing sits on the upload path; in WAL mode NORMAL skips the fsync per commit
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, kind, key):
+        """Add a job, or reset an existing job for the same key to run again"""
+        now = self._clock()
+        self._connect().execute(
+            'INSERT INTO jobs (kind, key, status, attempts, run_after, created_at) VALUES (?, ?, ?, 0, ?, ?) '
+            'ON CONFLICT (kind, key) DO UPDATE SET status = excluded.status, attempts = 0, '
+            'run_after = excluded.run_after, locked_until = NULL, error = NULL',
+            (kind, key, PENDING, now, now)
+        )
+
+    def claim(self):
+        """Lease the next job that is due, returns a dict with id, kind, key, attempts and lease, or None"""
+        now = self._clock()
+        conn = self._connect()
+        # IMMEDIATE takes the write lock up front, so two processes never claim the same job
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT id, kind, key, attempts FROM jobs '
+                'WHERE (status = ? AND run_after <= ?) OR (status = ? AND locked_until < ?) '
+                'ORDER BY run_after LIMIT 1',
+                (PENDING, now, RUNNING, now)
+            ).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            lease = now + self.lease
+            conn.execute(
+                'UPDATE jobs SET status = ?, attempts = attempts + 1, locked_until = ? WHERE id = ?',
+                (RUNNING, lease, row['id'])
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        job = dict(row)
+        job['attempts'] += 1
+        job['lease'] = lease
+        return job
+
+    def complete(self, job):
+        """Delete a job claimed by claim"""
+        self._connect().execute(
+            'DELETE FROM jobs WHERE id = ? AND status = ? AND locked_until = ?', (job['id'], RUNNING, job['lease'])
+        )
+
+    def fail(self, job, error, retry_in=None):
+        """Record a failed attempt; the job runs again in retry_in seconds, or is parked as failed when it is None"""
+        if retry_in is None:
+            status, run_after = FAILED, None
+        else:
+            status, run_after = PENDING, self._clock() + retry_in
+        self._connect().execute(
+            'UPDATE jobs SET status = ?, run_after = COALESCE(?, run_after), locked_until = NULL, error = ? '
+            'WHERE id = ? AND status = ? AND locked_until = ?',
+            (status, run_after, error, job['id'], RUNNING, job['lease'])
+        )
+
+    def remove_keys(self, kind, keys):
+        self._connect().executemany('DELETE FROM jobs WHERE kind = ? AND key = ?', [(kind, key) for key in keys])
+
+    def get(self, kind, key):
+        """Return the job for a key as a dict, or None when there is none (never queued, or done)"""
+        row = self._connect().execute(
+            'SELECT id, kind, key, status, attempts, error FROM jobs WHERE kind = ? AND key = ?', (kind, key)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def counts(self):
+        """Return the number of jobs per status"""
+        rows = self._connect().execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall()
+        return {status: count for status, count in rows}
+
+
+class JobWorker:
+    """Threads that claim jobs from a queue and run the handler registered for their kind.
+
+    Failed jobs are retried with exponential backoff until max_attempts; a
+    handler raising PermanentJobError fails the job straight away.
+    """
+
+    def __init__(self, queue, handlers, workers=2, max_attempts=5, retry_delay=5.0, poll_interval=2.0):
+        self.queue = queue
+        self.handlers = handlers
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self.pid = os.getpid()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def notify(self):
+        """Wake idle threads after a job was queued by this process"""
+        self._wake.set()
+
+    def run_one(self):
+        """Claim and run a single job, returns False when none was due"""
+        job = self.queue.claim()
+        if job is None:
+            return False
+
+        try:
+            self.handlers[job['kind']](job['key'])
+        except Exception as e:
+            error = f'{type(e).__name__}: {e}'
+            if isinstance(e, PermanentJobError) or job['attempts'] >= self.max_attempts:
+                self.queue.fail(job, error)
+            else:
+                self.queue.fail(job, error, retry_in=self.retry_delay * 2 ** (job['attempts'] - 1))
+        else:
+            self.queue.complete(job)
+        return True
+
+    def run_pending(self):
+        """Run jobs on the calling thread until none is due, returns how many ran"""
+        ran = 0
+        while self.run_one():
+            ran += 1
+        return ran
+
+    def start(self):
+        """Start the worker threads; calling it again does nothing"""
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'job-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                if self.run_one():
+                    continue
+            except sqlite3.Error:
+                pass  # Database busy or briefly unavailable; try again after the poll interval
+            self._wake.wait(self.poll_interval)
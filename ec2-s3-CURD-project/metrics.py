@@ -0,0 +1,201 @@
+"""
+Request and S3 call metrics in the Prometheus text format
+Metrics are kept per process; with several gunicorn workers each worker
+reports its own series and Prometheus sums them
+"""
+import threading
+import time
+from contextvars import ContextVar
+
+# Seconds; the Prometheus client library defaults
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+# Bytes, 256 B to 16 MB in powers of four
+SIZE_BUCKETS = tuple(256 * 4 ** i for i in range(9))
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    """A named family of series, one per combination of label values"""
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels: {", ".join(self.labelnames)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        with self._lock:
+            for values, series in sorted(self._series.items()):
+                lines.extend(self._render_series(values, series))
+        return lines
+
+    def _render_series(self, values, series):
+        return [f'{self.name}{_format_labels(self.labelnames, values)} {_format_value(series)}']
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._series.get(self._key(labels), 0)
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][i] += 1
+                    break
+            series['sum'] += value
+
+    def count(self, **labels):
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            return sum(series['counts']) if series else 0
+
+    def _render_series(self, values, series):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, series['counts']):
+            cumulative += count
+            labels = _format_labels(self.labelnames, values, [('le', _format_value(bound))])
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f'{self.name}_sum{labels} {_format_value(series["sum"])}')
+        lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Registry:
+    """The set of metrics rendered by one /metrics endpoint"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class RequestTimings:
+    """S3 time spent on behalf of one request, reported in its Server-Timing header"""
+
+    def __init__(self):
+        self.s3_calls = 0
+        self.s3_seconds = 0.0
+
+
+# Set for the duration of a request; S3 calls made from worker threads are not attributed to it
+current_timings = ContextVar('current_timings', default=None)
+
+
+class S3Instrumentation:
+    """Counts S3 operations, retries and time per operation through botocore's event hooks"""
+
+    def __init__(self, registry):
+        self.requests = registry.register(Counter(
+            's3_requests_total', 'S3 API calls by operation and outcome', ['operation', 'outcome']))
+        self.retries = registry.register(Counter(
+            's3_retries_total', 'HTTP attempts retried by botocore', ['operation']))
+        self.duration = registry.register(Histogram(
+            's3_request_duration_seconds', 'Time per S3 API call, retries included', ['operation']))
+
+    def attach(self, client):
+        """Instrument every API call made by a boto3 client"""
+        events = client.meta.events
+        events.register('before-call.s3', self._before_call)
+        events.register('before-send.s3', self._before_send)
+        events.register('after-call.s3', self._after_call)
+        events.register('after-call-error.s3', self._after_call_error)
+        return client
+
+    def _before_call(self, context, **kwargs):
+        context['metrics_started'] = time.monotonic()
+        context['metrics_attempts'] = 0
+
+    def _before_send(self, request, **kwargs):
+        context = getattr(request, 'context', None)
+        if context is not None and 'metrics_attempts' in context:
+            context['metrics_attempts'] += 1
+
+    def _after_call(self, model, context, http_response, **kwargs):
+        outcome = 'error' if http_response.status_code >= 400 else 'success'
+        self._record(model.name, context, outcome)
+
+    def _after_call_error(self, event_name, context, **kwargs):
+        # Connection errors and timeouts; this event carries no model, the operation ends the event name
+        self._record(event_name.rsplit('.', 1)[-1], context, 'exception')
+
+    def _record(self, operation, context, outcome):
+        started = context.pop('metrics_started', None)
+        if started is None:
+            return
+        elapsed = time.monotonic() - started
+        self.requests.inc(operation=operation, outcome=outcome)
+        self.duration.observe(elapsed, operation=operation)
+        retries = context.pop('metrics_attempts', 0) - 1
+        if retries > 0:
+            self.retries.inc(retries, operation=operation)
+
+        timings = current_timings.get()
+        if timings is not None:
+            timings.s3_calls += 1
+            timings.s3_seconds += elapsed
@@ -0,0 +1,290 @@
+"""
+Storage backends for the image manager
+S3Storage keeps images in an S3 bucket, LocalStorage on the local filesystem
+"""
+import hashlib
+import json
+import mimetypes
+import os
+import tempfile
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+
+ObjectInfo = namedtuple('ObjectInfo', ['key', 'size', 'last_modified', 'etag', 'content_type', 'metadata'])
+
+# Read size for streaming and copying object bodies
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Error codes S3 uses for a missing key
+NOT_FOUND_CODES = ('404', 'NoSuchKey', 'NotFound')
+
+
+class ObjectNotFound(Exception):
+    """Raised when a key does not exist in the storage backend"""
+
+
+class Storage:
+    """Interface every storage backend implements"""
+
+    name = None
+
+    def list(self, prefix=''):
+        """Yield an ObjectInfo for every key under prefix, in key order.
+
+        Listings may leave content_type and metadata as None.
+        """
+        raise NotImplementedError
+
+    def head(self, key):
+        """Return the ObjectInfo for key, raises ObjectNotFound"""
+        raise NotImplementedError
+
+    def open(self, key):
+        """Return (ObjectInfo, readable binary file object); the caller closes it"""
+        raise NotImplementedError
+
+    def put(self, key, fileobj, content_type, metadata=None):
+        """Store the contents of a file object under key"""
+        raise NotImplementedError
+
+    def delete(self, key):
+        """Delete key; deleting a missing key is not an error"""
+        raise NotImplementedError
+
+    def check(self):
+        """Raise if the backend cannot serve requests"""
+        raise NotImplementedError
+
+    def local_path(self, key):
+        """Return a filesystem path the WSGI server can sendfile() for key, or None"""
+        return None
+
+    def presigned_post(self, key, fields, conditions, expires_in):
+        """Return the url and form fields for a direct browser upload"""
+        raise NotImplementedError(f'Direct uploads are not supported by the {self.name} storage backend')
+
+    def exists(self, key):
+        try:
+            self.head(key)
+            return True
+        except ObjectNotFound:
+            return False
+
+    def stream(self, key, chunk_size=STREAM_CHUNK_SIZE):
+        """Return (ObjectInfo, iterator of body chunks), closing the body once exhausted"""
+        info, body = self.open(key)
+
+        def chunks():
+            try:
+                for chunk in iter(lambda: body.read(chunk_size), b''):
+                    yield chunk
+            finally:
+                body.close()
+
+        return info, chunks()
+
+    def delete_many(self, keys):
+        """Delete several keys, returns a list of per-key errors"""
+        errors = []
+        for key in keys:
+            try:
+                self.delete(key)
+            except Exception as e:
+                errors.append({'key': key, 'error': str(e)})
+        return errors
+
+
+class S3Storage(Storage):
+    """Objects in an S3 bucket, accessed through one boto3 client"""
+
+    name = 's3'
+
+    def __init__(self, client, bucket_name):
+        self.client = client
+        self.bucket_name = bucket_name
+
+    def list(self, prefix=''):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                yield ObjectInfo(obj['Key'], obj['Size'], obj['LastModified'], obj['ETag'].strip('"'), None, None)
+
+    def head(self, key):
+        try:
+            response = self.client.head_object(Bucket=self.bucket_name, Key=key)
+        except ClientError as e:
+            if e.response['Error']['Code'] in NOT_FOUND_CODES:
+                raise ObjectNotFound(f'Not found: {key}')
+            raise
+        return self._info(key, response)
+
+    def open(self, key):
+        try:
+            response = self.client.get_object(Bucket=self.bucket_name, Key=key)
+        except ClientError as e:
+            if e.response['Error']['Code'] in NOT_FOUND_CODES:
+                raise ObjectNotFound(f'Not found: {key}')
+            raise
+        return self._info(key, response), response['Body']
+
+    def _info(self, key, response):
+        return ObjectInfo(
+            key,
+            response['ContentLength'],
+            response['LastModified'],
+            response['ETag'].strip('"'),
+            response.get('ContentType'),
+            response.get('Metadata', {})
+        )
+
+    def put(self, key, fileobj, content_type, metadata=None):
+        self.client.upload_fileobj(
+            fileobj,
+            self.bucket_name,
+            key,
+            ExtraArgs={'ContentType': content_type, 'Metadata': metadata or {}}
+        )
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket_name, Key=key)
+
+    def delete_many(self, keys):
+        """Delete up to 1000 keys with one DeleteObjects call, returns a list of per-key errors"""
+        try:
+            response = self.client.delete_objects(
+                Bucket=self.bucket_name,
+                Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True}
+            )
+        except Exception as e:
+            return [{'key': key, 'error': str(e)} for key in keys]
+
+        return [
+            {'key': error['Key'], 'code': error.get('Code'), 'error': error.get('Message')}
+            for error in response.get('Errors', [])
+        ]
+
+    def check(self):
+        self.client.head_bucket(Bucket=self.bucket_name)
+
+    def presigned_post(self, key, fields, conditions, expires_in):
+        return self.client.generate_presigned_post(
+            Bucket=self.bucket_name,
+            Key=key,
+            Fields=fields,
+            Conditions=conditions,
+            ExpiresIn=expires_in
+        )
+
+
+class LocalStorage(Storage):
+    """Objects stored as plain files under a root directory.
+
+    Content type, metadata and ETag live in JSON sidecars under .meta/.
+    Writes go to a temp file that is renamed into place, so readers never
+    see a partial image.
+    """
+
+    name = 'local'
+    META_DIR = '.meta'
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        os.makedirs(os.path.join(self.root, self.META_DIR), exist_ok=True)
+
+    def _path(self, key):
+        """Map a key to a file path, refusing keys that would escape the root"""
+        normalized = os.path.normpath(key)
+        if (not key or '\0' in key or os.path.isabs(normalized) or normalized.startswith('..')
+                or normalized.split(os.sep)[0] == self.META_DIR):
+            raise ObjectNotFound(f'Invalid key: {key}')
+        return os.path.join(self.root, normalized)
+
+    def _meta_path(self, key):
+        return os.path.join(self.root, self.META_DIR, os.path.relpath(self._path(key), self.root) + '.json')
+
+    def list(self, prefix=''):
+        keys = []
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if dirpath == self.root:
+                dirnames[:] = [name for name in dirnames if name != self.META_DIR]
+            for filename in filenames:
+                if filename.startswith('.'):
+                    continue  # In-progress writes
+                key = os.path.relpath(os.path.join(dirpath, filename), self.root).replace(os.sep, '/')
+                if key.startswith(prefix):
+                    keys.append(key)
+
+        for key in sorted(keys):
+            try:
+                yield self.head(key)
+            except ObjectNotFound:
+                continue  # Deleted while listing
+
+    def head(self, key):
+        path = self._path(key)
+        try:
+            stat = os.stat(path)
+        except (FileNotFoundError, NotADirectoryError):
+            raise ObjectNotFound(f'Not found: {key}')
+
+        try:
+            with open(self._meta_path(key)) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = {}
+
+        return ObjectInfo(
+            key,
+            stat.st_size,
+            datetime.fromtimestamp(stat.st_mtime, timezone.utc),
+            meta.get('etag') or f'{stat.st_size:x}-{stat.st_mtime_ns:x}',
+            meta.get('content_type') or mimetypes.guess_type(key)[0],
+            meta.get('metadata', {})
+        )
+
+    def open(self, key):
+        info = self.head(key)
+        try:
+            return info, open(self._path(key), 'rb')
+        except FileNotFoundError:
+            raise ObjectNotFound(f'Not found: {key}')
+
+    def put(self, key, fileobj, content_type, metadata=None):
+        path = self._path(key)
+        digest = hashlib.md5()
+        self._write_atomic(path, lambda f: self._copy(fileobj, f, digest))
+        meta = json.dumps({'etag': digest.hexdigest(), 'content_type': content_type, 'metadata': metadata or {}})
+        self._write_atomic(self._meta_path(key), lambda f: f.write(meta.encode('utf-8')))
+
+    def _copy(self, source, target, digest):
+        for chunk in iter(lambda: source.read(STREAM_CHUNK_SIZE), b''):
+            digest.update(chunk)
+            target.write(chunk)
+
+    def _write_atomic(self, path, write):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def delete(self, key):
+        for path in (self._path(key), self._meta_path(key)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def check(self):
+        if not os.access(self.root, os.W_OK):
+            raise OSError(f'Storage directory is not writable: {self.root}')
+
+    def local_path(self, key):
+        return self._path(key)
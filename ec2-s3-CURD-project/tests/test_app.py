@@ -2,8 +2,12 @@
 Unit tests for the Flask S3 Image Manager application
 """
 import pytest
+import base64
+import hashlib
 import json
 import os
+import tempfile
+import zipfile
 from io import BytesIO
 from unittest.mock import patch, MagicMock
 import boto3
@@ -15,8 +19,14 @@ os.environ['AWS_SECRET_ACCESS_KEY'] = 'testing'
 os.environ['AWS_REGION'] = 'us-east-1'
 os.environ['S3_BUCKET_NAME'] = 'test-bucket'
 os.environ['SECRET_KEY'] = 'test-secret-key'
+os.environ['S3_HEALTH_PROBE_INTERVAL'] = '0'
+os.environ['INDEX_DB_PATH'] = os.path.join(tempfile.mkdtemp(), 'image_index.db')
+os.environ['IMAGE_VARIANT_DIR'] = tempfile.mkdtemp()
+os.environ['METADATA_WORKERS'] = '0'
 
-from app import app, allowed_file, generate_unique_filename, ALLOWED_EXTENSIONS
+from app import app, allowed_file, generate_unique_filename, s3_breaker, ALLOWED_EXTENSIONS
+from circuit_breaker import CircuitBreaker, HealthProber
+from PIL import Image
 
 
 @pytest.fixture
@@ -24,6 +34,7 @@ def client():
     """Create a test client for the Flask application"""
     app.config['TESTING'] = True
     app.config['WTF_CSRF_ENABLED'] = False
+    s3_breaker.reset()
     with app.test_client() as client:
         yield client
 
@@ -108,6 +119,67 @@ class TestHealthEndpoints:
         assert response.status_code == 200
         data = json.loads(response.data)
         assert data['status'] == 'healthy'
+    
+    def test_prober_only_starts_with_the_server(self, client):
+        """Test that looking up storage starts no thread; start_background_threads does"""
+        from app import get_health_prober, get_storage, start_background_threads
+        app.config['S3_HEALTH_PROBE_INTERVAL'] = 10
+        try:
+            get_storage()
+            assert get_health_prober() is None
+            with patch.object(HealthProber, 'start') as start:
+                start_background_threads()
+            assert start.called
+            assert get_health_prober() is not None
+        finally:
+            app.config['S3_HEALTH_PROBE_INTERVAL'] = 0
+            app.extensions.pop('health_prober', None)
+    
+    def test_s3_client_uses_configured_region(self):
+        """Test that the S3 client is created in AWS_REGION"""
+        from app import get_s3_client
+        app.config['AWS_REGION'] = 'eu-west-1'
+        try:
+            assert get_s3_client().meta.region_name == 'eu-west-1'
+        finally:
+            app.config['AWS_REGION'] = 'us-east-1'
+    
+    def test_health_s3_answers_from_prober(self, client):
+        """Test that /health/s3 uses the prober's last result without calling S3"""
+        prober = HealthProber(lambda: None, 10)
+        prober.probe()
+        app.config['S3_HEALTH_PROBE_INTERVAL'] = 10
+        app.extensions['health_prober'] = prober
+        try:
+            with patch('app.get_s3_client') as mock_client:
+                response = client.get('/health/s3')
+                assert not mock_client.called
+        finally:
+            app.config['S3_HEALTH_PROBE_INTERVAL'] = 0
+            del app.extensions['health_prober']
+        
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert data['status'] == 'healthy'
+        assert data['circuit'] == CircuitBreaker.CLOSED
+        assert data['bucket'] == 'test-bucket'
+    
+    @mock_aws
+    def test_open_circuit_fails_fast(self, client):
+        """Test that routes do not reach S3 while the circuit is open"""
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='test-bucket')
+        
+        for _ in range(s3_breaker.min_calls):
+            s3_breaker.record_failure()
+        try:
+            response = client.get('/api/images')
+            assert response.status_code == 500
+            assert 'circuit is open' in json.loads(response.data)['error']
+        finally:
+            s3_breaker.reset()
+        
+        assert client.get('/api/images').status_code == 200
 
 
 class TestIndexRoute:
@@ -228,6 +300,238 @@ class TestAPIEndpoints:
         assert 'Invalid file type' in data['error']
 
 
+class TestImageSearch:
+    """Tests for searching /api/images through the local index"""
+    
+    @pytest.fixture
+    def fresh_index(self, tmp_path):
+        app.config['INDEX_DB_PATH'] = str(tmp_path / 'search.db')
+        yield
+        app.config['INDEX_DB_PATH'] = os.environ['INDEX_DB_PATH']
+    
+    @mock_aws
+    def test_search_uploaded_images(self, client, fresh_index):
+        """Test that uploads are indexed and can be filtered and sorted"""
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='test-bucket')
+        
+        for body, name, content_type in [(b'a' * 30, 'a.jpg', 'image/jpeg'),
+                                         (b'b' * 10, 'b.png', 'image/png'),
+                                         (b'c' * 20, 'c.jpg', 'image/jpeg')]:
+            client.post('/api/upload', data={'file': (BytesIO(body), name, content_type)},
+                        content_type='multipart/form-data')
+        
+        response = client.get('/api/images?content_type=image/jpeg&sort=-size')
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert [image['size'] for image in data['images']] == [30, 20]
+        assert data['next_cursor'] is None
+        
+        data = json.loads(client.get('/api/images?min_size=15&limit=1&sort=size').data)
+        assert data['images'][0]['size'] == 20
+        data = json.loads(client.get(f"/api/images?min_size=15&limit=1&sort=size&cursor={data['next_cursor']}").data)
+        assert data['images'][0]['size'] == 30
+    
+    def test_search_invalid_params(self, client, fresh_index):
+        """Test that bad search parameters are rejected"""
+        assert client.get('/api/images?sort=owner').status_code == 400
+        assert client.get('/api/images?limit=0').status_code == 400
+        assert client.get('/api/images?limit=abc').status_code == 400
+        assert client.get('/api/images?min_size=big').status_code == 400
+        assert client.get('/api/images?max_size=1.5').status_code == 400
+        assert client.get('/api/images?modified_after=yesterday').status_code == 400
+        assert client.get('/api/images?cursor=garbage').status_code == 400
+    
+    @mock_aws
+    def test_sync_index_command(self, client, fresh_index):
+        """Test that sync-index indexes objects written outside the app"""
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='test-bucket')
+        s3.put_object(Bucket='test-bucket', Key='external/photo.jpg', Body=b'test')
+        s3.put_object(Bucket='test-bucket', Key='external/notes.txt', Body=b'test')
+        
+        result = app.test_cli_runner().invoke(args=['sync-index'])
+        assert 'Indexed 1 images' in result.output
+        
+        data = json.loads(client.get('/api/images?prefix=external/').data)
+        assert data['images'] == [{
+            'key': 'external/photo.jpg',
+            'size': 4,
+            'last_modified': data['images'][0]['last_modified'],
+            'content_type': 'image/jpeg'
+        }]
+
+
+class TestUploadDeduplication:
+    """Tests for content-hash deduplication of uploads"""
+    
+    @mock_aws
+    def test_duplicate_upload_reuses_key(self, client):
+        """Test that identical bytes are stored once and the existing key is returned"""
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='test-bucket')
+        
+        first = client.post('/api/upload', data={'file': (BytesIO(b'same photo'), 'a.jpg', 'image/jpeg')},
+                            content_type='multipart/form-data')
+        second = client.post('/api/upload', data={'file': (BytesIO(b'same photo'), 'b.jpg', 'image/jpeg')},
+                             content_type='multipart/form-data')
+        first, second = json.loads(first.data), json.loads(second.data)
+        
+        assert first['duplicate'] is False
+        assert second['duplicate'] is True
+        assert second['filename'] == first['filename']
+        assert second['original_filename'] == 'b.jpg'
+        assert s3.list_objects_v2(Bucket='test-bucket')['KeyCount'] == 1
+        
+        head = s3.head_object(Bucket='test-bucket', Key=first['filename'])
+        assert head['Metadata']['sha256'] == hashlib.sha256(b'same photo').hexdigest()
+    
+    @mock_aws
+    def test_upload_after_delete_stores_again(self, client):
+        """Test that deleting the stored object lets the same bytes be uploaded again"""
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='test-bucket')
+        
+        data = lambda: {'file': (BytesIO(b'deleted photo'), 'a.jpg', 'image/jpeg')}
+        first = json.loads(client.post('/api/upload', data=data(), content_type='multipart/form-data').data)
+        client.delete(f"/api/delete/{first['filename']}")
+        
+        second = json.loads(client.post('/api/upload', data=data(), content_type='multipart/form-data').data)
+        assert second['duplicate'] is False
+        assert second['filename'] != first['filename']
+    
+    @mock_aws
+    def test_upload_when_stored_object_vanished(self, client):
+        """Test that an index entry for an object removed outside the app is ignored"""
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='test-bucket')
+        
+        data = lambda: {'file': (BytesIO(b'vanished photo'), 'a.jpg', 'image/jpeg')}
+        first = json.loads(client.post('/api/upload', data=data(), content_type='multipart/form-data').data)
+        s3.delete_object(Bucket='test-bucket', Key=first['filename'])
+        
+        second = json.loads(client.post('/api/upload', data=data(), content_type='multipart/form-data').data)
+        assert second['duplicate'] is False
+        assert s3.list_objects_v2(Bucket='test-bucket')['KeyCount'] == 1
+
+
+class TestPresignedUpload:
+    """Tests for direct browser-to-S3 uploads"""
+    
+    def test_presign_rejects_invalid_type(self, client):
+        """Test that disallowed extensions and content types get no policy"""
+        response = client.post('/api/upload/presign', json={'filename': 'notes.txt', 'content_type': 'text/plain'})
+        assert response.status_code == 400
+        response = client.post('/api/upload/presign', json={'filename': 'a.jpg', 'content_type': 'text/html'})
+        assert response.status_code == 400
+    
+    @mock_aws
+    def test_presign_policy_enforces_limits(self, client):
+        """Test that the policy pins content type and the maximum size"""
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='test-bucket')
+        
+        response = client.post('/api/upload/presign', json={'filename': 'a.jpg', 'content_type': 'image/jpeg'})
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert data['fields']['key'] == data['filename']
+        assert data['fields']['Content-Type'] == 'image/jpeg'
+        
+        policy = json.loads(base64.b64decode(data['fields']['policy']))
+        assert ['content-length-range', 1, app.config['MAX_CONTENT_LENGTH']] in policy['conditions']
+        assert {'Content-Type': 'image/jpeg'} in policy['conditions']
+    
+    @mock_aws
+    def test_complete_records_upload(self, client, tmp_path):
+        """Test that completing a direct upload indexes the object"""
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='test-bucket')
+        key = generate_unique_filename('a.jpg')
+        s3.put_object(Bucket='test-bucket', Key=key, Body=b'direct', ContentType='image/jpeg',
+                      Metadata={'original_filename': 'a.jpg'})
+        
+        app.config['INDEX_DB_PATH'] = str(tmp_path / 'complete.db')
+        try:
+            response = client.post('/api/upload/complete', json={'filename': key})
+            assert response.status_code == 200
+            data = json.loads(response.data)
+            assert data['original_filename'] == 'a.jpg'
+            assert data['size'] == 6
+            
+            data = json.loads(client.get('/api/images?content_type=image/jpeg').data)
+            assert [image['key'] for image in data['images']] == [key]
+        finally:
+            app.config['INDEX_DB_PATH'] = os.environ['INDEX_DB_PATH']
+    
+    @mock_aws
+    def test_complete_unknown_upload(self, client):
+        """Test that completing an upload that never reached S3 fails"""
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='test-bucket')
+        
+        response = client.post('/api/upload/complete', json={'filename': generate_unique_filename('a.jpg')})
+        assert response.status_code == 404
+        response = client.post('/api/upload/complete', json={'filename': 'someone-elses.jpg'})
+        assert response.status_code == 400
+
+
+class TestBatchUpload:
+    """Tests for the batch upload API"""
+    
+    def test_batch_upload_no_files(self, client):
+        """Test batch upload with no files"""
+        response = client.post('/api/upload/batch', data={})
+        assert response.status_code == 400
+        data = json.loads(response.data)
+        assert 'error' in data
+    
+    @mock_aws
+    def test_batch_upload_all_valid(self, client):
+        """Test batch upload where every file is accepted"""
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='test-bucket')
+        
+        data = {
+            'files': [
+                (BytesIO(b'one'), 'one.jpg', 'image/jpeg'),
+                (BytesIO(b'two'), 'two.png', 'image/png'),
+                (BytesIO(b'three'), 'three.gif', 'image/gif'),
+            ]
+        }
+        response = client.post('/api/upload/batch', data=data,
+                               content_type='multipart/form-data')
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert data['uploaded'] == 3
+        assert data['failed'] == 0
+        assert [r['original_filename'] for r in data['results']] == ['one.jpg', 'two.png', 'three.gif']
+        
+        objects = s3.list_objects_v2(Bucket='test-bucket')
+        assert len(objects['Contents']) == 3
+    
+    @mock_aws
+    def test_batch_upload_partial_failure(self, client):
+        """Test that an invalid part does not abort the rest of the batch"""
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='test-bucket')
+        
+        data = {
+            'files': [
+                (BytesIO(b'one'), 'one.jpg', 'image/jpeg'),
+                (BytesIO(b'notes'), 'notes.txt', 'text/plain'),
+            ]
+        }
+        response = client.post('/api/upload/batch', data=data,
+                               content_type='multipart/form-data')
+        assert response.status_code == 207
+        data = json.loads(response.data)
+        assert data['uploaded'] == 1
+        assert data['failed'] == 1
+        assert data['results'][0]['status'] == 'uploaded'
+        assert data['results'][1]['status'] == 'error'
+        assert 'Invalid file type' in data['results'][1]['error']
+
+
 class TestDeleteRoute:
     """Tests for delete functionality"""
     
@@ -258,6 +562,475 @@ class TestDeleteRoute:
         assert 'Successfully deleted' in data['message']
 
 
+class TestBulkDelete:
+    """Tests for the bulk delete API"""
+    
+    def test_bulk_delete_requires_filter(self, client):
+        """Test that an empty request is rejected instead of clearing the bucket"""
+        response = client.post('/api/delete/batch', json={})
+        assert response.status_code == 400
+        data = json.loads(response.data)
+        assert 'error' in data
+    
+    @mock_aws
+    def test_bulk_delete_by_keys(self, client):
+        """Test deleting an explicit list of keys"""
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='test-bucket')
+        for key in ['a.jpg', 'b.jpg', 'c.jpg']:
+            s3.put_object(Bucket='test-bucket', Key=key, Body=b'test')
+        
+        response = client.post('/api/delete/batch', json={'keys': ['a.jpg', 'b.jpg']})
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert data['deleted'] == 2
+        assert data['errors'] == []
+        
+        objects = s3.list_objects_v2(Bucket='test-bucket')
+        assert [obj['Key'] for obj in objects['Contents']] == ['c.jpg']
+    
+    @mock_aws
+    def test_bulk_delete_by_prefix(self, client):
+        """Test deleting every key under a prefix"""
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='test-bucket')
+        for key in ['old/a.jpg', 'old/b.jpg', 'new/c.jpg']:
+            s3.put_object(Bucket='test-bucket', Key=key, Body=b'test')
+        
+        response = client.post('/api/delete/batch', json={'prefix': 'old/'})
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert data['deleted'] == 2
+        
+        objects = s3.list_objects_v2(Bucket='test-bucket')
+        assert [obj['Key'] for obj in objects['Contents']] == ['new/c.jpg']
+    
+    @mock_aws
+    def test_bulk_delete_by_filter_keeps_other_files(self, client):
+        """Test that a date filter only deletes images"""
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='test-bucket')
+        for key in ['a.jpg', 'notes.txt', 'backup.tar']:
+            s3.put_object(Bucket='test-bucket', Key=key, Body=b'test')
+        
+        response = client.post('/api/delete/batch', json={'modified_before': '2999-01-01T00:00:00'})
+        assert response.status_code == 200
+        assert json.loads(response.data)['deleted'] == 1
+        
+        objects = s3.list_objects_v2(Bucket='test-bucket')
+        assert sorted(obj['Key'] for obj in objects['Contents']) == ['backup.tar', 'notes.txt']
+    
+    def test_bulk_delete_rejects_invalid_keys(self, client):
+        """Test that keys other than non-empty strings are a 400, not a 500"""
+        for keys in ['a.jpg', ['a.jpg', 1], ['a.jpg', ''], [None], [['a.jpg']]]:
+            response = client.post('/api/delete/batch', json={'keys': keys})
+            assert response.status_code == 400
+            assert 'keys must be a list' in json.loads(response.data)['error']
+    
+    def test_bulk_delete_batches_and_reports_errors(self, client):
+        """Test that keys are sent in batches of 1000 and per-key errors are reported"""
+        keys = [f'{i}.jpg' for i in range(2500)]
+        with patch('app.get_s3_client') as mock_client:
+            mock_s3 = MagicMock()
+            mock_s3.delete_objects.return_value = {
+                'Errors': [{'Key': '0.jpg', 'Code': 'AccessDenied', 'Message': 'Access Denied'}]
+            }
+            mock_client.return_value = mock_s3
+            
+            response = client.post('/api/delete/batch', json={'keys': keys})
+        
+        assert response.status_code == 207
+        batch_sizes = sorted(len(call.kwargs['Delete']['Objects']) for call in mock_s3.delete_objects.call_args_list)
+        assert batch_sizes == [500, 1000, 1000]
+        data = json.loads(response.data)
+        assert data['failed'] == 3
+        assert data['errors'][0] == {'key': '0.jpg', 'code': 'AccessDenied', 'error': 'Access Denied'}
+
+
+class TestServeImageCaching:
+    """Tests for validators and conditional requests on served images"""
+    
+    @mock_aws
+    def test_serve_image_sets_validators(self, client):
+        """Test that served images carry ETag and Last-Modified"""
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='test-bucket')
+        s3.put_object(Bucket='test-bucket', Key='test.jpg', Body=b'test', ContentType='image/jpeg')
+        etag = s3.head_object(Bucket='test-bucket', Key='test.jpg')['ETag'].strip('"')
+        
+        response = client.get('/image/test.jpg')
+        assert response.status_code == 200
+        assert response.data == b'test'
+        assert response.headers['ETag'] == f'"{etag}"'
+        assert 'Last-Modified' in response.headers
+        assert 'no-cache' in response.headers['Cache-Control']
+    
+    @mock_aws
+    def test_serve_image_if_none_match(self, client):
+        """Test that a matching If-None-Match returns 304 without a body"""
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='test-bucket')
+        s3.put_object(Bucket='test-bucket', Key='test.jpg', Body=b'test')
+        
+        etag = client.get('/image/test.jpg').headers['ETag']
+        response = client.get('/image/test.jpg', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.data == b''
+        assert response.headers['ETag'] == etag
+        
+        response = client.get('/image/test.jpg', headers={'If-None-Match': '"stale"'})
+        assert response.status_code == 200
+    
+    @mock_aws
+    def test_serve_image_if_modified_since(self, client):
+        """Test that If-Modified-Since at or after LastModified returns 304"""
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='test-bucket')
+        s3.put_object(Bucket='test-bucket', Key='test.jpg', Body=b'test')
+        
+        last_modified = client.get('/image/test.jpg').headers['Last-Modified']
+        response = client.get('/image/test.jpg', headers={'If-Modified-Since': last_modified})
+        assert response.status_code == 304
+    
+    @mock_aws
+    def test_serve_image_unique_key_is_immutable(self, client):
+        """Test that uuid-named keys get a long-lived Cache-Control"""
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='test-bucket')
+        key = generate_unique_filename('photo.jpg')
+        s3.put_object(Bucket='test-bucket', Key=key, Body=b'test')
+        
+        response = client.get(f'/image/{key}')
+        assert response.status_code == 200
+        cache_control = response.headers['Cache-Control']
+        assert 'immutable' in cache_control
+        assert 'max-age=31536000' in cache_control
+    
+    @mock_aws
+    def test_serve_image_from_disk_cache(self, client, tmp_path):
+        """Test that a cached uuid-named image is served without calling S3 again"""
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='test-bucket')
+        key = generate_unique_filename('photo.png')
+        s3.put_object(Bucket='test-bucket', Key=key, Body=b'cached image', ContentType='image/png')
+        
+        app.config['IMAGE_CACHE_DIR'] = str(tmp_path)
+        try:
+            first = client.get(f'/image/{key}')
+            assert first.status_code == 200
+            assert first.data == b'cached image'
+            
+            with patch('app.get_s3_client') as mock_client:
+                mock_client.return_value = MagicMock()
+                second = client.get(f'/image/{key}')
+                assert not mock_client.return_value.get_object.called
+                assert not mock_client.return_value.head_object.called
+            
+            assert second.status_code == 200
+            assert second.data == b'cached image'
+            assert second.mimetype == 'image/png'
+            assert second.headers['ETag'] == first.headers['ETag']
+            
+            client.delete(f'/api/delete/{key}')
+            assert app.extensions['image_cache'].get(key) is None
+        finally:
+            app.config['IMAGE_CACHE_DIR'] = ''
+
+
+class TestImageVariants:
+    """Tests for Accept negotiation and ?w= resizing on /image"""
+    
+    @staticmethod
+    def jpeg(size=(1200, 900)):
+        buffer = BytesIO()
+        Image.new('RGB', size, 'blue').save(buffer, 'JPEG')
+        return buffer.getvalue()
+    
+    @mock_aws
+    def test_original_without_webp_in_accept(self, client):
+        """Test that clients that do not ask for a modern format get the stored bytes"""
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='test-bucket')
+        body = self.jpeg()
+        s3.put_object(Bucket='test-bucket', Key='photo.jpg', Body=body, ContentType='image/jpeg')
+        
+        response = client.get('/image/photo.jpg', headers={'Accept': 'image/*'})
+        assert response.status_code == 200
+        assert response.data == body
+        assert 'Accept' in response.headers['Vary']
+    
+    @mock_aws
+    def test_webp_negotiation_and_resize(self, client):
+        """Test that a resized WebP is produced once and reused"""
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='test-bucket')
+        key = 'a1b2c3d4e5f6a7b8c9d0e1f2a3b4c5d6_20240101_120000.jpg'
+        s3.put_object(Bucket='test-bucket', Key=key, Body=self.jpeg(), ContentType='image/jpeg')
+        headers = {'Accept': 'image/webp,*/*;q=0.8'}
+        
+        with patch('app.transcode', wraps=__import__('transcode').transcode) as transcode:
+            response = client.get(f'/image/{key}?w=600', headers=headers)
+            assert response.status_code == 200
+            assert response.mimetype == 'image/webp'
+            assert Image.open(BytesIO(response.data)).size == (640, 480)
+            assert 'Accept' in response.headers['Vary']
+            
+            again = client.get(f'/image/{key}?w=640', headers=headers)
+            assert again.data == response.data
+            assert transcode.call_count == 1
+        
+        revalidated = client.get(f'/image/{key}?w=640', headers=dict(headers, **{'If-None-Match': response.headers['ETag']}))
+        assert revalidated.status_code == 304
+    
+    @mock_aws
+    def test_resized_jpeg_for_legacy_clients(self, client):
+        """Test that ?w= alone keeps the original format"""
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='test-bucket')
+        s3.put_object(Bucket='test-bucket', Key='photo.jpg', Body=self.jpeg(), ContentType='image/jpeg')
+        
+        response = client.get('/image/photo.jpg?w=320')
+        assert response.mimetype == 'image/jpeg'
+        assert Image.open(BytesIO(response.data)).size == (320, 240)
+    
+    @mock_aws
+    def test_disabled_without_variant_dir(self, client):
+        """Test that images are served as stored until IMAGE_VARIANT_DIR is set"""
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='test-bucket')
+        s3.put_object(Bucket='test-bucket', Key='photo.jpg', Body=self.jpeg(), ContentType='image/jpeg')
+        
+        variant_dir = app.config['IMAGE_VARIANT_DIR']
+        app.config['IMAGE_VARIANT_DIR'] = ''
+        try:
+            response = client.get('/image/photo.jpg?w=320', headers={'Accept': 'image/webp'})
+        finally:
+            app.config['IMAGE_VARIANT_DIR'] = variant_dir
+        assert response.data == self.jpeg()
+        assert 'Accept' not in response.vary
+    
+    @mock_aws
+    def test_oversized_image_served_as_stored(self, client):
+        """Test that an image over Pillow's pixel limit is sent as stored instead of failing"""
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='test-bucket')
+        body = self.jpeg()
+        s3.put_object(Bucket='test-bucket', Key='huge.jpg', Body=body, ContentType='image/jpeg')
+        
+        with patch.object(Image, 'MAX_IMAGE_PIXELS', 1000):
+            response = client.get('/image/huge.jpg?w=320', headers={'Accept': 'image/webp'})
+        assert response.status_code == 200
+        assert response.data == body
+    
+    def test_invalid_width(self, client):
+        """Test that a non-numeric width is rejected"""
+        assert client.get('/image/photo.jpg?w=abc').status_code == 400
+        assert client.get('/image/photo.jpg?w=0').status_code == 400
+    
+    @mock_aws
+    def test_delete_discards_variants(self, client):
+        """Test that deleting an image drops its cached variants"""
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='test-bucket')
+        s3.put_object(Bucket='test-bucket', Key='photo.jpg', Body=self.jpeg(), ContentType='image/jpeg')
+        client.get('/image/photo.jpg?w=320')
+        
+        from app import get_variant_cache
+        assert get_variant_cache().get('photo.jpg\x00320.jpg') is not None
+        client.delete('/api/delete/photo.jpg')
+        assert get_variant_cache().get('photo.jpg\x00320.jpg') is None
+
+
+class TestMetadataExtraction:
+    """Tests for background metadata extraction after upload"""
+    
+    @mock_aws
+    def test_upload_queues_extraction(self, client):
+        """Test that an upload is answered before extraction and the job fills in metadata"""
+        from app import get_metadata_worker
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='test-bucket')
+        get_metadata_worker().run_pending()  # Jobs left by earlier tests
+        buffer = BytesIO()
+        Image.new('RGB', (120, 80), 'red').save(buffer, 'PNG')
+        
+        response = client.post('/api/upload', data={'file': (BytesIO(buffer.getvalue()), 'red.png')},
+                               content_type='multipart/form-data')
+        key = response.get_json()['filename']
+        
+        pending = client.get(f'/api/images/{key}/metadata')
+        assert pending.status_code == 202
+        assert pending.get_json()['status'] == 'pending'
+        
+        assert get_metadata_worker().run_pending() == 1
+        done = client.get(f'/api/images/{key}/metadata')
+        assert done.status_code == 200
+        metadata = done.get_json()['metadata']
+        assert (metadata['width'], metadata['height']) == (120, 80)
+        assert metadata['format'] == 'PNG'
+        assert metadata['dominant_color'] == '#ff0000'
+    
+    def test_worker_threads_only_start_with_the_server(self, client):
+        """Test that looking up storage or the worker starts no thread; start_background_threads does"""
+        from app import get_metadata_worker, get_storage, start_background_threads
+        from job_queue import JobWorker
+        with patch.object(JobWorker, 'start') as start:
+            get_storage()
+            get_metadata_worker()
+            assert not start.called
+            start_background_threads()
+            assert start.called
+    
+    @mock_aws
+    def test_unreadable_upload_fails_without_retry(self, client):
+        """Test that files Pillow cannot read fail their job once"""
+        from app import get_metadata_worker
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='test-bucket')
+        
+        response = client.post('/api/upload', data={'file': (BytesIO(b'not really an image'), 'fake.jpg')},
+                               content_type='multipart/form-data')
+        key = response.get_json()['filename']
+        get_metadata_worker().run_pending()
+        
+        body = client.get(f'/api/images/{key}/metadata').get_json()
+        assert body['status'] == 'failed'
+        assert body['attempts'] == 1
+    
+    def test_unknown_key(self, client):
+        """Test that keys never uploaded have no metadata"""
+        assert client.get('/api/images/never-uploaded.jpg/metadata').status_code == 404
+
+
+class TestZipDownload:
+    """Tests for streaming ZIP downloads"""
+    
+    def test_zip_requires_selection(self, client):
+        """Test that a request without keys or prefix is rejected"""
+        assert client.get('/api/download/zip').status_code == 400
+    
+    @mock_aws
+    def test_zip_by_keys(self, client):
+        """Test downloading chosen keys as one archive"""
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='test-bucket')
+        for key in ['a.jpg', 'b.jpg', 'c.jpg']:
+            s3.put_object(Bucket='test-bucket', Key=key, Body=key.encode())
+        
+        response = client.get('/api/download/zip?key=c.jpg&key=a.jpg')
+        assert response.status_code == 200
+        assert response.mimetype == 'application/zip'
+        assert 'images.zip' in response.headers['Content-Disposition']
+        
+        archive = zipfile.ZipFile(BytesIO(response.data))
+        assert archive.namelist() == ['c.jpg', 'a.jpg']
+        assert archive.read('a.jpg') == b'a.jpg'
+    
+    @mock_aws
+    def test_zip_by_prefix(self, client):
+        """Test downloading every image under a prefix"""
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='test-bucket')
+        for key in ['album/1.jpg', 'album/2.png', 'album/notes.txt', 'other/3.jpg']:
+            s3.put_object(Bucket='test-bucket', Key=key, Body=b'x')
+        
+        response = client.post('/api/download/zip', json={'prefix': 'album/'})
+        assert response.status_code == 200
+        archive = zipfile.ZipFile(BytesIO(response.data))
+        assert archive.namelist() == ['album/1.jpg', 'album/2.png']
+        
+        response = client.post('/api/download/zip', json={'prefix': 'empty/'})
+        assert response.status_code == 404
+
+
+class TestMetricsEndpoint:
+    """Tests for request metrics, /metrics and Server-Timing"""
+    
+    def test_metrics_endpoint(self, client):
+        """Test that requests show up in the Prometheus output"""
+        client.get('/health')
+        response = client.get('/metrics')
+        assert response.status_code == 200
+        assert response.content_type.startswith('text/plain; version=0.0.4')
+        
+        text = response.get_data(as_text=True)
+        assert '# TYPE http_request_duration_seconds histogram' in text
+        assert 'http_request_duration_seconds_count{method="GET",endpoint="/health",status="200"}' in text
+        assert 'http_response_size_bytes_count{method="GET",endpoint="/health"}' in text
+        assert 'http_requests_in_flight 1' in text
+    
+    def test_endpoint_label_uses_route_pattern(self, client):
+        """Test that keys in the URL do not create a series per key"""
+        with patch('app.get_storage', return_value=None):
+            client.delete('/api/delete/some-key.jpg')
+        text = client.get('/metrics').get_data(as_text=True)
+        assert 'endpoint="/api/delete/<path:key>"' in text
+        assert 'some-key.jpg' not in text
+    
+    @mock_aws
+    def test_server_timing_and_s3_metrics(self, client):
+        """Test that S3 calls are timed per request and counted per operation"""
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='test-bucket')
+        s3.put_object(Bucket='test-bucket', Key='a.jpg', Body=b'a')
+        
+        response = client.get('/api/images')
+        assert response.status_code == 200
+        server_timing = response.headers['Server-Timing']
+        assert server_timing.startswith('app;dur=')
+        assert 'storage;dur=' in server_timing
+        assert 'S3 calls' in server_timing
+        
+        text = client.get('/metrics').get_data(as_text=True)
+        assert 's3_requests_total{operation="ListObjectsV2",outcome="success"}' in text
+        assert 's3_request_duration_seconds_count{operation="ListObjectsV2"}' in text
+
+
+class TestLocalStorageBackend:
+    """Tests for running the app on the local filesystem backend"""
+    
+    @pytest.fixture
+    def local_backend(self, tmp_path):
+        app.config['STORAGE_BACKEND'] = 'local'
+        app.config['LOCAL_STORAGE_DIR'] = str(tmp_path / 'storage')
+        app.config['INDEX_DB_PATH'] = str(tmp_path / 'local.db')
+        yield
+        app.config['STORAGE_BACKEND'] = 's3'
+        app.config['INDEX_DB_PATH'] = os.environ['INDEX_DB_PATH']
+    
+    def test_upload_serve_delete(self, client, local_backend):
+        """Test the full image lifecycle without S3"""
+        with patch('app.get_s3_client') as mock_client:
+            response = client.post('/api/upload', data={'file': (BytesIO(b'local image'), 'a.png', 'image/png')},
+                                   content_type='multipart/form-data')
+            assert response.status_code == 200
+            key = json.loads(response.data)['filename']
+            
+            data = json.loads(client.get('/api/images').data)
+            assert [image['key'] for image in data['images']] == [key]
+            
+            response = client.get(f'/image/{key}')
+            assert response.status_code == 200
+            assert response.data == b'local image'
+            assert response.mimetype == 'image/png'
+            assert 'immutable' in response.headers['Cache-Control']
+            
+            response = client.get(f'/image/{key}', headers={'If-None-Match': response.headers['ETag']})
+            assert response.status_code == 304
+            
+            response = client.get(f'/download/{key}')
+            assert response.data == b'local image'
+            
+            assert client.delete(f'/api/delete/{key}').status_code == 200
+            assert client.get(f'/image/{key}').status_code == 404
+            assert not mock_client.called
+    
+    def test_presign_not_supported(self, client, local_backend):
+        """Test that direct uploads are refused on the local backend"""
+        response = client.post('/api/upload/presign', json={'filename': 'a.jpg', 'content_type': 'image/jpeg'})
+        assert response.status_code == 400
+
+
 class TestDownloadRoute:
     """Tests for download functionality"""
     
@@ -0,0 +1,78 @@
+"""
+Unit tests for streaming ZIP archives
+"""
+import threading
+import time
+import zipfile
+from io import BytesIO
+
+from archive import stream_zip
+from storage import LocalStorage
+
+
+class SlowStorage(LocalStorage):
+    """LocalStorage that records how many opens run at once"""
+    
+    def __init__(self, root):
+        super().__init__(root)
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+    
+    def open(self, key):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.02)
+        try:
+            return super().open(key)
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+def read_zip(chunks):
+    return zipfile.ZipFile(BytesIO(b''.join(chunks)))
+
+
+class TestStreamZip:
+    """Tests for stream_zip"""
+    
+    def test_archive_contains_every_key_in_order(self, tmp_path):
+        storage = LocalStorage(str(tmp_path))
+        for i in range(5):
+            storage.put(f'dir/{i}.jpg', BytesIO(f'image {i}'.encode() * 1000), 'image/jpeg')
+        
+        archive = read_zip(stream_zip(storage, [f'dir/{i}.jpg' for i in range(5)], prefetch=2))
+        assert archive.namelist() == [f'dir/{i}.jpg' for i in range(5)]
+        assert archive.read('dir/3.jpg') == b'image 3' * 1000
+        assert archive.testzip() is None
+    
+    def test_yields_incrementally(self, tmp_path):
+        """Test that the archive is produced in many chunks, not one buffer"""
+        storage = LocalStorage(str(tmp_path))
+        for i in range(3):
+            storage.put(f'{i}.jpg', BytesIO(b'x' * 200000), 'image/jpeg')
+        
+        chunks = list(stream_zip(storage, ['0.jpg', '1.jpg', '2.jpg']))
+        assert len(chunks) > 3
+        assert all(chunks)
+        assert max(len(chunk) for chunk in chunks) < 200000
+    
+    def test_prefetch_is_bounded(self, tmp_path):
+        storage = SlowStorage(str(tmp_path))
+        keys = [f'{i}.jpg' for i in range(12)]
+        for key in keys:
+            storage.put(key, BytesIO(b'x'), 'image/jpeg')
+        
+        archive = read_zip(stream_zip(storage, keys, prefetch=3))
+        assert len(archive.namelist()) == 12
+        assert 1 < storage.max_active <= 3
+    
+    def test_missing_keys_are_reported(self, tmp_path):
+        storage = LocalStorage(str(tmp_path))
+        storage.put('a.jpg', BytesIO(b'a'), 'image/jpeg')
+        
+        archive = read_zip(stream_zip(storage, ['a.jpg', 'missing.jpg']))
+        assert archive.namelist() == ['a.jpg', 'errors.txt']
+        assert b'missing.jpg' in archive.read('errors.txt')
@@ -0,0 +1,203 @@
+"""
+Tests for the async S3 entry point, run against a moto server
+"""
+import asyncio
+import json
+import os
+import socket
+import tempfile
+import zipfile
+from io import BytesIO
+
+import pytest
+
+pytest.importorskip('aiobotocore')
+moto_server = pytest.importorskip('moto.server')
+
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+os.environ.setdefault('S3_BUCKET_NAME', 'test-bucket')
+os.environ.setdefault('S3_HEALTH_PROBE_INTERVAL', '0')
+os.environ.setdefault('METADATA_WORKERS', '0')
+os.environ.setdefault('INDEX_DB_PATH', os.path.join(tempfile.mkdtemp(), 'image_index.db'))
+
+import boto3
+
+from app import app, s3_breaker
+from async_app import AsyncImageApp
+
+
+class Response:
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+    
+    def json(self):
+        return json.loads(self.body)
+
+
+def call(asgi, method, path, query='', headers=None, body=b''):
+    """Run one request through an ASGI app and collect the response"""
+    scope = {
+        'type': 'http',
+        'method': method,
+        'path': path,
+        'query_string': query.encode('latin-1'),
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in (headers or {}).items()],
+        'server': ('testserver', 80),
+        'client': ('127.0.0.1', 12345),
+        'scheme': 'http',
+        'http_version': '1.1',
+    }
+    # Delivered in two pieces, like a real server would
+    pieces = [body[:len(body) // 2], body[len(body) // 2:]]
+    
+    async def receive():
+        piece = pieces.pop(0) if pieces else b''
+        return {'type': 'http.request', 'body': piece, 'more_body': bool(pieces)}
+    
+    messages = []
+    
+    async def send(message):
+        messages.append(message)
+    
+    async def run():
+        try:
+            await asgi(scope, receive, send)
+        finally:
+            await asgi.s3.close()
+    
+    asyncio.run(run())
+    start = messages[0]
+    headers = {name.decode('latin-1'): value.decode('latin-1') for name, value in start['headers']}
+    return Response(start['status'], headers, b''.join(message.get('body', b'') for message in messages[1:]))
+
+
+def multipart(filename, data, content_type='image/jpeg'):
+    boundary = 'test-boundary'
+    body = (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="note"\r\n\r\nhello\r\n'
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f'Content-Type: {content_type}\r\n\r\n'
+    ).encode('latin-1') + data + f'\r\n--{boundary}--\r\n'.encode('latin-1')
+    return body, {'Content-Type': f'multipart/form-data; boundary={boundary}', 'Content-Length': str(len(body))}
+
+
+@pytest.fixture(scope='module')
+def endpoint():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    server = moto_server.ThreadedMotoServer(ip_address='127.0.0.1', port=port, verbose=False)
+    server.start()
+    yield f'http://127.0.0.1:{port}'
+    server.stop()
+
+
+@pytest.fixture
+def asgi(endpoint, monkeypatch):
+    monkeypatch.setitem(app.config, 'S3_ENDPOINT_URL', endpoint)
+    monkeypatch.setitem(app.config, 'STORAGE_BACKEND', 's3')
+    s3_breaker.reset()
+    return AsyncImageApp(app)
+
+
+@pytest.fixture
+def bucket(endpoint):
+    s3 = boto3.client('s3', region_name='us-east-1', endpoint_url=endpoint)
+    s3.create_bucket(Bucket='test-bucket')
+    yield s3
+    for obj in s3.list_objects_v2(Bucket='test-bucket').get('Contents', []):
+        s3.delete_object(Bucket='test-bucket', Key=obj['Key'])
+    s3.delete_bucket(Bucket='test-bucket')
+
+
+class TestAsyncRoutes:
+    """Tests for the routes answered on the event loop"""
+    
+    def test_list_images(self, asgi, bucket):
+        bucket.put_object(Bucket='test-bucket', Key='a.jpg', Body=b'a')
+        bucket.put_object(Bucket='test-bucket', Key='notes.txt', Body=b'n')
+        
+        response = call(asgi, 'GET', '/api/images')
+        assert response.status == 200
+        assert [image['key'] for image in response.json()['images']] == ['a.jpg']
+        assert 'storage;dur=' in response.headers['server-timing']
+    
+    def test_serve_image_and_revalidate(self, asgi, bucket):
+        bucket.put_object(Bucket='test-bucket', Key='a.jpg', Body=b'image-bytes', ContentType='image/jpeg')
+        
+        response = call(asgi, 'GET', '/image/a.jpg')
+        assert response.status == 200
+        assert response.body == b'image-bytes'
+        assert response.headers['content-type'] == 'image/jpeg'
+        assert response.headers['cache-control'] == 'no-cache'
+        
+        revalidated = call(asgi, 'GET', '/image/a.jpg', headers={'If-None-Match': response.headers['etag']})
+        assert revalidated.status == 304
+        assert call(asgi, 'GET', '/image/missing.jpg').status == 404
+    
+    def test_serve_image_from_disk_cache(self, asgi, bucket, tmp_path, monkeypatch):
+        """Test that the image route fills and then answers from the same disk cache as the Flask route"""
+        from app import get_image_cache
+        monkeypatch.setitem(app.config, 'IMAGE_CACHE_DIR', str(tmp_path))
+        key = 'a1b2c3d4e5f6a7b8c9d0e1f2a3b4c5d6_20240101_120000.jpg'
+        bucket.put_object(Bucket='test-bucket', Key=key, Body=b'image-bytes', ContentType='image/jpeg')
+        
+        response = call(asgi, 'GET', f'/image/{key}')
+        assert response.status == 200
+        assert response.body == b'image-bytes'
+        assert get_image_cache().get(key) is not None
+        
+        bucket.delete_object(Bucket='test-bucket', Key=key)
+        cached = call(asgi, 'GET', f'/image/{key}')
+        assert cached.status == 200
+        assert cached.body == b'image-bytes'
+        assert cached.headers['content-type'] == 'image/jpeg'
+        assert cached.headers['etag'] == response.headers['etag']
+        assert 'immutable' in cached.headers['cache-control']
+    
+    def test_upload_and_deduplicate(self, asgi, bucket):
+        body, headers = multipart('photo.jpg', b'\xff\xd8 some jpeg bytes')
+        
+        response = call(asgi, 'POST', '/api/upload', headers=headers, body=body)
+        assert response.status == 200
+        uploaded = response.json()
+        assert uploaded['duplicate'] is False
+        stored = bucket.get_object(Bucket='test-bucket', Key=uploaded['filename'])
+        assert stored['Body'].read() == b'\xff\xd8 some jpeg bytes'
+        assert stored['ContentType'] == 'image/jpeg'
+        
+        again = call(asgi, 'POST', '/api/upload', headers=headers, body=body)
+        assert again.json() == dict(uploaded, duplicate=True)
+    
+    def test_upload_validation(self, asgi, bucket):
+        body, headers = multipart('notes.txt', b'text', 'text/plain')
+        assert call(asgi, 'POST', '/api/upload', headers=headers, body=body).status == 400
+        
+        body, headers = multipart('big.jpg', b'x' * (app.config['MAX_CONTENT_LENGTH'] + 1))
+        assert call(asgi, 'POST', '/api/upload', headers=headers, body=body).status == 413
+
+
+class TestFlaskFallback:
+    """Tests for requests handed to the Flask app"""
+    
+    def test_other_routes_reach_flask(self, asgi):
+        response = call(asgi, 'GET', '/health')
+        assert response.status == 200
+        assert response.json()['status'] == 'healthy'
+    
+    def test_streamed_flask_response(self, asgi, bucket):
+        bucket.put_object(Bucket='test-bucket', Key='a.jpg', Body=b'a')
+        
+        response = call(asgi, 'GET', '/api/download/zip', query='key=a.jpg')
+        assert response.status == 200
+        assert zipfile.ZipFile(BytesIO(response.body)).read('a.jpg') == b'a'
+    
+    def test_variants_are_left_to_flask(self, asgi):
+        assert asgi.route({'method': 'GET', 'path': '/image/a.jpg', 'query_string': b'w=320', 'headers': []}) is None
+        accept_webp = [(b'accept', b'image/webp,*/*')]
+        assert asgi.route({'method': 'GET', 'path': '/image/a.jpg', 'query_string': b'', 'headers': accept_webp}) is None
+        assert asgi.route({'method': 'GET', 'path': '/image/a.jpg', 'query_string': b'', 'headers': []}) is not None
+        assert asgi.route({'method': 'GET', 'path': '/api/images', 'query_string': b'prefix=a', 'headers': []}) is None
@@ -0,0 +1,120 @@
+"""
+Unit tests for the S3 circuit breaker and health prober
+"""
+import pytest
+
+from circuit_breaker import CircuitBreaker, CircuitOpenError, HealthProber
+
+
+class FakeClock:
+    """Manually advanced replacement for time.monotonic"""
+    
+    def __init__(self):
+        self.now = 0.0
+    
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def breaker(clock):
+    return CircuitBreaker(failure_threshold=0.5, window_size=10, min_calls=4, reset_timeout=30, clock=clock)
+
+
+class TestCircuitBreaker:
+    """Tests for CircuitBreaker"""
+    
+    def test_stays_closed_below_min_calls(self, breaker):
+        """Test that a few failures do not open the circuit before min_calls"""
+        for _ in range(3):
+            breaker.record_failure()
+        assert breaker.state == CircuitBreaker.CLOSED
+        assert breaker.allow_request() is True
+    
+    def test_opens_at_failure_rate(self, breaker):
+        """Test that the circuit opens once the failure rate reaches the threshold"""
+        breaker.record_success()
+        breaker.record_success()
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.CLOSED
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.OPEN
+        assert breaker.allow_request() is False
+    
+    def test_half_open_allows_single_trial(self, breaker, clock):
+        """Test that after reset_timeout only one trial call is let through"""
+        for _ in range(4):
+            breaker.record_failure()
+        clock.now += 30
+        
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        assert breaker.allow_request() is True
+        assert breaker.allow_request() is False
+    
+    def test_trial_success_closes(self, breaker, clock):
+        """Test that a successful trial closes the circuit"""
+        for _ in range(4):
+            breaker.record_failure()
+        clock.now += 30
+        breaker.allow_request()
+        breaker.record_success()
+        
+        assert breaker.state == CircuitBreaker.CLOSED
+        assert breaker.allow_request() is True
+    
+    def test_trial_failure_reopens(self, breaker, clock):
+        """Test that a failed trial opens the circuit for another reset_timeout"""
+        for _ in range(4):
+            breaker.record_failure()
+        clock.now += 30
+        breaker.allow_request()
+        breaker.record_failure()
+        
+        assert breaker.state == CircuitBreaker.OPEN
+        clock.now += 29
+        assert breaker.allow_request() is False
+    
+    def test_hooks_refuse_calls_while_open(self, breaker):
+        """Test that the before-call hook raises instead of calling S3"""
+        for _ in range(4):
+            breaker.record_failure()
+        with pytest.raises(CircuitOpenError):
+            breaker._before_call()
+    
+    def test_hooks_count_only_server_errors(self, breaker):
+        """Test that 4xx responses count as S3 being available"""
+        class Response:
+            def __init__(self, status_code):
+                self.status_code = status_code
+        
+        for _ in range(4):
+            breaker._after_call(http_response=Response(404))
+        assert breaker.state == CircuitBreaker.CLOSED
+        for _ in range(4):
+            breaker._after_call(http_response=Response(503))
+        assert breaker.state == CircuitBreaker.OPEN
+
+
+class TestHealthProber:
+    """Tests for HealthProber"""
+    
+    def test_probe_records_healthy(self):
+        """Test that a passing check is stored as healthy"""
+        prober = HealthProber(lambda: None, 10)
+        result = prober.probe()
+        assert result['status'] == 'healthy'
+        assert prober.last_result is result
+    
+    def test_probe_records_error(self):
+        """Test that a failing check is stored with its error"""
+        def check():
+            raise IOError('timed out')
+        
+        result = HealthProber(check, 10).probe()
+        assert result['status'] == 'unhealthy'
+        assert result['error'] == 'timed out'
@@ -0,0 +1,120 @@
+"""
+Unit tests for the on-disk image cache
+"""
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from io import BytesIO
+
+import pytest
+
+from image_cache import DiskCache
+
+LAST_MODIFIED = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def put(cache, key, etag='etag', body=b'x' * 10):
+    return cache.put(key, etag, BytesIO(body), 'image/jpeg', LAST_MODIFIED)
+
+
+class TestDiskCache:
+    """Tests for DiskCache"""
+    
+    def test_put_and_get(self, tmp_path):
+        """Test that a stored image is returned with its metadata"""
+        cache = DiskCache(str(tmp_path), 1024)
+        put(cache, 'a.jpg', body=b'image bytes')
+        
+        entry = cache.get('a.jpg')
+        assert entry.etag == 'etag'
+        assert entry.content_type == 'image/jpeg'
+        assert entry.last_modified == LAST_MODIFIED
+        with open(entry.path, 'rb') as f:
+            assert f.read() == b'image bytes'
+    
+    def test_get_with_other_etag_misses(self, tmp_path):
+        """Test that a different version of a key is not served from cache"""
+        cache = DiskCache(str(tmp_path), 1024)
+        put(cache, 'a.jpg', etag='v1')
+        
+        assert cache.get('a.jpg', 'v1') is not None
+        assert cache.get('a.jpg', 'v2') is None
+    
+    def test_evicts_least_recently_used(self, tmp_path):
+        """Test that the byte cap evicts the least recently used entry"""
+        cache = DiskCache(str(tmp_path), 25)
+        put(cache, 'a.jpg')
+        put(cache, 'b.jpg')
+        cache.get('a.jpg')
+        put(cache, 'c.jpg')
+        
+        assert cache.get('b.jpg') is None
+        assert cache.get('a.jpg') is not None
+        assert cache.get('c.jpg') is not None
+        assert cache.total_bytes == 20
+    
+    def test_new_version_replaces_old(self, tmp_path):
+        """Test that storing a new ETag removes the previous file"""
+        cache = DiskCache(str(tmp_path), 1024)
+        old = put(cache, 'a.jpg', etag='v1')
+        put(cache, 'a.jpg', etag='v2')
+        
+        assert cache.get('a.jpg').etag == 'v2'
+        assert cache.total_bytes == 10
+        assert not os.path.exists(old.path)
+    
+    def test_discard(self, tmp_path):
+        """Test that discarded keys are removed from disk and index"""
+        cache = DiskCache(str(tmp_path), 1024)
+        entry = put(cache, 'a.jpg')
+        cache.discard('a.jpg')
+        
+        assert cache.get('a.jpg') is None
+        assert cache.total_bytes == 0
+        assert list(tmp_path.iterdir()) == []
+        assert not os.path.exists(entry.path)
+    
+    def test_reloads_index_from_disk(self, tmp_path):
+        """Test that a new instance picks up files left by a previous one"""
+        put(DiskCache(str(tmp_path), 1024), 'a.jpg')
+        
+        cache = DiskCache(str(tmp_path), 1024)
+        assert cache.get('a.jpg', 'etag').last_modified == LAST_MODIFIED
+        assert cache.total_bytes == 10
+    
+    def test_concurrent_misses_fetch_once(self, tmp_path):
+        """Test that concurrent misses for one key share a single fetch"""
+        cache = DiskCache(str(tmp_path), 1024)
+        calls = []
+        
+        def fetch():
+            calls.append(1)
+            time.sleep(0.2)
+            return {'body': BytesIO(b'image'), 'etag': 'etag',
+                    'content_type': 'image/png', 'last_modified': LAST_MODIFIED}
+        
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(cache.get_or_fetch('a.png', None, fetch)))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        assert len(calls) == 1
+        assert len(results) == 5
+        assert {entry.path for entry in results} == {results[0].path}
+    
+    def test_fetch_error_reaches_waiters(self, tmp_path):
+        """Test that a failed fetch raises and leaves nothing cached"""
+        cache = DiskCache(str(tmp_path), 1024)
+        
+        def fetch():
+            raise IOError('S3 unavailable')
+        
+        with pytest.raises(IOError):
+            cache.get_or_fetch('a.jpg', None, fetch)
+        assert cache.get('a.jpg') is None
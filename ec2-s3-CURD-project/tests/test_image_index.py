@@ -0,0 +1,103 @@
+"""
+Unit tests for the local SQLite image index
+"""
+import time
+
+import pytest
+
+from image_index import ImageIndex
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = ImageIndex(str(tmp_path / 'images.db'))
+    index.add_images([
+        {'key': '2024/a.jpg', 'size': 300, 'last_modified': '2024-01-03T00:00:00+00:00', 'content_type': 'image/jpeg'},
+        {'key': '2024/b.png', 'size': 100, 'last_modified': '2024-01-01T00:00:00+00:00', 'content_type': 'image/png'},
+        {'key': '2024/c.jpg', 'size': 200, 'last_modified': '2024-01-02T00:00:00+00:00', 'content_type': 'image/jpeg'},
+        {'key': '2025/d.jpg', 'size': 200, 'last_modified': '2025-01-01T00:00:00+00:00', 'content_type': 'image/jpeg'},
+    ])
+    return index
+
+
+def keys(result):
+    return [image['key'] for image in result[0]]
+
+
+class TestHashes:
+    """Tests for the content hash table"""
+    
+    def test_first_key_wins(self, tmp_path):
+        """Test that a hash keeps pointing at the first key recorded"""
+        index = ImageIndex(str(tmp_path / 'images.db'))
+        index.add_hash('abc', 'first.jpg')
+        index.add_hash('abc', 'second.jpg')
+        assert index.find_by_hash('abc') == 'first.jpg'
+        
+        index.remove_keys(['first.jpg'])
+        assert index.find_by_hash('abc') is None
+
+
+class TestSearch:
+    """Tests for ImageIndex.search"""
+    
+    def test_default_sort_is_key(self, index):
+        assert keys(index.search()) == ['2024/a.jpg', '2024/b.png', '2024/c.jpg', '2025/d.jpg']
+    
+    def test_prefix(self, index):
+        assert keys(index.search(prefix='2025/')) == ['2025/d.jpg']
+    
+    def test_size_range(self, index):
+        assert keys(index.search(min_size=150, max_size=250)) == ['2024/c.jpg', '2025/d.jpg']
+    
+    def test_date_range(self, index):
+        result = index.search(modified_after='2024-01-02T00:00:00+00:00', modified_before='2025-01-01T00:00:00+00:00')
+        assert keys(result) == ['2024/a.jpg', '2024/c.jpg']
+    
+    def test_content_type(self, index):
+        assert keys(index.search(content_type='image/png')) == ['2024/b.png']
+    
+    def test_sort_by_size_descending(self, index):
+        result = index.search(sort='size', descending=True)
+        assert keys(result) == ['2024/a.jpg', '2025/d.jpg', '2024/c.jpg', '2024/b.png']
+    
+    def test_cursor_pagination(self, index):
+        """Test that following cursors walks every row once, ties broken by key"""
+        seen = []
+        cursor = None
+        while True:
+            images, cursor = index.search(sort='size', limit=1, cursor=cursor)
+            seen.extend(image['key'] for image in images)
+            if cursor is None:
+                break
+        assert seen == ['2024/b.png', '2024/c.jpg', '2025/d.jpg', '2024/a.jpg']
+    
+    def test_invalid_sort(self, index):
+        with pytest.raises(ValueError):
+            index.search(sort='content_type')
+    
+    def test_invalid_cursor(self, index):
+        with pytest.raises(ValueError):
+            index.search(cursor='not-a-cursor')
+    
+    def test_search_uses_index(self, index):
+        """Test that filtered, sorted queries are answered from an index, not a table scan"""
+        plan = index._connect().execute(
+            'EXPLAIN QUERY PLAN SELECT key FROM images WHERE size >= 100 ORDER BY size, key LIMIT 10'
+        ).fetchall()
+        assert any('images_size' in row[3] for row in plan)
+
+
+class TestPrune:
+    """Tests for ImageIndex.prune_images"""
+    
+    def test_prunes_unlisted_records(self, index):
+        """Test that records missing from a sync are removed, newer records are kept"""
+        started = time.time()
+        index.add_images([
+            {'key': 'new.jpg', 'size': 1, 'last_modified': '2025-02-01T00:00:00+00:00', 'content_type': 'image/jpeg'}
+        ])
+        pruned = index.prune_images(['2024/a.jpg'], started)
+        
+        assert pruned == 3
+        assert keys(index.search()) == ['2024/a.jpg', 'new.jpg']
@@ -0,0 +1,59 @@
+"""
+Unit tests for image metadata extraction
+"""
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from image_metadata import UnreadableImage, extract_metadata, hamming_distance, perceptual_hash
+
+
+def gradient(size=(64, 48), reverse=False):
+    image = Image.new('L', size)
+    image.putdata([(255 - x * 4 if reverse else x * 4) % 256 for y in range(size[1]) for x in range(size[0])])
+    return image.convert('RGB')
+
+
+class TestExtractMetadata:
+    """Tests for extract_metadata"""
+    
+    def test_dimensions_exif_and_color(self):
+        exif = Image.Exif()
+        exif[0x010f] = 'Canon'
+        exif[0x0112] = 6  # Rotated 90 degrees
+        buffer = BytesIO()
+        Image.new('RGB', (300, 200), (0, 128, 0)).save(buffer, 'JPEG', exif=exif)
+        buffer.seek(0)
+        
+        metadata = extract_metadata(buffer)
+        assert (metadata['width'], metadata['height']) == (200, 300)
+        assert metadata['format'] == 'JPEG'
+        assert metadata['exif']['Make'] == 'Canon'
+        assert metadata['dominant_color'].startswith('#00')
+        assert len(metadata['phash']) == 16
+    
+    def test_unreadable_file(self):
+        with pytest.raises(UnreadableImage):
+            extract_metadata(BytesIO(b'not an image'))
+    
+    def test_decompression_bomb_is_unreadable(self, monkeypatch):
+        """Test that an image over Pillow's pixel limit fails without a retry"""
+        buffer = BytesIO()
+        Image.new('RGB', (100, 100)).save(buffer, 'PNG')
+        buffer.seek(0)
+        monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', 1000)
+        with pytest.raises(UnreadableImage):
+            extract_metadata(buffer)
+
+
+class TestPerceptualHash:
+    """Tests for the difference hash"""
+    
+    def test_similar_images_have_close_hashes(self):
+        original = gradient()
+        resized = original.resize((128, 96))
+        assert hamming_distance(perceptual_hash(original), perceptual_hash(resized)) <= 4
+    
+    def test_different_images_have_distant_hashes(self):
+        assert hamming_distance(perceptual_hash(gradient()), perceptual_hash(gradient(reverse=True))) > 32
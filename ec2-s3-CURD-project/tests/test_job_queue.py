@@ -0,0 +1,138 @@
+"""
+Unit tests for the SQLite job queue
+"""
+import pytest
+
+from job_queue import FAILED, PENDING, RUNNING, JobQueue, JobWorker, PermanentJobError
+
+
+class FakeClock:
+    """Manually advanced replacement for time.time"""
+    
+    def __init__(self):
+        self.now = 1000.0
+    
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def queue(tmp_path, clock):
+    return JobQueue(str(tmp_path / 'jobs.db'), lease=60, clock=clock)
+
+
+class TestJobQueue:
+    """Tests for JobQueue"""
+    
+    def test_claim_in_order_and_complete(self, queue):
+        queue.enqueue('metadata', 'a.jpg')
+        queue.enqueue('metadata', 'b.jpg')
+        
+        job = queue.claim()
+        assert (job['key'], job['attempts']) == ('a.jpg', 1)
+        assert queue.get('metadata', 'a.jpg')['status'] == RUNNING
+        assert queue.claim()['key'] == 'b.jpg'
+        assert queue.claim() is None
+        
+        queue.complete(job)
+        assert queue.get('metadata', 'a.jpg') is None
+    
+    def test_enqueue_twice_keeps_one_job(self, queue):
+        queue.enqueue('metadata', 'a.jpg')
+        queue.enqueue('metadata', 'a.jpg')
+        assert queue.counts() == {PENDING: 1}
+    
+    def test_retry_waits_for_delay(self, queue, clock):
+        queue.enqueue('metadata', 'a.jpg')
+        job = queue.claim()
+        queue.fail(job, 'boom', retry_in=30)
+        
+        assert queue.claim() is None
+        clock.now += 30
+        retried = queue.claim()
+        assert retried['attempts'] == 2
+    
+    def test_expired_lease_is_reclaimed(self, queue, clock):
+        """Test that jobs held by a process that died run again"""
+        queue.enqueue('metadata', 'a.jpg')
+        queue.claim()
+        assert queue.claim() is None
+        clock.now += 61
+        assert queue.claim()['key'] == 'a.jpg'
+    
+    def test_requeued_while_running_runs_again(self, queue):
+        """Test that a job queued again while it runs is not removed when the first run ends"""
+        queue.enqueue('metadata', 'a.jpg')
+        job = queue.claim()
+        queue.enqueue('metadata', 'a.jpg')
+        queue.complete(job)
+        assert queue.get('metadata', 'a.jpg')['status'] == PENDING
+        queue.fail(job, 'boom')
+        assert queue.get('metadata', 'a.jpg')['status'] == PENDING
+        assert queue.claim()['key'] == 'a.jpg'
+    
+    def test_reclaimed_job_is_left_to_its_new_lease(self, queue, clock):
+        """Test that a worker whose lease ran out does not complete the job for the one that reclaimed it"""
+        queue.enqueue('metadata', 'a.jpg')
+        stale = queue.claim()
+        clock.now += 61
+        job = queue.claim()
+        queue.complete(stale)
+        assert queue.get('metadata', 'a.jpg')['status'] == RUNNING
+        queue.complete(job)
+        assert queue.get('metadata', 'a.jpg') is None
+    
+    def test_jobs_survive_reopening(self, tmp_path, clock):
+        path = str(tmp_path / 'jobs.db')
+        JobQueue(path, clock=clock).enqueue('metadata', 'a.jpg')
+        assert JobQueue(path, clock=clock).claim()['key'] == 'a.jpg'
+
+
+class TestJobWorker:
+    """Tests for JobWorker"""
+    
+    def test_runs_handlers_and_retries(self, queue, clock):
+        calls = []
+        
+        def handler(key):
+            calls.append(key)
+            if len(calls) == 1:
+                raise IOError('temporary')
+        
+        worker = JobWorker(queue, {'metadata': handler}, workers=0, max_attempts=3, retry_delay=10)
+        queue.enqueue('metadata', 'a.jpg')
+        
+        assert worker.run_pending() == 1
+        assert queue.get('metadata', 'a.jpg')['error'] == 'OSError: temporary'
+        clock.now += 10
+        assert worker.run_pending() == 1
+        assert calls == ['a.jpg', 'a.jpg']
+        assert queue.counts() == {}
+    
+    def test_gives_up_after_max_attempts(self, queue, clock):
+        def handler(key):
+            raise IOError('down')
+        
+        worker = JobWorker(queue, {'metadata': handler}, workers=0, max_attempts=2, retry_delay=1)
+        queue.enqueue('metadata', 'a.jpg')
+        worker.run_pending()
+        clock.now += 1
+        worker.run_pending()
+        clock.now += 100
+        assert worker.run_pending() == 0
+        assert queue.get('metadata', 'a.jpg')['status'] == FAILED
+    
+    def test_permanent_errors_are_not_retried(self, queue):
+        def handler(key):
+            raise PermanentJobError('gone')
+        
+        worker = JobWorker(queue, {'metadata': handler}, workers=0, max_attempts=5)
+        queue.enqueue('metadata', 'a.jpg')
+        worker.run_pending()
+        job = queue.get('metadata', 'a.jpg')
+        assert (job['status'], job['attempts']) == (FAILED, 1)
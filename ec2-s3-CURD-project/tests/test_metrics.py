@@ -0,0 +1,99 @@
+"""
+Unit tests for request and S3 metrics
+"""
+import boto3
+import pytest
+from botocore.config import Config as BotoConfig
+from botocore.exceptions import EndpointConnectionError
+from moto import mock_aws
+
+from metrics import Counter, Gauge, Histogram, Registry, RequestTimings, S3Instrumentation, current_timings
+
+
+class TestMetrics:
+    """Tests for the metric types and text rendering"""
+    
+    def test_counter_and_gauge(self):
+        registry = Registry()
+        counter = registry.register(Counter('jobs_total', 'Jobs run', ['kind']))
+        gauge = registry.register(Gauge('jobs_running', 'Jobs running'))
+        counter.inc(kind='a')
+        counter.inc(2, kind='a')
+        gauge.inc()
+        gauge.inc()
+        gauge.dec()
+        
+        text = registry.render()
+        assert '# TYPE jobs_total counter' in text
+        assert 'jobs_total{kind="a"} 3' in text
+        assert 'jobs_running 1' in text
+    
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram('latency_seconds', 'Latency', ['route'], buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 5.0):
+            histogram.observe(value, route='/x')
+        
+        lines = histogram.render()
+        assert 'latency_seconds_bucket{route="/x",le="0.1"} 1' in lines
+        assert 'latency_seconds_bucket{route="/x",le="1"} 3' in lines
+        assert 'latency_seconds_bucket{route="/x",le="+Inf"} 4' in lines
+        assert 'latency_seconds_count{route="/x"} 4' in lines
+        assert 'latency_seconds_sum{route="/x"} 6.05' in lines
+    
+    def test_labels_must_match(self):
+        counter = Counter('jobs_total', 'Jobs run', ['kind'])
+        with pytest.raises(ValueError):
+            counter.inc(other='a')
+    
+    def test_label_values_are_escaped(self):
+        counter = Counter('jobs_total', 'Jobs run', ['kind'])
+        counter.inc(kind='say "hi"\n')
+        assert 'jobs_total{kind="say \\"hi\\"\\n"} 1' in counter.render()
+
+
+class TestS3Instrumentation:
+    """Tests for the botocore event hooks"""
+    
+    @mock_aws
+    def test_counts_operations_and_outcomes(self):
+        instrumentation = S3Instrumentation(Registry())
+        s3 = instrumentation.attach(boto3.client('s3', region_name='us-east-1'))
+        s3.create_bucket(Bucket='bucket')
+        s3.put_object(Bucket='bucket', Key='a.jpg', Body=b'a')
+        with pytest.raises(Exception):
+            s3.head_object(Bucket='bucket', Key='missing.jpg')
+        
+        assert instrumentation.requests.value(operation='PutObject', outcome='success') == 1
+        assert instrumentation.requests.value(operation='HeadObject', outcome='error') == 1
+        assert instrumentation.duration.count(operation='PutObject') == 1
+    
+    def test_counts_retries_and_connection_errors(self):
+        instrumentation = S3Instrumentation(Registry())
+        s3 = instrumentation.attach(boto3.client(
+            's3',
+            region_name='us-east-1',
+            endpoint_url='http://127.0.0.1:1',
+            aws_access_key_id='testing',
+            aws_secret_access_key='testing',
+            config=BotoConfig(connect_timeout=1, retries={'total_max_attempts': 3, 'mode': 'standard'})
+        ))
+        with pytest.raises(EndpointConnectionError):
+            s3.head_bucket(Bucket='bucket')
+        
+        assert instrumentation.requests.value(operation='HeadBucket', outcome='exception') == 1
+        assert instrumentation.retries.value(operation='HeadBucket') == 2
+    
+    @mock_aws
+    def test_attributes_time_to_current_request(self):
+        instrumentation = S3Instrumentation(Registry())
+        s3 = instrumentation.attach(boto3.client('s3', region_name='us-east-1'))
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        try:
+            s3.create_bucket(Bucket='bucket')
+            s3.list_objects_v2(Bucket='bucket')
+        finally:
+            current_timings.reset(token)
+        
+        assert timings.s3_calls == 2
+        assert timings.s3_seconds > 0
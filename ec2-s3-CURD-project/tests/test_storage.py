@@ -0,0 +1,115 @@
+"""
+Unit tests for the storage backends
+"""
+import hashlib
+from io import BytesIO
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from storage import LocalStorage, ObjectNotFound, S3Storage
+
+
+@pytest.fixture
+def local(tmp_path):
+    return LocalStorage(str(tmp_path / 'storage'))
+
+
+@pytest.fixture
+def s3():
+    with mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket='test-bucket')
+        yield S3Storage(client, 'test-bucket')
+
+
+@pytest.fixture(params=['local', 's3'])
+def storage(request):
+    """Run the shared behaviour tests against every backend"""
+    return request.getfixturevalue(request.param)
+
+
+class TestStorageBackends:
+    """Behaviour every backend must share"""
+    
+    def test_put_and_head(self, storage):
+        storage.put('a.jpg', BytesIO(b'image'), 'image/jpeg', {'original_filename': 'photo.jpg'})
+        
+        info = storage.head('a.jpg')
+        assert info.key == 'a.jpg'
+        assert info.size == 5
+        assert info.content_type == 'image/jpeg'
+        assert info.etag == hashlib.md5(b'image').hexdigest()
+        assert info.last_modified.tzinfo is not None
+    
+    def test_open_and_stream(self, storage):
+        storage.put('a.jpg', BytesIO(b'image bytes'), 'image/jpeg')
+        
+        info, body = storage.open('a.jpg')
+        with body:
+            assert body.read() == b'image bytes'
+        
+        info, chunks = storage.stream('a.jpg', chunk_size=4)
+        assert b''.join(chunks) == b'image bytes'
+    
+    def test_list_in_key_order(self, storage):
+        for key in ['b/2.jpg', 'a.jpg', 'b/1.jpg', 'c.png']:
+            storage.put(key, BytesIO(b'x'), 'image/jpeg')
+        
+        assert [info.key for info in storage.list()] == ['a.jpg', 'b/1.jpg', 'b/2.jpg', 'c.png']
+        assert [info.key for info in storage.list('b/')] == ['b/1.jpg', 'b/2.jpg']
+    
+    def test_missing_key(self, storage):
+        with pytest.raises(ObjectNotFound):
+            storage.head('missing.jpg')
+        with pytest.raises(ObjectNotFound):
+            storage.open('missing.jpg')
+        assert storage.exists('missing.jpg') is False
+    
+    def test_delete(self, storage):
+        storage.put('a.jpg', BytesIO(b'x'), 'image/jpeg')
+        storage.delete('a.jpg')
+        storage.delete('a.jpg')
+        
+        assert storage.exists('a.jpg') is False
+        assert list(storage.list()) == []
+    
+    def test_delete_many(self, storage):
+        for key in ['a.jpg', 'b.jpg', 'c.jpg']:
+            storage.put(key, BytesIO(b'x'), 'image/jpeg')
+        
+        assert storage.delete_many(['a.jpg', 'b.jpg']) == []
+        assert [info.key for info in storage.list()] == ['c.jpg']
+    
+    def test_check(self, storage):
+        storage.check()
+
+
+class TestLocalStorage:
+    """Tests specific to the filesystem backend"""
+    
+    def test_local_path_points_at_file(self, local):
+        local.put('dir/a.jpg', BytesIO(b'image'), 'image/jpeg')
+        with open(local.local_path('dir/a.jpg'), 'rb') as f:
+            assert f.read() == b'image'
+    
+    def test_rejects_keys_outside_root(self, local):
+        for key in ['../escape.jpg', '/etc/passwd', 'a/../../escape.jpg', '.meta/a.jpg.json']:
+            with pytest.raises(ObjectNotFound):
+                local.head(key)
+    
+    def test_overwrite_is_atomic(self, local, tmp_path):
+        local.put('a.jpg', BytesIO(b'old'), 'image/jpeg')
+        local.put('a.jpg', BytesIO(b'new'), 'image/png')
+        
+        info, body = local.open('a.jpg')
+        with body:
+            assert body.read() == b'new'
+        assert info.content_type == 'image/png'
+        # No temp files left next to the object
+        assert sorted(p.name for p in (tmp_path / 'storage').iterdir()) == ['.meta', 'a.jpg']
+    
+    def test_presigned_post_unsupported(self, local):
+        with pytest.raises(NotImplementedError):
+            local.presigned_post('a.jpg', {}, [], 60)
@@ -0,0 +1,99 @@
+"""
+Unit tests for image variant negotiation and transcoding
+"""
+from io import BytesIO
+
+import pytest
+from PIL import Image
+from werkzeug.datastructures import MIMEAccept
+
+from transcode import NotTranscodable, Variant, choose_variant, transcode, variant_suffix
+
+WIDTHS = [320, 640, 1024]
+
+
+def make_image(size=(800, 600), mode='RGB', fmt='JPEG', color='red'):
+    buffer = BytesIO()
+    Image.new(mode, size, color).save(buffer, fmt)
+    buffer.seek(0)
+    return buffer
+
+
+class TestChooseVariant:
+    """Tests for choose_variant"""
+    
+    def test_prefers_avif_then_webp(self):
+        accept = MIMEAccept([('image/avif', 1), ('image/webp', 1), ('*/*', 0.8)])
+        assert choose_variant(accept, 'image/jpeg', None, WIDTHS) == Variant('image/avif', None)
+        
+        accept = MIMEAccept([('image/webp', 1), ('*/*', 0.8)])
+        assert choose_variant(accept, 'image/jpeg', None, WIDTHS) == Variant('image/webp', None)
+    
+    def test_wildcard_keeps_original(self):
+        assert choose_variant(MIMEAccept([('*/*', 1)]), 'image/jpeg', None, WIDTHS) is None
+        assert choose_variant(MIMEAccept(), 'image/png', None, WIDTHS) is None
+    
+    def test_width_rounds_up_to_allowed_width(self):
+        accept = MIMEAccept([('*/*', 1)])
+        assert choose_variant(accept, 'image/jpeg', 500, WIDTHS) == Variant('image/jpeg', 640)
+        assert choose_variant(accept, 'image/jpeg', 5000, WIDTHS) == Variant('image/jpeg', 1024)
+        assert choose_variant(accept, 'image/bmp', 320, WIDTHS) == Variant('image/png', 320)
+        assert choose_variant(accept, 'image/gif', 320, WIDTHS) == Variant('image/png', 320)
+    
+    def test_unsupported_sources_are_served_as_stored(self):
+        accept = MIMEAccept([('image/webp', 1)])
+        assert choose_variant(accept, 'image/svg+xml', 320, WIDTHS) is None
+        assert choose_variant(accept, None, 320, WIDTHS) is None
+    
+    def test_variant_suffix(self):
+        assert variant_suffix(Variant('image/webp', 640)) == '640.webp'
+        assert variant_suffix(Variant('image/avif', None)) == 'full.avif'
+
+
+class TestTranscode:
+    """Tests for transcode"""
+    
+    @pytest.mark.parametrize('content_type,pil_format', [
+        ('image/webp', 'WEBP'),
+        ('image/avif', 'AVIF'),
+        ('image/jpeg', 'JPEG'),
+    ])
+    def test_resizes_and_encodes(self, content_type, pil_format):
+        data = transcode(make_image(), Variant(content_type, 320))
+        image = Image.open(BytesIO(data))
+        assert image.format == pil_format
+        assert image.size == (320, 240)
+    
+    def test_never_upscales(self):
+        data = transcode(make_image((200, 100)), Variant('image/webp', 640))
+        assert Image.open(BytesIO(data)).size == (200, 100)
+    
+    def test_keeps_alpha_except_for_jpeg(self):
+        source = make_image(mode='RGBA', fmt='PNG', color=(255, 0, 0, 128))
+        assert Image.open(BytesIO(transcode(source, Variant('image/webp', None)))).mode == 'RGBA'
+        source.seek(0)
+        assert Image.open(BytesIO(transcode(source, Variant('image/jpeg', None)))).mode == 'RGB'
+    
+    def test_animated_and_unreadable_images_are_refused(self):
+        frames = [Image.new('RGB', (10, 10), color) for color in ('red', 'green', 'blue')]
+        animated = BytesIO()
+        frames[0].save(animated, 'GIF', save_all=True, append_images=frames[1:])
+        animated.seek(0)
+        with pytest.raises(NotTranscodable):
+            transcode(animated, Variant('image/webp', None))
+        with pytest.raises(NotTranscodable):
+            transcode(BytesIO(b'not an image'), Variant('image/webp', None))
+    
+    def test_decompression_bombs_are_refused(self, monkeypatch):
+        monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', 1000)
+        with pytest.raises(NotTranscodable):
+            transcode(make_image((100, 100), fmt='PNG'), Variant('image/webp', 64))
+    
+    def test_transparent_gif_resized_to_png_keeps_alpha(self):
+        source = BytesIO()
+        Image.new('P', (100, 100)).save(source, 'GIF', transparency=0)
+        source.seek(0)
+        image = Image.open(BytesIO(transcode(source, Variant('image/png', 50))))
+        assert image.format == 'PNG'
+        assert image.mode == 'RGBA'
+        assert image.getpixel((0, 0))[3] == 0
@@ -0,0 +1,94 @@
+"""
+Derived image variants: format negotiation and resizing
+Picks the best output format from the request's Accept header and a target
+width from ?w=, and transcodes the original with Pillow
+"""
+from collections import namedtuple
+from io import BytesIO
+
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+
+Variant = namedtuple('Variant', ['content_type', 'width'])
+
+# Pillow format name, file extension and encoder options per output type
+OUTPUT_FORMATS = {
+    'image/avif': ('AVIF', 'avif', {'quality': 60}),
+    'image/webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'image/jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+    'image/png': ('PNG', 'png', {'optimize': True}),
+}
+
+# Preferred first; only used when the client names them in Accept
+MODERN_FORMATS = [content_type for content_type, codec in (('image/avif', 'avif'), ('image/webp', 'webp'))
+                  if features.check(codec)]
+
+# Originals of these types can be transcoded; anything else is always served as stored
+SOURCE_TYPES = {'image/jpeg', 'image/png', 'image/webp', 'image/gif', 'image/bmp'}
+
+
+class NotTranscodable(Exception):
+    """Raised for images that have to be served as they are stored"""
+
+
+def choose_variant(accept_mimetypes, content_type, width, widths):
+    """Return the Variant to serve, or None when the original fits the request as it is.
+
+    A modern format is only chosen when the client lists it explicitly, since
+    a */* wildcard says nothing about what it can decode. The width is
+    rounded up to the nearest allowed width, so the number of variants per
+    image stays bounded. A resized GIF or BMP the client cannot take as a
+    modern format becomes PNG, which keeps its transparency.
+    """
+    if content_type not in SOURCE_TYPES:
+        return None
+
+    accepted = {value.lower() for value, quality in accept_mimetypes if quality > 0}
+    output = next((candidate for candidate in MODERN_FORMATS if candidate in accepted), None)
+
+    if width is not None:
+        width = next((allowed for allowed in sorted(widths) if allowed >= width), max(widths))
+
+    if output is None or output == content_type:
+        if width is None:
+            return None
+        output = content_type if content_type in OUTPUT_FORMATS else 'image/png'
+    return Variant(output, width)
+
+
+def variant_suffix(variant):
+    """Stable name for a variant, used in cache keys and ETags"""
+    return f'{variant.width or "full"}.{OUTPUT_FORMATS[variant.content_type][1]}'
+
+
+def transcode(source, variant):
+    """Transcode an image file object to a variant, returns the encoded bytes.
+
+    Raises NotTranscodable for animations, files Pillow cannot read and images
+    over its MAX_IMAGE_PIXELS limit.
+    """
+    try:
+        image = Image.open(source)
+    except UnidentifiedImageError:
+        raise NotTranscodable('Not a readable image')
+    except Image.DecompressionBombError:
+        raise NotTranscodable('Too many pixels to transcode')
+    if getattr(image, 'is_animated', False):
+        raise NotTranscodable('Animated images are served as stored')
+
+    image = ImageOps.exif_transpose(image)
+
+    # Convert before resizing; palette images would otherwise be resampled with nearest neighbour
+    pil_format, _, options = OUTPUT_FORMATS[variant.content_type]
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    if has_alpha and pil_format != 'JPEG':
+        image = image.convert('RGBA')
+    elif image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    if variant.width and image.width > variant.width:
+        height = max(1, round(image.height * variant.width / image.width))
+        image = image.resize((variant.width, height), Image.Resampling.LANCZOS)
+
+    output = BytesIO()
+    image.save(output, pil_format, **options)
+    return output.getvalue()